@@ -0,0 +1,390 @@
+import os
+import json
+import math
+import fcntl
+import logging
+import threading
+import time
+from django.conf import settings
+
+from .telemetry import telemetry_values
+
+logger = logging.getLogger(__name__)
+
+# Default detector parameters; per-detector overrides in settings.ANOMALY_DETECTORS
+DEFAULT_HALFLIFE = 3600       # Samples for the EWMA weight of a sample to halve
+DEFAULT_WARMUP = 600          # Samples per feature before anything is flagged
+DEFAULT_Z_THRESHOLD = 4.0
+DEFAULT_QUANTILES = (0.01, 0.99)
+
+# Seconds between state saves while updating
+DEFAULT_SAVE_SECONDS = 60
+
+# Recent anomaly events kept per hive
+MAX_EVENTS = 50
+
+def _state_path(name):
+    directory = str(getattr(settings, 'ANOMALY_STATE_DIR', os.path.join(settings.BASE_DIR, 'anomaly_state')))
+    return os.path.join(directory, f'{name}.json')
+
+class P2Quantile:
+    """
+    Streaming quantile estimate with the P-square algorithm
+
+    Keeps five markers whose heights track the minimum, p/2, p, (1+p)/2
+    quantiles and the maximum; each update is O(1) and no samples are stored.
+    """
+
+    def __init__(self, p, heights=None, positions=None, desired=None):
+        """
+        :param p: Quantile to track (0-1)
+        """
+        self.p = p
+        self.heights = list(heights or [])
+        self.positions = list(positions or [1, 2, 3, 4, 5])
+        self.desired = list(desired or [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5])
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    @property
+    def count(self):
+        return self.positions[4] if len(self.heights) == 5 else len(self.heights)
+
+    def update(self, x):
+        """
+        Add one observation
+        """
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers toward their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    @property
+    def value(self):
+        """
+        Current quantile estimate, or None before the first observation
+        """
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[min(len(q) - 1, int(round(self.p * (len(q) - 1))))]
+        return q[2]
+
+    def to_dict(self):
+        return {'p': self.p, 'heights': self.heights, 'positions': self.positions, 'desired': self.desired}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['p'], data['heights'], data['positions'], data['desired'])
+
+class FeatureStats:
+    """
+    Exponentially weighted mean/variance plus tail quantiles of one feature
+    """
+
+    def __init__(self, alpha, quantiles, count=0, mean=0.0, variance=0.0, sketches=None):
+        """
+        :param alpha: EWMA weight of the newest sample
+        :param quantiles: (low, high) quantiles bounding normal values
+        """
+        self.alpha = alpha
+        self.count = count
+        self.mean = mean
+        self.variance = variance
+        self.sketches = sketches or [P2Quantile(p) for p in quantiles]
+
+    def score(self, x):
+        """
+        Return the z-score of x against the current mean and variance
+        """
+        std = math.sqrt(self.variance)
+        if std <= 1e-12:
+            return 0.0 if abs(x - self.mean) <= 1e-12 else math.copysign(math.inf, x - self.mean)
+        return (x - self.mean) / std
+
+    def update(self, x):
+        """
+        Add one observation in O(1)
+        """
+        if self.count == 0:
+            self.mean = x
+        else:
+            diff = x - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+        self.count += 1
+        for sketch in self.sketches:
+            sketch.update(x)
+
+    @property
+    def bounds(self):
+        return tuple(sketch.value for sketch in self.sketches)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'variance': self.variance,
+            'sketches': [sketch.to_dict() for sketch in self.sketches]
+        }
+
+    @classmethod
+    def from_dict(cls, data, alpha):
+        sketches = [P2Quantile.from_dict(sketch) for sketch in data['sketches']]
+        return cls(alpha, None, data['count'], data['mean'], data['variance'], sketches)
+
+class AnomalyDetector:
+    """
+    Online per-hive "normal for this hive" model over acoustic features
+
+    Each feature of each hive keeps an exponentially weighted mean and
+    variance and P-square estimates of its low and high quantiles. A value
+    is anomalous when its z-score against the EWMA exceeds the threshold
+    AND it falls outside the quantile band, which keeps heavy-tailed
+    features from alerting on ordinary spikes. Every observation also
+    updates the model, so the baseline follows slow seasonal drift.
+
+    State is saved as JSON under settings.ANOMALY_STATE_DIR and reloaded on
+    first use, so the baseline survives restarts.
+    """
+
+    def __init__(self, name, halflife=None, warmup=None, z_threshold=None, quantiles=None,
+                 save_seconds=DEFAULT_SAVE_SECONDS):
+        """
+        :param name: Detector name, also the state file name
+        :param halflife: Samples after which an observation's weight halves
+        :param warmup: Samples per feature before anomalies are flagged
+        :param z_threshold: Minimum |z-score| of an anomaly
+        :param quantiles: (low, high) quantiles bounding normal values
+        :param save_seconds: Minimum interval between automatic saves
+        """
+        options = getattr(settings, 'ANOMALY_DETECTORS', {}).get(name, {})
+        self.name = name
+        self.halflife = halflife or options.get('halflife', DEFAULT_HALFLIFE)
+        self.warmup = warmup or options.get('warmup', DEFAULT_WARMUP)
+        self.z_threshold = z_threshold or getattr(settings, 'ANOMALY_Z_THRESHOLD', DEFAULT_Z_THRESHOLD)
+        self.quantiles = tuple(quantiles or getattr(settings, 'ANOMALY_QUANTILES', DEFAULT_QUANTILES))
+        self.alpha = 1 - 0.5 ** (1.0 / self.halflife)
+        self.save_seconds = save_seconds
+        self.hives = None
+        self.events = {}
+        self.active = {}
+        self._lock = threading.Lock()
+        self._last_save = time.monotonic()
+
+    @property
+    def path(self):
+        return _state_path(self.name)
+
+    def _ensure_loaded(self):
+        if self.hives is not None:
+            return
+        self.hives = {}
+        state = read_anomaly_state(self.name)
+        for hive_id, features in state.get('hives', {}).items():
+            self.hives[hive_id] = {
+                feature: FeatureStats.from_dict(stats, self.alpha) for feature, stats in features.items()
+            }
+        self.events = state.get('events', {})
+        self.active = {hive_id: set(features) for hive_id, features in state.get('active', {}).items()}
+        if self.hives:
+            logger.info(f"Loaded {self.name} anomaly baseline for {len(self.hives)} hive(s)")
+
+    def reload(self):
+        """
+        Drop the in-memory state so the next update rereads the saved state,
+        for detectors shared by several processes
+        """
+        with self._lock:
+            self.hives = None
+
+    def update_shared(self, hive_id, values, timestamp=None):
+        """
+        Reload, update and save the state while holding an exclusive lock on
+        its file, so concurrent web workers, hourly runs and upload analyses
+        never overwrite each other's observations
+
+        :return: List of anomaly dictionaries for the flagged features
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.reload()
+                anomalies = self.update(hive_id, values, timestamp)
+                self.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return anomalies
+
+    def update(self, hive_id, values, timestamp=None):
+        """
+        Score one observation per feature against the hive's baseline, then
+        fold it into the baseline
+
+        :param hive_id: Hive identifier
+        :param values: Dictionary of feature name to number; NaN is skipped
+        :param timestamp: Epoch time of the observation, defaults to now
+        :return: List of anomaly dictionaries for the flagged features
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        anomalies = []
+        with self._lock:
+            self._ensure_loaded()
+            hive = self.hives.setdefault(hive_id, {})
+            active = self.active.setdefault(hive_id, set())
+
+            for feature, x in values.items():
+                if x is None or not math.isfinite(x):
+                    continue
+                stats = hive.get(feature)
+                if stats is None:
+                    stats = hive[feature] = FeatureStats(self.alpha, self.quantiles)
+
+                if stats.count >= self.warmup:
+                    z = stats.score(x)
+                    low, high = stats.bounds
+                    if abs(z) >= self.z_threshold and not (low <= x <= high):
+                        anomalies.append({
+                            'feature': feature,
+                            'value': round(x, 6),
+                            'mean': round(stats.mean, 6),
+                            'std': round(math.sqrt(stats.variance), 6),
+                            'z_score': round(z, 2) if math.isfinite(z) else None,
+                            'normal_range': [round(low, 6), round(high, 6)],
+                            'direction': 'high' if x > stats.mean else 'low',
+                            'timestamp': round(timestamp, 3)
+                        })
+                stats.update(x)
+
+            # Log and record only features entering the anomalous state
+            flagged = {anomaly['feature'] for anomaly in anomalies}
+            for anomaly in anomalies:
+                if anomaly['feature'] not in active:
+                    logger.warning(f"{self.name} anomaly on {hive_id}: {anomaly['feature']}={anomaly['value']} "
+                                   f"(mean {anomaly['mean']}, z {anomaly['z_score']})")
+                    events = self.events.setdefault(hive_id, [])
+                    events.append(anomaly)
+                    del events[:-MAX_EVENTS]
+            self.active[hive_id] = flagged
+
+        if time.monotonic() - self._last_save >= self.save_seconds:
+            self.save()
+        return anomalies
+
+    def observe(self, hive_id, second, features):
+        """
+        TelemetryMonitor listener: update from one second of telemetry
+        """
+        self.update(hive_id, telemetry_values(features), timestamp=second)
+
+    def save(self):
+        """
+        Atomically write the detector state to disk
+        """
+        with self._lock:
+            if self.hives is None:
+                return
+            state = {
+                'name': self.name,
+                'saved_at': time.time(),
+                'halflife': self.halflife,
+                'hives': {
+                    hive_id: {feature: stats.to_dict() for feature, stats in features.items()}
+                    for hive_id, features in self.hives.items()
+                },
+                'active': {hive_id: sorted(features) for hive_id, features in self.active.items()},
+                'events': self.events
+            }
+            self._last_save = time.monotonic()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+def read_anomaly_state(name):
+    """
+    Read a detector's saved state, e.g. from the web process while another
+    process owns the detector
+
+    :param name: Detector name
+    :return: State dictionary, empty when nothing was saved yet
+    """
+    path = _state_path(name)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read anomaly state {path}: {e}")
+        return {}
+
+def summarize_anomaly_state(name):
+    """
+    Return the per-hive baseline, active anomalies and recent events of a
+    saved detector
+    """
+    state = read_anomaly_state(name)
+    hives = {}
+    for hive_id, features in state.get('hives', {}).items():
+        hives[hive_id] = {
+            'baseline': {
+                feature: {
+                    'count': stats['count'],
+                    'mean': round(stats['mean'], 6),
+                    'std': round(math.sqrt(stats['variance']), 6),
+                    'normal_range': [P2Quantile.from_dict(sketch).value for sketch in stats['sketches']]
+                }
+                for feature, stats in features.items()
+            },
+            'active': state.get('active', {}).get(hive_id, []),
+            'events': state.get('events', {}).get(hive_id, [])
+        }
+    return {'saved_at': state.get('saved_at'), 'hives': hives}
+
+def recording_values(features):
+    """
+    Pick the detector inputs out of a full-recording feature dictionary
+    """
+    values = telemetry_values(features)
+    values['spectral_centroid'] = float(features.get('spectral_centroid', 0.0))
+    return values
+
+# Global detectors: per-second telemetry (run_telemetry) and per-recording analysis
+telemetry_detector = AnomalyDetector('telemetry')
+recording_detector = AnomalyDetector('recordings')
@@ -0,0 +1,210 @@
+import os
+import logging
+import tempfile
+import time
+import numpy as np
+from django.conf import settings
+
+from .capture import DeviceCapture, DEFAULT_SAMPLE_RATE
+from .pipeline import AudioClip
+
+logger = logging.getLogger(__name__)
+
+# Default anytime analysis parameters
+DEFAULT_WINDOW_SECONDS = 2.0
+DEFAULT_HOP_SECONDS = 1.0
+DEFAULT_CONFIDENCE_THRESHOLD = 0.9
+DEFAULT_STABLE_WINDOWS = 3
+
+# Give up when the stream delivers nothing new for this long
+STALL_TIMEOUT = 2.0
+
+# Poll interval while waiting for the next window
+POLL_SECONDS = 0.02
+
+def predict_window(model, img_path, preprocess):
+    """
+    Predict the class of one spectrogram window without logging it
+
+    Shared by the BNQ, QNQ and TOOT predictors, which pass in their model
+    and image preprocessing function.
+
+    :param model: Keras model of the predictor, or None if it failed to load
+    :param img_path: Path to the window spectrogram image
+    :param preprocess: Function turning an image path into a model input batch
+    :return: Tuple of (predicted_class, confidence of the predicted class)
+    """
+    if model is None:
+        raise RuntimeError("No model available for prediction")
+
+    pred = model.predict(preprocess(img_path), verbose=0)
+    if pred.ndim > 1 and pred.shape[1] > 1:
+        predicted_class = int(np.argmax(pred[0]))
+        confidence = float(pred[0][predicted_class])
+    else:
+        # Binary output is the probability of class 1
+        predicted_class = 1 if pred[0][0] > 0.5 else 0
+        confidence = float(pred[0][0] if predicted_class else 1 - pred[0][0])
+    return predicted_class, max(0.0, min(1.0, confidence))
+
+class StabilityTracker:
+    """
+    Track windowed predictions until every predictor has settled
+
+    A predictor is stable once its last K windows agree on the class and
+    each has a confidence at or above the threshold.
+    """
+
+    def __init__(self, predictors, threshold=None, stable_windows=None):
+        """
+        :param predictors: Names of the predictors that must all be stable
+        :param threshold: Minimum confidence (0-1), defaults to
+            settings.ANYTIME_CONFIDENCE_THRESHOLD
+        :param stable_windows: K, defaults to settings.ANYTIME_STABLE_WINDOWS
+        """
+        self.threshold = threshold or getattr(settings, 'ANYTIME_CONFIDENCE_THRESHOLD', DEFAULT_CONFIDENCE_THRESHOLD)
+        self.stable_windows = stable_windows or getattr(settings, 'ANYTIME_STABLE_WINDOWS', DEFAULT_STABLE_WINDOWS)
+        self.history = {name: [] for name in predictors}
+
+    def update(self, name, predicted_class, confidence):
+        """
+        Record the prediction of one predictor for the latest window
+        """
+        self.history[name].append((int(predicted_class), float(confidence)))
+
+    def reset(self):
+        """
+        Forget all windows, e.g. after a window failed the quality gate
+        """
+        for windows in self.history.values():
+            windows.clear()
+
+    def is_predictor_stable(self, name):
+        recent = self.history[name][-self.stable_windows:]
+        return (len(recent) == self.stable_windows and
+                len({predicted_class for predicted_class, _ in recent}) == 1 and
+                all(confidence >= self.threshold for _, confidence in recent))
+
+    def is_stable(self):
+        """
+        Return True once every predictor is stable
+        """
+        return bool(self.history) and all(self.is_predictor_stable(name) for name in self.history)
+
+    def summary(self):
+        """
+        Return the latest class, confidence and stability per predictor
+        """
+        return {
+            name: {
+                'predicted_class': windows[-1][0] if windows else None,
+                'confidence': round(windows[-1][1] * 100, 2) if windows else None,
+                'windows': len(windows),
+                'stable': self.is_predictor_stable(name)
+            }
+            for name, windows in self.history.items()
+        }
+
+def anytime_capture(predict_functions, render_spectrogram, work_dir, max_duration, sample_rate=None,
+                    device=None, backend=None, window_seconds=None, hop_seconds=None,
+                    threshold=None, stable_windows=None):
+    """
+    Capture audio while running windowed inference, stopping once confident
+
+    Every hop, the latest window of audio is rendered and scored by each
+    predictor. Capture stops as soon as all predictors have been stable for
+    K windows, or at max_duration. Windows that fail the capture quality
+    gate reset the stability count. If inference is slower than the hop,
+    windows are skipped rather than queued, so the decision always uses
+    the freshest audio.
+
+    :param predict_functions: Dictionary of predictor name to a function
+        taking a spectrogram path and returning (predicted_class, confidence)
+    :param render_spectrogram: Function (clip, path, title) that writes a
+        spectrogram image
+    :param work_dir: Directory for the temporary window spectrogram
+    :param max_duration: Longest capture in seconds
+    :param sample_rate: Capture sampling rate
+    :param device: Device index on the capture backend
+    :param backend: CaptureBackend, defaults to get_capture_backend()
+    :param window_seconds: Analysis window length
+    :param hop_seconds: Time between window analyses
+    :param threshold: Confidence threshold for a stable prediction
+    :param stable_windows: Number of agreeing windows required (K)
+    :return: Dictionary with the captured 'clip', 'stopped_early',
+        'windows' analyzed, 'duration' and per-predictor 'decisions'
+    """
+    sample_rate = sample_rate or getattr(settings, 'SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+    window_seconds = window_seconds or getattr(settings, 'ANYTIME_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS)
+    hop_seconds = hop_seconds or getattr(settings, 'ANYTIME_HOP_SECONDS', DEFAULT_HOP_SECONDS)
+    window_seconds = min(window_seconds, max_duration)
+
+    tracker = StabilityTracker(predict_functions, threshold, stable_windows)
+    capture = DeviceCapture(device, 1, sample_rate, int(max_duration) + 1, backend)
+    # A scratch image per call, so concurrent analyses never score each other's window
+    os.makedirs(work_dir, exist_ok=True)
+    fd, window_path = tempfile.mkstemp(prefix='anytime_window_', suffix='.png', dir=work_dir)
+    os.close(fd)
+
+    windows = 0
+    stopped_early = False
+    next_window = window_seconds
+    captured = 0
+    last_progress = time.monotonic()
+
+    capture.start()
+    try:
+        while True:
+            frames = capture.buffer.frames_written
+            if frames != captured:
+                captured, last_progress = frames, time.monotonic()
+            elif time.monotonic() - last_progress > STALL_TIMEOUT:
+                logger.warning("Capture stream stalled, ending anytime analysis")
+                break
+
+            elapsed = captured / sample_rate
+            if elapsed >= max_duration:
+                break
+            if elapsed < next_window:
+                time.sleep(POLL_SECONDS)
+                continue
+
+            window = AudioClip(capture.buffer.read_latest(int(window_seconds * sample_rate))[:, 0], sample_rate)
+            next_window = elapsed + hop_seconds
+            windows += 1
+
+            if window.quality()['status'] != 'ok':
+                tracker.reset()
+                continue
+
+            render_spectrogram(window, window_path, 'Anytime Window')
+            for name, predict in predict_functions.items():
+                try:
+                    predicted_class, confidence = predict(window_path)
+                    tracker.update(name, predicted_class, confidence)
+                except Exception as e:
+                    logger.error(f"{name} window prediction error: {e}")
+
+            if tracker.is_stable():
+                stopped_early = True
+                break
+    finally:
+        capture.stop()
+        try:
+            os.remove(window_path)
+        except FileNotFoundError:
+            pass
+
+    clip = AudioClip(capture.buffer.read_latest(int(max_duration * sample_rate))[:, 0], sample_rate, source='anytime')
+    duration = clip.duration
+    decisions = tracker.summary()
+    logger.info(f"Anytime analysis: {windows} window(s), {duration:.2f}s captured, "
+                f"stopped early: {stopped_early}, decisions: {decisions}")
+
+    return {
+        'clip': clip,
+        'stopped_early': stopped_early,
+        'windows': windows,
+        'duration': round(duration, 3),
+        'decisions': decisions
+    }
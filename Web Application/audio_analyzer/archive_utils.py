@@ -0,0 +1,224 @@
+import os
+import queue
+import itertools
+import shutil
+import tempfile
+import logging
+import threading
+import time
+import soundfile as sf
+from django.conf import settings
+
+from .audio_features import resample_audio, to_mono_float32
+
+logger = logging.getLogger(__name__)
+
+# Supported recording archive formats
+ARCHIVE_FORMATS = {
+    'wav': {'extension': '.wav', 'format': 'WAV', 'subtype': 'PCM_16'},
+    'flac': {'extension': '.flac', 'format': 'FLAC', 'subtype': 'PCM_16'},
+    'opus': {'extension': '.opus', 'format': 'OGG', 'subtype': 'OPUS'},
+}
+
+# Extensions every audio reader decodes transparently
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.opus', '.ogg')
+
+# Sampling rates accepted by the Opus encoder
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# libsndfile maps Opus compression level 0.0-1.0 linearly onto 256-6 kbps per channel
+OPUS_MAX_BITRATE = 256000
+OPUS_MIN_BITRATE = 6000
+
+def get_archive_format():
+    """
+    Return the configured archive format ('wav', 'flac' or 'opus')
+    """
+    archive_format = getattr(settings, 'RECORDING_ARCHIVE_FORMAT', 'wav').lower()
+    if archive_format not in ARCHIVE_FORMATS:
+        logger.warning(f"Unknown RECORDING_ARCHIVE_FORMAT '{archive_format}', falling back to wav")
+        return 'wav'
+    return archive_format
+
+def is_audio_file(filename):
+    """
+    Check whether a filename has a decodable recording extension
+    """
+    return filename.lower().endswith(AUDIO_EXTENSIONS)
+
+def archive_path(base_path, archive_format=None):
+    """
+    Return the archive file path for a recording path without extension
+
+    :param base_path: Recording path, with or without an audio extension
+    :param archive_format: Archive format, defaults to get_archive_format()
+    :return: Path with the extension of the archive format
+    """
+    root, ext = os.path.splitext(base_path)
+    if ext.lower() not in AUDIO_EXTENSIONS:
+        root = base_path
+    return root + ARCHIVE_FORMATS[archive_format or get_archive_format()]['extension']
+
+def write_recording(path, samples, sample_rate, archive_format=None, bitrate=None):
+    """
+    Encode a recording to disk in the archive format
+
+    The file is encoded under a temporary name and renamed into place, so
+    readers never see a partially written recording.
+
+    :param path: Destination path, including extension
+    :param samples: Recording samples, any WAV dtype, mono or multi-channel
+    :param sample_rate: Sampling rate of the samples
+    :param archive_format: Archive format, defaults to get_archive_format()
+    :param bitrate: Opus bitrate in bits per second per channel
+    """
+    archive_format = archive_format or get_archive_format()
+    spec = ARCHIVE_FORMATS[archive_format]
+    options = {}
+
+    if archive_format == 'opus':
+        # Opus only encodes at a few fixed rates: pick the nearest one above
+        samples = to_mono_float32(samples)
+        target_sr = next((sr for sr in OPUS_SAMPLE_RATES if sr >= sample_rate), OPUS_SAMPLE_RATES[-1])
+        samples = resample_audio(samples, sample_rate, target_sr)
+        sample_rate = target_sr
+
+        bitrate = bitrate or getattr(settings, 'RECORDING_OPUS_BITRATE', 32000)
+        bitrate = min(max(bitrate, OPUS_MIN_BITRATE), OPUS_MAX_BITRATE)
+        options['compression_level'] = (OPUS_MAX_BITRATE - bitrate) / (OPUS_MAX_BITRATE - OPUS_MIN_BITRATE)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    os.close(fd)
+    try:
+        sf.write(tmp_path, samples, sample_rate, format=spec['format'], subtype=spec['subtype'], **options)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+class RecordingArchiver:
+    """
+    Encode recordings to disk on a background thread
+
+    Callers get the final path immediately; readers that need the file
+    call wait_for(path) before opening it. The same path may be submitted
+    again before an earlier write finishes: writes happen in submission
+    order and wait_for waits for all of them.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        # Path -> {submission token: event}
+        self._pending = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='recording-archiver', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            token, path, samples, sample_rate, archive_format, on_written = self._queue.get()
+            try:
+                write_recording(path, samples, sample_rate, archive_format)
+                logger.info(f"Archived recording to {path}")
+                if on_written is not None:
+                    on_written(path)
+            except Exception as e:
+                logger.error(f"Failed to archive recording {path}: {e}")
+            finally:
+                with self._lock:
+                    submissions = self._pending.get(path, {})
+                    done = submissions.pop(token, None)
+                    if not submissions:
+                        self._pending.pop(path, None)
+                if done is not None:
+                    done.set()
+                self._queue.task_done()
+
+    def submit(self, base_path, samples, sample_rate, archive_format=None, on_written=None):
+        """
+        Queue a recording for encoding
+
+        :param base_path: Recording path, with or without an audio extension
+        :param samples: Recording samples (not modified afterwards by the caller)
+        :param sample_rate: Sampling rate of the samples
+        :param archive_format: Archive format, defaults to get_archive_format()
+        :param on_written: Optional function called with the path once the file is written
+        :return: Final path of the archived recording
+        """
+        archive_format = archive_format or get_archive_format()
+        path = archive_path(base_path, archive_format)
+
+        with self._lock:
+            token = next(self._tokens)
+            self._pending.setdefault(path, {})[token] = threading.Event()
+        self._ensure_worker()
+        self._queue.put((token, path, samples, sample_rate, archive_format, on_written))
+        return path
+
+    def wait_for(self, path, timeout=30):
+        """
+        Block until every write submitted so far for a path has finished
+
+        :param path: Path returned by submit
+        :param timeout: Maximum time to wait in seconds
+        :return: True if the writes finished and the file is on disk
+        """
+        with self._lock:
+            events = list(self._pending.get(path, {}).values())
+        deadline = time.monotonic() + timeout
+        for done in events:
+            if not done.wait(max(deadline - time.monotonic(), 0)):
+                return False
+        return os.path.exists(path)
+
+    def flush(self):
+        """
+        Block until every queued recording has been written
+        """
+        self._queue.join()
+
+def prune_recordings(max_age_days=None):
+    """
+    Delete recording sessions older than the retention period
+
+    :param max_age_days: Retention in days, defaults to
+        settings.RECORDING_RETENTION_DAYS; 0 or None keeps everything
+    :return: Number of sessions removed
+    """
+    max_age_days = max_age_days if max_age_days is not None else getattr(settings, 'RECORDING_RETENTION_DAYS', 0)
+    recordings_dir = os.path.join(settings.MEDIA_ROOT, 'recordings')
+    if not max_age_days or not os.path.isdir(recordings_dir):
+        return 0
+
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for entry in os.scandir(recordings_dir):
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+            removed += 1
+        except OSError as e:
+            logger.error(f"Failed to prune recording {entry.path}: {e}")
+
+    if removed:
+        logger.info(f"Pruned {removed} recording session(s) older than {max_age_days} days")
+    return removed
+
+# Create a global recording archiver instance
+recording_archiver = RecordingArchiver()
@@ -0,0 +1,494 @@
+import logging
+from math import gcd
+import numpy as np
+import librosa
+import soundfile as sf
+from scipy import signal
+from scipy.io import wavfile
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Ignore DC and sub-audible rumble when looking for the peak frequency
+MIN_FREQUENCY = 20
+
+# Fraction of spectral energy below the rolloff frequency
+ROLLOFF_PERCENT = 0.85
+
+# Default STFT frame length (~93 ms at 44.1 kHz); frames overlap by 50% as in Welch
+DEFAULT_N_FFT = 4096
+
+# Default block length for chunked file processing
+DEFAULT_CHUNK_SECONDS = 10
+
+# Frequency bands (Hz) relevant to hive acoustics
+DEFAULT_BEE_BANDS = {
+    'sub_hum': (20, 100),       # Wind, handling and mains rumble
+    'hum': (100, 300),          # Colony hum and fanning
+    'piping': (300, 600),       # Queen tooting/quacking fundamentals
+    'harmonics': (600, 1500),   # Piping harmonics and worker piping
+    'hiss': (1500, 4000),       # Defensive hissing and alarm
+}
+
+def get_bee_bands():
+    """
+    Return the configured bee-relevant frequency bands
+
+    :return: Dictionary of band name to (low_hz, high_hz)
+    """
+    return getattr(settings, 'BEE_FREQUENCY_BANDS', DEFAULT_BEE_BANDS)
+
+def to_mono_float32(samples):
+    """
+    Convert raw samples to a mono float32 array scaled to [-1, 1]
+
+    :param samples: 1-D or (frames, channels) array in any WAV sample format
+    :return: 1-D float32 numpy array
+    """
+    samples = np.asarray(samples)
+
+    if samples.dtype == np.uint8:
+        samples = (samples.astype(np.float32) - 128.0) / 128.0
+    elif np.issubdtype(samples.dtype, np.integer):
+        scale = float(2 ** (8 * samples.dtype.itemsize - 1))
+        samples = samples.astype(np.float32) / scale
+    else:
+        samples = samples.astype(np.float32, copy=False)
+
+    # Convert stereo/multi-channel to mono
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1, dtype=np.float32) if samples.shape[1] > 1 else samples[:, 0]
+
+    return samples
+
+def resample_audio(y, orig_sr, target_sr):
+    """
+    Resample audio with a polyphase FIR filter
+
+    :param y: 1-D float32 samples
+    :param orig_sr: Current sampling rate
+    :param target_sr: Desired sampling rate
+    :return: Resampled float32 samples
+    """
+    if orig_sr == target_sr:
+        return y
+    factor = gcd(int(orig_sr), int(target_sr))
+    resampled = signal.resample_poly(y, int(target_sr) // factor, int(orig_sr) // factor)
+    return resampled.astype(np.float32, copy=False)
+
+class StreamingResampler:
+    """
+    Polyphase resampler for audio that arrives in blocks
+
+    Uses the same Kaiser-windowed FIR low-pass as resample_audio and keeps
+    the filter history between blocks, so the concatenated output equals
+    resampling the whole signal at once, with no edge effects at block
+    boundaries. Output lags the input by half the filter length until the
+    final block.
+    """
+
+    def __init__(self, orig_sr, target_sr):
+        """
+        :param orig_sr: Sampling rate of the input blocks
+        :param target_sr: Desired sampling rate
+        """
+        factor = gcd(int(orig_sr), int(target_sr))
+        self.up = int(target_sr) // factor
+        self.down = int(orig_sr) // factor
+        max_rate = max(self.up, self.down)
+        self.half_len = 10 * max_rate
+        self.h = (signal.firwin(2 * self.half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+                  * self.up).astype(np.float32)
+        # Input samples still needed by future outputs, starting at input index _start
+        self._buffer = None
+        self._start = 0
+        self._received = 0
+        self._next = 0
+        self._finished = False
+
+    def process(self, block, final=False):
+        """
+        Feed the next input block
+
+        :param block: float32 array of shape (frames, channels)
+        :param final: No input follows; flush the end of the signal
+        :return: float32 array of shape (frames, channels) with the output
+            that can be computed so far
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if self._buffer is None:
+            self._buffer = np.zeros((0, block.shape[1]), dtype=np.float32)
+        if self._finished:
+            return self._buffer[:0]
+        self._buffer = np.concatenate([self._buffer, block]) if len(self._buffer) else block
+        self._received += len(block)
+
+        # Output n is the upsampled input filtered around position n * down
+        if final:
+            self._finished = True
+            end = -(-self._received * self.up // self.down)
+        else:
+            end = max(-(-(self._received * self.up - self.half_len) // self.down), self._next)
+        if end <= self._next:
+            return self._buffer[:0]
+        n = np.arange(self._next, end)
+        taps = 2 * self.half_len // self.up + 1
+        first = -((self.half_len - n * self.down) // self.up)
+        index = first[:, None] + np.arange(taps)
+        h_index = n[:, None] * self.down + self.half_len - index * self.up
+        valid = (h_index >= 0) & (h_index <= 2 * self.half_len) & (index >= 0) & (index < self._received)
+        weights = np.where(valid, self.h[np.clip(h_index, 0, 2 * self.half_len)], 0)
+        samples = self._buffer[np.clip(index - self._start, 0, len(self._buffer) - 1)]
+        output = np.einsum('nk,nkc->nc', weights, samples).astype(np.float32, copy=False)
+
+        # Drop input no later output needs
+        self._next = end
+        keep_from = max(-((self.half_len - end * self.down) // self.up), self._start)
+        self._buffer = self._buffer[min(keep_from - self._start, len(self._buffer)):]
+        self._start = keep_from
+        return output
+
+def decimate_to_bee_band(samples, sample_rate, target_rate=None):
+    """
+    Anti-alias filter and decimate a capture to the bee acoustic band
+
+    Bee buzzing, piping and tooting sit below 4 kHz, so every later stage
+    (quality checks, STFT, spectrograms, storage) can run on far fewer
+    samples. resample_poly applies a Kaiser-windowed FIR low-pass before
+    decimating, in polyphase form.
+
+    :param samples: Raw samples, any WAV dtype, mono or multi-channel
+    :param sample_rate: Sampling rate of the samples
+    :param target_rate: Output rate, defaults to settings.BEE_BAND_SAMPLE_RATE;
+        when unset or not below sample_rate the audio is only made mono float32
+    :return: Tuple of (samples, sample_rate)
+    """
+    target_rate = target_rate or getattr(settings, 'BEE_BAND_SAMPLE_RATE', None)
+    y = to_mono_float32(samples)
+
+    if not target_rate or target_rate >= sample_rate:
+        return y, sample_rate
+
+    return resample_audio(y, sample_rate, target_rate), int(target_rate)
+
+def load_audio(audio_path, target_sr=None):
+    """
+    Load an audio file as mono float32 at its native sampling rate
+
+    Unlike librosa.load, no resampling happens unless target_sr is given
+    and differs from the file rate, in which case a polyphase resampler
+    is used.
+
+    :param audio_path: Path to the audio file
+    :param target_sr: Optional sampling rate to resample to
+    :return: Tuple of (samples, sample_rate)
+    """
+    samples, sr = sf.read(audio_path, dtype='float32', always_2d=False)
+    y = to_mono_float32(samples)
+
+    if target_sr and target_sr != sr:
+        y = resample_audio(y, sr, target_sr)
+        sr = target_sr
+
+    return y, sr
+
+def iter_audio_blocks(audio_path, chunk_seconds=None):
+    """
+    Yield a recording as mono float32 blocks with bounded memory
+
+    PCM WAV files are memory-mapped so only the current block is paged
+    in; other formats are decoded block by block through soundfile.
+
+    :param audio_path: Path to the audio file
+    :param chunk_seconds: Block length in seconds, defaults to
+        settings.AUDIO_CHUNK_SECONDS
+    :return: Generator of (block, sample_rate) tuples
+    """
+    chunk_seconds = chunk_seconds or getattr(settings, 'AUDIO_CHUNK_SECONDS', DEFAULT_CHUNK_SECONDS)
+
+    try:
+        sample_rate, samples = wavfile.read(audio_path, mmap=True)
+    except Exception:
+        # Not a memory-mappable WAV (e.g. FLAC, 24-bit PCM): stream-decode instead
+        sample_rate = sf.info(audio_path).samplerate
+        block_size = int(chunk_seconds * sample_rate)
+        for block in sf.blocks(audio_path, blocksize=block_size, dtype='float32', always_2d=True):
+            yield to_mono_float32(block), sample_rate
+        return
+
+    block_size = int(chunk_seconds * sample_rate)
+    for start in range(0, len(samples), block_size):
+        yield to_mono_float32(samples[start:start + block_size]), sample_rate
+
+def magnitude_spectrogram(y, n_fft=DEFAULT_N_FFT, hop_length=None, center=True):
+    """
+    Compute the float32 STFT magnitude shared by every spectral feature
+
+    :param y: 1-D float32 samples
+    :param n_fft: FFT frame length
+    :param hop_length: Hop between frames, defaults to n_fft // 2
+    :param center: Pad so frames are centred on their timestamps
+    :return: Tuple of (S, n_fft) where S has shape (1 + n_fft // 2, frames)
+    """
+    if center:
+        # Shrink the frame for very short clips instead of zero-padding them away
+        n_fft = int(min(n_fft, 2 ** int(np.log2(max(len(y), 16)))))
+    hop_length = hop_length or n_fft // 2
+    S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length, window='hann', center=center))
+    return S.astype(np.float32, copy=False), n_fft
+
+def spectral_shape(S, sample_rate, n_fft):
+    """
+    Frame-wise spectral centroid, bandwidth and rolloff from one spectrogram
+
+    :param S: Magnitude spectrogram from magnitude_spectrogram
+    :param sample_rate: Sampling rate of the audio
+    :param n_fft: FFT frame length used for S
+    :return: Tuple of per-frame (centroid, bandwidth, rolloff) arrays
+    """
+    freqs = librosa.fft_frequencies(sr=sample_rate, n_fft=n_fft)
+    mask = freqs >= MIN_FREQUENCY
+    S, freqs = S[mask], freqs[mask]
+
+    centroid = librosa.feature.spectral_centroid(S=S, sr=sample_rate, freq=freqs)
+    bandwidth = librosa.feature.spectral_bandwidth(S=S, sr=sample_rate, freq=freqs, centroid=centroid)
+    rolloff = librosa.feature.spectral_rolloff(S=S, sr=sample_rate, freq=freqs, roll_percent=ROLLOFF_PERCENT)
+    return centroid[0], bandwidth[0], rolloff[0]
+
+def features_from_psd(freqs, psd, sample_rate, rms, duration, bands=None, shape=None):
+    """
+    Derive every acoustic feature from a single power spectral density
+
+    :param freqs: Frequency of each PSD bin in Hz
+    :param psd: Power spectral density for each bin
+    :param sample_rate: Sampling rate of the analysed audio
+    :param rms: RMS amplitude of the analysed audio (full scale = 1.0)
+    :param duration: Duration of the analysed audio in seconds
+    :param bands: Optional band definitions, defaults to get_bee_bands()
+    :param shape: Optional (centroid, bandwidth, rolloff) frame means; when
+        omitted they are derived from the PSD itself
+    :return: Dictionary of acoustic features
+    """
+    bands = bands or get_bee_bands()
+    freqs = np.asarray(freqs, dtype=np.float32)
+    psd = np.asarray(psd, dtype=np.float32)
+
+    # Restrict every spectral statistic to the audible range
+    mask = freqs >= MIN_FREQUENCY
+    f = freqs[mask]
+    p = psd[mask]
+    bin_width = float(freqs[1] - freqs[0]) if len(freqs) > 1 else 0.0
+    total_power = float(p.sum())
+
+    if len(f) == 0 or total_power <= 0:
+        peak_frequency = centroid = bandwidth = rolloff = 0.0
+    else:
+        peak_frequency = float(f[np.argmax(p)])
+        weights = p / total_power
+        centroid = float(np.dot(weights, f))
+        bandwidth = float(np.sqrt(np.dot(weights, (f - centroid) ** 2)))
+        cumulative = np.cumsum(weights)
+        rolloff = float(f[min(np.searchsorted(cumulative, ROLLOFF_PERCENT), len(f) - 1)])
+
+    if shape is not None:
+        centroid, bandwidth, rolloff = (float(value) for value in shape)
+
+    # Vectorized band energies: one (bands x bins) mask, one matrix product
+    names = list(bands.keys())
+    edges = np.asarray([bands[name] for name in names], dtype=np.float32).reshape(-1, 2)
+    band_masks = (freqs >= edges[:, :1]) & (freqs < edges[:, 1:])
+    energies = band_masks.astype(np.float32) @ psd * bin_width
+    band_total = float(psd[mask].sum() * bin_width)
+
+    band_energies = {name: float(energy) for name, energy in zip(names, energies)}
+    band_ratios = {
+        name: (float(energy) / band_total if band_total > 0 else 0.0)
+        for name, energy in zip(names, energies)
+    }
+
+    nyquist = sample_rate / 2.0
+
+    return {
+        'sample_rate': int(sample_rate),
+        'duration': round(float(duration), 3),
+        'rms': round(float(rms), 6),
+        'peak_frequency': round(peak_frequency, 2),
+        'spectral_centroid': round(centroid, 2),
+        'spectral_bandwidth': round(bandwidth, 2),
+        'spectral_rolloff': round(rolloff, 2),
+        'frequency_range': f"{MIN_FREQUENCY} - {round(nyquist, 2)}",
+        'band_energies': band_energies,
+        'band_energy_ratios': band_ratios,
+    }
+
+class StreamingFeatureAccumulator:
+    """
+    Accumulate the shared feature set over audio delivered in blocks
+
+    Only sufficient statistics are kept (per-bin power sum, frame-wise
+    shape sums, sum of squares and a carry of less than one frame), so
+    memory does not grow with recording length.
+    """
+
+    def __init__(self, sample_rate, n_fft=DEFAULT_N_FFT):
+        """
+        :param sample_rate: Sampling rate of the incoming blocks
+        :param n_fft: STFT frame length; hop is n_fft // 2
+        """
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop_length = n_fft // 2
+        self.power_sum = np.zeros(1 + n_fft // 2, dtype=np.float64)
+        self.shape_sum = np.zeros(3, dtype=np.float64)
+        self.frame_count = 0
+        self.square_sum = 0.0
+        self.sample_count = 0
+        self._carry = np.zeros(0, dtype=np.float32)
+
+    def _accumulate_frames(self, S):
+        self.power_sum += np.square(S, dtype=np.float32).sum(axis=1)
+        centroid, bandwidth, rolloff = spectral_shape(S, self.sample_rate, self.n_fft)
+        self.shape_sum += (centroid.sum(), bandwidth.sum(), rolloff.sum())
+        self.frame_count += S.shape[1]
+
+    def update(self, block):
+        """
+        Feed the next block of samples
+
+        :param block: Samples in any WAV dtype, mono or multi-channel
+        """
+        block = to_mono_float32(block)
+        self.square_sum += float(np.dot(block, block))
+        self.sample_count += len(block)
+
+        buffer = np.concatenate((self._carry, block)) if len(self._carry) else block
+        if len(buffer) < self.n_fft:
+            self._carry = buffer.copy()
+            return
+
+        S, _ = magnitude_spectrogram(buffer, self.n_fft, self.hop_length, center=False)
+        self._accumulate_frames(S)
+
+        # Keep the samples the next frame still overlaps
+        consumed = S.shape[1] * self.hop_length
+        self._carry = buffer[consumed:].copy()
+
+    def result(self, bands=None):
+        """
+        Return the feature set for everything fed so far
+
+        :param bands: Optional band definitions, defaults to get_bee_bands()
+        :return: Dictionary of acoustic features
+        """
+        if self.sample_count == 0:
+            raise ValueError("Cannot compute features of an empty recording")
+
+        if self.frame_count == 0:
+            # Shorter than one frame: analyse the zero-padded remainder once
+            padded = np.pad(self._carry, (0, self.n_fft - len(self._carry)))
+            S, _ = magnitude_spectrogram(padded, self.n_fft, self.hop_length, center=False)
+            self._accumulate_frames(S)
+
+        freqs = librosa.fft_frequencies(sr=self.sample_rate, n_fft=self.n_fft)
+        psd = self.power_sum / self.frame_count
+        shape = self.shape_sum / self.frame_count
+        rms = np.sqrt(self.square_sum / self.sample_count)
+        duration = self.sample_count / self.sample_rate
+
+        return features_from_psd(freqs, psd, self.sample_rate, rms, duration, bands, shape=shape)
+
+def compute_audio_features(samples, sample_rate, bands=None, n_fft=DEFAULT_N_FFT, chunk_seconds=None):
+    """
+    Compute the shared acoustic feature set for an in-memory recording
+
+    The buffer is fed to the accumulator in fixed-size slices, so the STFT
+    working memory is bounded by the block size, not the recording length.
+
+    :param samples: Raw samples, any WAV dtype, mono or multi-channel
+    :param sample_rate: Sampling rate of the samples
+    :param bands: Optional band definitions, defaults to get_bee_bands()
+    :param n_fft: STFT frame length in samples
+    :param chunk_seconds: Block length in seconds, defaults to
+        settings.AUDIO_CHUNK_SECONDS
+    :return: Dictionary of acoustic features
+    """
+    chunk_seconds = chunk_seconds or getattr(settings, 'AUDIO_CHUNK_SECONDS', DEFAULT_CHUNK_SECONDS)
+    block_size = max(int(chunk_seconds * sample_rate), n_fft)
+
+    samples = to_mono_float32(samples)
+    accumulator = StreamingFeatureAccumulator(sample_rate, n_fft)
+    for start in range(0, len(samples), block_size):
+        accumulator.update(samples[start:start + block_size])
+    return accumulator.result(bands)
+
+def compute_file_features(audio_path, bands=None, n_fft=DEFAULT_N_FFT, chunk_seconds=None):
+    """
+    Compute the shared acoustic feature set for a file in fixed-size blocks
+
+    Peak memory is bounded by the block size, not the recording length.
+
+    :param audio_path: Path to the audio file
+    :param bands: Optional band definitions, defaults to get_bee_bands()
+    :param n_fft: STFT frame length in samples
+    :param chunk_seconds: Block length in seconds
+    :return: Dictionary of acoustic features
+    """
+    accumulator = None
+    for block, sample_rate in iter_audio_blocks(audio_path, chunk_seconds):
+        if accumulator is None:
+            accumulator = StreamingFeatureAccumulator(sample_rate, n_fft)
+        accumulator.update(block)
+
+    if accumulator is None:
+        raise ValueError(f"Cannot compute features of an empty recording: {audio_path}")
+    return accumulator.result(bands)
+
+def classify_activity(features):
+    """
+    Classify hive activity level from the shared feature set
+
+    :param features: Dictionary returned by compute_audio_features
+    :return: Activity description string, e.g. "Intense Normal"
+    """
+    peak_frequency = features.get('peak_frequency', 0)
+    rms_amplitude = features.get('rms', 0)
+
+    # Classify activity level based on the dominant hive frequency
+    if peak_frequency < 100:
+        base_level = "Low"
+    elif 100 <= peak_frequency <= 300:
+        base_level = "Normal"
+    elif 300 < peak_frequency <= 500:
+        base_level = "High"
+    else:
+        base_level = "Chaotic"
+
+    # Amplitude-based refinement
+    if rms_amplitude < 0.1:
+        return f"Very {base_level}"
+    elif 0.1 <= rms_amplitude < 0.3:
+        return f"{base_level}"
+    elif 0.3 <= rms_amplitude < 0.6:
+        return f"Intense {base_level}"
+    return f"Extremely {base_level}"
+
+def format_frequency_summary(features):
+    """
+    Format the shared feature set as lines for text notifications
+
+    :param features: Dictionary returned by compute_audio_features
+    :return: Multi-line summary string
+    """
+    bands = ", ".join(
+        f"{name} {ratio * 100:.1f}%"
+        for name, ratio in features.get('band_energy_ratios', {}).items()
+    )
+    return (
+        f"Frequency Data: Peak {features['peak_frequency']}Hz, "
+        f"Centroid {features['spectral_centroid']}Hz, "
+        f"Bandwidth {features['spectral_bandwidth']}Hz, "
+        f"Rolloff {features['spectral_rolloff']}Hz\n"
+        f"RMS Amplitude: {features['rms']}\n"
+        f"Band Energy: {bands}\n"
+        f"Activity Level: {classify_activity(features)} Activity\n"
+    )
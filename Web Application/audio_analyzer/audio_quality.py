@@ -0,0 +1,105 @@
+import logging
+import numpy as np
+from django.conf import settings
+
+from .audio_features import to_mono_float32
+
+logger = logging.getLogger(__name__)
+
+# Default pre-inference quality thresholds
+DEFAULT_QUALITY_THRESHOLDS = {
+    'min_rms': 1e-4,                # Below this the mic is unplugged or muted
+    'clip_level': 0.999,            # Absolute sample value treated as clipped
+    'max_clipping_ratio': 0.01,     # Fraction of clipped samples
+    'max_dc_offset': 0.1,           # Absolute mean of the signal
+    'min_dropout_ms': 10,           # Shortest run of exact zeros counted as a dropout
+    'max_dropout_ratio': 0.05,      # Fraction of samples inside dropouts
+    'max_spectral_flatness': 0.8,   # Near 1.0 means white noise, not hive sound
+}
+
+# Frame length for the spectral flatness estimate
+FLATNESS_FRAME = 2048
+
+def get_quality_thresholds():
+    """
+    Return the quality thresholds, with settings overrides applied
+    """
+    return {**DEFAULT_QUALITY_THRESHOLDS, **getattr(settings, 'CAPTURE_QUALITY_THRESHOLDS', {})}
+
+def _zero_runs(y):
+    """
+    Return the lengths of every run of exact zeros
+    """
+    is_zero = np.concatenate(([0], (y == 0).view(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(is_zero))
+    return edges[1::2] - edges[::2]
+
+def _spectral_flatness(y):
+    """
+    Spectral flatness of the frame-averaged power spectrum
+    """
+    frames = len(y) // FLATNESS_FRAME
+    if frames == 0:
+        return 0.0
+    framed = y[:frames * FLATNESS_FRAME].reshape(frames, FLATNESS_FRAME)
+    power = np.mean(np.abs(np.fft.rfft(framed * np.hanning(FLATNESS_FRAME).astype(np.float32), axis=1)) ** 2, axis=0)
+    power = power[1:] + 1e-20
+    return float(np.exp(np.mean(np.log(power))) / np.mean(power))
+
+def assess_capture_quality(samples, sample_rate, thresholds=None):
+    """
+    Check a capture before running spectrograms and inference on it
+
+    Measures RMS level, clipping, DC offset, zero-run dropouts and
+    spectral flatness in one vectorized pass.
+
+    :param samples: Raw samples, any WAV dtype, mono or multi-channel
+    :param sample_rate: Sampling rate of the samples
+    :param thresholds: Optional thresholds, defaults to get_quality_thresholds()
+    :return: Dictionary with 'status' ('ok' or 'bad_capture'), 'reasons'
+        and the measured 'metrics'
+    """
+    thresholds = thresholds or get_quality_thresholds()
+    y = to_mono_float32(samples)
+
+    if len(y) == 0:
+        return {'status': 'bad_capture', 'reasons': ['empty recording'], 'metrics': {}}
+
+    abs_y = np.abs(y)
+    dc_offset = float(np.mean(y))
+    rms = float(np.sqrt(np.mean(np.square(y))))
+    clipping_ratio = float(np.count_nonzero(abs_y >= thresholds['clip_level']) / len(y))
+
+    runs = _zero_runs(y)
+    min_run = max(1, int(thresholds['min_dropout_ms'] * sample_rate / 1000))
+    dropouts = runs[runs >= min_run]
+    dropout_ratio = float(dropouts.sum() / len(y))
+
+    flatness = _spectral_flatness(y - dc_offset)
+
+    metrics = {
+        'rms': round(rms, 6),
+        'clipping_ratio': round(clipping_ratio, 6),
+        'dc_offset': round(dc_offset, 6),
+        'dropout_count': int(len(dropouts)),
+        'dropout_ratio': round(dropout_ratio, 6),
+        'spectral_flatness': round(flatness, 4),
+    }
+
+    reasons = []
+    if rms < thresholds['min_rms']:
+        reasons.append('silent or disconnected microphone')
+    if clipping_ratio > thresholds['max_clipping_ratio']:
+        reasons.append('clipped or saturated input')
+    if abs(dc_offset) > thresholds['max_dc_offset']:
+        reasons.append('large DC offset')
+    if dropout_ratio > thresholds['max_dropout_ratio']:
+        reasons.append('audio dropouts')
+    if rms >= thresholds['min_rms'] and flatness > thresholds['max_spectral_flatness']:
+        reasons.append('broadband noise only')
+
+    status = 'bad_capture' if reasons else 'ok'
+    if reasons:
+        logger.warning(f"Bad capture detected: {', '.join(reasons)} ({metrics})")
+
+    return {'status': status, 'reasons': reasons, 'metrics': metrics}
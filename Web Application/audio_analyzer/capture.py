@@ -0,0 +1,291 @@
+import logging
+import threading
+import time
+import numpy as np
+from django.conf import settings
+
+from .device_manager import device_manager
+from .capture_backends import get_capture_backend
+
+logger = logging.getLogger(__name__)
+
+# Default sampling rate for hive capture
+DEFAULT_SAMPLE_RATE = 44100
+
+# Frames delivered to each stream callback
+DEFAULT_BLOCKSIZE = 1024
+
+class RingBuffer:
+    """
+    Fixed-size float32 ring buffer filled from an audio callback
+
+    One writer (the PortAudio callback thread) and any number of readers;
+    when full, the oldest frames are overwritten.
+    """
+
+    def __init__(self, capacity, channels=1):
+        """
+        :param capacity: Number of frames the buffer holds
+        :param channels: Number of interleaved channels per frame
+        """
+        self.capacity = int(capacity)
+        self.channels = channels
+        self._data = np.zeros((self.capacity, channels), dtype=np.float32)
+        self._write_pos = 0
+        self._filled = 0
+        self._lock = threading.Lock()
+        self.overwritten_frames = 0
+        self.frames_written = 0
+
+    def write(self, frames):
+        """
+        Append frames, overwriting the oldest data when full
+
+        :param frames: Array of shape (n, channels)
+        """
+        total = len(frames)
+        overflow = max(0, total - self.capacity)
+        frames = frames[-self.capacity:]
+        n = len(frames)
+        with self._lock:
+            end = self._write_pos + n
+            if end <= self.capacity:
+                self._data[self._write_pos:end] = frames
+            else:
+                split = self.capacity - self._write_pos
+                self._data[self._write_pos:] = frames[:split]
+                self._data[:n - split] = frames[split:]
+            self._write_pos = end % self.capacity
+            overflow += max(0, self._filled + n - self.capacity)
+            self.overwritten_frames += overflow
+            self.frames_written += total
+            self._filled = min(self.capacity, self._filled + n)
+
+    def read_latest(self, frames=None):
+        """
+        Copy out the most recent frames in chronological order
+
+        :param frames: Number of frames to read, defaults to all buffered
+        :return: Array of shape (frames, channels)
+        """
+        with self._lock:
+            frames = self._filled if frames is None else min(int(frames), self._filled)
+            start = (self._write_pos - frames) % self.capacity
+            if start + frames <= self.capacity:
+                return self._data[start:start + frames].copy()
+            return np.concatenate((self._data[start:], self._data[:self._write_pos]))
+
+    def read_since(self, position):
+        """
+        Copy out every frame written after an absolute position
+
+        Consumers keep the returned position and pass it back on the next
+        call, so each frame is read once even while the writer runs. Frames
+        already overwritten are skipped.
+
+        :param position: Value of frames_written at the previous read
+        :return: Tuple of (array of shape (frames, channels), new position)
+        """
+        with self._lock:
+            frames = min(self.frames_written - position, self._filled)
+            start = (self._write_pos - frames) % self.capacity
+            if start + frames <= self.capacity:
+                data = self._data[start:start + frames].copy()
+            else:
+                data = np.concatenate((self._data[start:], self._data[:self._write_pos]))
+            return data, self.frames_written
+
+    def clear(self):
+        """
+        Discard all buffered frames
+        """
+        with self._lock:
+            self._write_pos = 0
+            self._filled = 0
+            self.frames_written = 0
+
+    def __len__(self):
+        return self._filled
+
+class DeviceCapture:
+    """
+    One input stream on one device, feeding a per-device ring buffer
+
+    A multi-channel interface is opened once and each hive reads its own
+    channel from the shared buffer.
+    """
+
+    def __init__(self, device, channels, sample_rate, buffer_seconds, backend=None):
+        """
+        :param device: Device index or name on the capture backend
+        :param channels: Number of channels to open on the device
+        :param sample_rate: Sampling rate of the stream
+        :param buffer_seconds: Ring buffer length in seconds
+        :param backend: CaptureBackend, defaults to get_capture_backend()
+        """
+        self.backend = backend or get_capture_backend()
+        self.hardware = self.backend.name == 'sounddevice'
+        self.device = device
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.buffer = RingBuffer(buffer_seconds * sample_rate, channels)
+        self.status_errors = 0
+        self.stream = None
+
+    def _callback(self, indata, frames, time_info, status):
+        if status:
+            self.status_errors += 1
+            if self.hardware:
+                device_manager.stream_status(self.device, status)
+            logger.warning(f"Input stream status on device {self.device}: {status}")
+        self.buffer.write(indata)
+
+    def start(self):
+        """
+        Open and start the input stream
+        """
+        self.buffer.clear()
+        # Register first, so PortAudio is not re-initialized under an opening stream
+        if self.hardware:
+            device_manager.capture_started(self.device)
+        try:
+            self.stream = self.backend.open_stream(
+                self.device,
+                self.channels,
+                self.sample_rate,
+                getattr(settings, 'AUDIO_CAPTURE_BLOCKSIZE', DEFAULT_BLOCKSIZE),
+                self._callback
+            )
+            self.stream.start()
+        except Exception as e:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            if self.hardware:
+                device_manager.capture_stopped(self.device)
+                device_manager.capture_failed(self.device, e)
+            raise
+        logger.info(f"Started capture on device {self.device} ({self.channels} channel(s))")
+
+    def stop(self):
+        """
+        Stop and close the input stream
+        """
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+            if self.hardware:
+                device_manager.capture_stopped(self.device)
+            logger.info(f"Stopped capture on device {self.device}")
+
+class CaptureManager:
+    """
+    Record several hives at once, one callback stream per input device
+
+    Hive inputs are dictionaries with 'hive_id', 'device' and an optional
+    'channel' (for multi-channel interfaces), as in settings.HIVE_AUDIO_INPUTS.
+    """
+
+    def __init__(self, hive_inputs=None, sample_rate=None, buffer_seconds=60, backend=None):
+        """
+        :param hive_inputs: List of hive input dictionaries, defaults to
+            get_hive_inputs()
+        :param sample_rate: Sampling rate shared by all devices
+        :param buffer_seconds: Ring buffer length per device in seconds
+        :param backend: CaptureBackend, defaults to get_capture_backend()
+        """
+        self.backend = backend or get_capture_backend()
+        self.hive_inputs = hive_inputs if hive_inputs is not None else get_hive_inputs(self.backend)
+        self.sample_rate = sample_rate or getattr(settings, 'SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        self.buffer_seconds = buffer_seconds
+        self.devices = {}
+
+        # Open each device once, with enough channels for every hive on it
+        channels_needed = {}
+        for hive_input in self.hive_inputs:
+            device = hive_input['device']
+            channel = hive_input.get('channel', 0)
+            channels_needed[device] = max(channels_needed.get(device, 1), channel + 1)
+
+        for device, channels in channels_needed.items():
+            self.devices[device] = DeviceCapture(device, channels, self.sample_rate, buffer_seconds, self.backend)
+
+    def start(self):
+        """
+        Start every device stream; on failure, already started streams are stopped
+        """
+        try:
+            for capture in self.devices.values():
+                capture.start()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        """
+        Stop every device stream
+        """
+        for capture in self.devices.values():
+            try:
+                capture.stop()
+            except Exception as e:
+                logger.error(f"Error stopping capture on device {capture.device}: {e}")
+
+    def read_latest(self, seconds=None):
+        """
+        Return the most recent audio for every hive
+
+        :param seconds: Amount of audio to return, defaults to all buffered
+        :return: Dictionary of hive_id to 1-D float32 samples
+        """
+        frames = None if seconds is None else int(seconds * self.sample_rate)
+        recordings = {}
+        for hive_input in self.hive_inputs:
+            capture = self.devices[hive_input['device']]
+            data = capture.buffer.read_latest(frames)
+            recordings[hive_input['hive_id']] = data[:, hive_input.get('channel', 0)].copy()
+        return recordings
+
+    def record(self, duration):
+        """
+        Record every hive in parallel for a fixed duration
+
+        :param duration: Recording duration in seconds
+        :return: Dictionary of hive_id to 1-D float32 samples
+        """
+        if duration > self.buffer_seconds:
+            raise ValueError(f"Duration {duration}s exceeds ring buffer length {self.buffer_seconds}s")
+
+        self.start()
+        try:
+            time.sleep(duration)
+        finally:
+            self.stop()
+        return self.read_latest(duration)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
+
+def get_hive_inputs(backend=None):
+    """
+    Return the configured hive inputs, or one hive per input device
+    (USB devices first) of the capture backend
+
+    :param backend: CaptureBackend, defaults to get_capture_backend()
+    :return: List of dictionaries with 'hive_id', 'device' and 'channel'
+    """
+    configured = getattr(settings, 'HIVE_AUDIO_INPUTS', None)
+    if configured:
+        return configured
+
+    input_devices, _ = (backend or get_capture_backend()).diagnose()
+    return [
+        {'hive_id': f'hive{n + 1}', 'device': device, 'channel': 0}
+        for n, device in enumerate(input_devices)
+    ]
@@ -0,0 +1,444 @@
+import logging
+import threading
+import time
+import numpy as np
+import soundfile as sf
+from scipy import signal
+from django.conf import settings
+
+from .audio_features import StreamingResampler
+
+logger = logging.getLogger(__name__)
+
+# Default backend when settings.AUDIO_CAPTURE_BACKEND is not set
+DEFAULT_BACKEND = 'sounddevice'
+
+# Frames per callback for simulated streams
+DEFAULT_BLOCKSIZE = 1024
+
+# Pole of the one-pole low-pass that colours synthetic background noise
+NOISE_POLE = 0.9
+
+class CaptureBackend:
+    """
+    Source of captured audio
+
+    Every backend records a fixed duration (record) and opens callback
+    streams for the ring-buffer capture (open_stream), so the views, the
+    hourly command and CaptureManager work the same with real hardware,
+    replayed files or synthetic audio.
+    """
+
+    name = None
+
+    def record(self, duration, sample_rate, channels=1, device=None):
+        """
+        Record a fixed duration
+
+        :param duration: Recording duration in seconds
+        :param sample_rate: Sampling rate of the returned audio
+        :param channels: Number of channels
+        :param device: Device index (meaning depends on the backend)
+        :return: float32 array of shape (frames, channels)
+        """
+        raise NotImplementedError
+
+    def open_stream(self, device, channels, sample_rate, blocksize, callback):
+        """
+        Open a callback input stream with the sounddevice.InputStream interface
+
+        :return: Stream object with start(), stop() and close()
+        """
+        raise NotImplementedError
+
+    def diagnose(self):
+        """
+        Return the usable input devices, like diagnose_audio_devices
+
+        :return: Tuple of (device indices, device detail dictionaries)
+        """
+        raise NotImplementedError
+
+    def input_devices(self):
+        """
+        Return every input device for device pickers
+
+        :return: List of dictionaries with 'index', 'name' and 'max_input_channels'
+        """
+        return self.diagnose()[1]
+
+class SoundDeviceBackend(CaptureBackend):
+    """
+    Capture from real audio hardware through PortAudio
+    """
+
+    name = 'sounddevice'
+
+    def record(self, duration, sample_rate, channels=1, device=None):
+        import sounddevice as sd
+        from .device_manager import device_manager
+
+        with device_manager.in_use(device):
+            recording = sd.rec(
+                int(duration * sample_rate),
+                samplerate=sample_rate,
+                channels=channels,
+                dtype='float32',
+                device=device
+            )
+            sd.wait()
+        return recording
+
+    def open_stream(self, device, channels, sample_rate, blocksize, callback):
+        import sounddevice as sd
+
+        return sd.InputStream(
+            device=device,
+            channels=channels,
+            samplerate=sample_rate,
+            dtype='float32',
+            blocksize=blocksize,
+            callback=callback
+        )
+
+    def diagnose(self):
+        # Import lazily: views imports this module
+        from .views import diagnose_audio_devices
+
+        return diagnose_audio_devices()
+
+    def input_devices(self):
+        from .device_manager import device_manager
+
+        return device_manager.get_input_devices()
+
+class SimulatedStream:
+    """
+    Callback stream driven by a thread instead of an audio interface
+
+    Blocks come from read_block(frames) and are delivered at the pace set
+    by speed (1.0 = realtime, 0 = as fast as possible).
+    """
+
+    def __init__(self, read_block, sample_rate, blocksize, callback, speed=1.0):
+        self.read_block = read_block
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize or DEFAULT_BLOCKSIZE
+        self.callback = callback
+        self.speed = speed
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        block_seconds = self.blocksize / self.sample_rate / self.speed if self.speed else 0
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            block = self.read_block(self.blocksize)
+            if block is None or len(block) == 0:
+                break
+            self.callback(block, len(block), None, None)
+            if block_seconds:
+                next_time += block_seconds
+                self._stop.wait(max(0.0, next_time - time.monotonic()))
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='simulated-capture', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+
+def _pace(started, duration, speed):
+    """
+    Sleep until a simulated recording of duration seconds would have finished
+    """
+    if speed:
+        remaining = duration / speed - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+def _match_channels(samples, channels):
+    """
+    Return (frames, channels) float32, duplicating or dropping channels
+    """
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    if samples.shape[1] >= channels:
+        return np.ascontiguousarray(samples[:, :channels])
+    return np.repeat(samples[:, :1], channels, axis=1)
+
+class FileReplayBackend(CaptureBackend):
+    """
+    Replay WAV/FLAC/Opus recordings as if they were captured live
+
+    Each file is one virtual device. Successive recordings continue where
+    the previous one stopped and wrap around at the end when looping.
+    """
+
+    name = 'file'
+
+    def __init__(self, paths=None, speed=None, loop=None):
+        """
+        :param paths: Files to replay, defaults to settings.AUDIO_REPLAY_FILES
+        :param speed: Replay speed; 1.0 is realtime, 0 as fast as possible
+        :param loop: Wrap around at the end of the file
+        """
+        self.paths = list(paths or getattr(settings, 'AUDIO_REPLAY_FILES', []))
+        if not self.paths:
+            raise ValueError("File replay backend needs AUDIO_REPLAY_FILES or a path")
+        self.speed = speed if speed is not None else getattr(settings, 'AUDIO_REPLAY_SPEED', 1.0)
+        self.loop = loop if loop is not None else getattr(settings, 'AUDIO_REPLAY_LOOP', True)
+        # Per file: one open handle, and the resampler state and resampled
+        # frames not yet returned when the stream rate differs from the file's
+        self._files = {}
+        self._resampling = {}
+        self._lock = threading.Lock()
+
+    def _read_file(self, f, frames):
+        """
+        Read up to frames from the file position, wrapping around when looping
+        """
+        chunks = []
+        while frames > 0:
+            if f.tell() >= f.frames:
+                if not self.loop or f.frames == 0:
+                    break
+                f.seek(0)
+            chunk = f.read(min(frames, f.frames - f.tell()), dtype='float32', always_2d=True)
+            chunks.append(chunk)
+            frames -= len(chunk)
+        if not chunks:
+            return np.zeros((0, f.channels), dtype=np.float32)
+        return np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+
+    def _read(self, device, frames, sample_rate):
+        """
+        Read the next frames of a file at sample_rate, advancing its position
+        """
+        index = (device or 0) % len(self.paths)
+
+        with self._lock:
+            f = self._files.get(index)
+            if f is None:
+                f = self._files[index] = sf.SoundFile(self.paths[index])
+            if f.samplerate == sample_rate:
+                return self._read_file(f, frames)
+
+            # Resample with filter state carried across reads, so blocks join seamlessly
+            state = self._resampling.get(index)
+            if state is None or state['sample_rate'] != sample_rate:
+                state = self._resampling[index] = {
+                    'sample_rate': sample_rate,
+                    'resampler': StreamingResampler(f.samplerate, sample_rate),
+                    'ready': np.zeros((0, f.channels), dtype=np.float32),
+                }
+            ready = [state['ready']]
+            available = len(state['ready'])
+            while available < frames:
+                needed = int(np.ceil((frames - available) * f.samplerate / sample_rate))
+                block = self._read_file(f, max(needed, DEFAULT_BLOCKSIZE))
+                output = state['resampler'].process(block, final=len(block) == 0)
+                ready.append(output)
+                available += len(output)
+                if len(block) == 0:
+                    break
+            data = np.concatenate(ready)
+            state['ready'] = data[frames:]
+            return data[:frames]
+
+    def record(self, duration, sample_rate, channels=1, device=None):
+        started = time.monotonic()
+        data = _match_channels(self._read(device, int(duration * sample_rate), sample_rate), channels)
+        _pace(started, len(data) / sample_rate, self.speed)
+        return data
+
+    def open_stream(self, device, channels, sample_rate, blocksize, callback):
+        def read_block(frames):
+            data = self._read(device, frames, sample_rate)
+            return _match_channels(data, channels) if len(data) else None
+
+        return SimulatedStream(read_block, sample_rate, blocksize, callback, self.speed)
+
+    def diagnose(self):
+        details = [
+            {'index': i, 'name': f'replay:{path}', 'max_input_channels': sf.info(path).channels}
+            for i, path in enumerate(self.paths)
+        ]
+        return [d['index'] for d in details], details
+
+class BeeSoundGenerator:
+    """
+    Continuous synthetic hive sound
+
+    A colony hum (fundamental with decaying harmonics, slow pitch drift and
+    amplitude modulation) over low-passed noise, with optional queen
+    tooting bursts. State carries over between calls so blocks join
+    without clicks.
+    """
+
+    def __init__(self, sample_rate, seed=None, hum_frequency=230.0, harmonics=6,
+                 noise_level=0.02, piping_rate=0.0, piping_frequency=420.0):
+        """
+        :param sample_rate: Output sampling rate
+        :param seed: Random seed for reproducible audio
+        :param hum_frequency: Mean hum fundamental in Hz
+        :param harmonics: Number of hum harmonics
+        :param noise_level: RMS of the background noise
+        :param piping_rate: Expected tooting bursts per second (0 disables)
+        :param piping_frequency: Tooting fundamental in Hz
+        """
+        self.sample_rate = sample_rate
+        self.rng = np.random.default_rng(seed)
+        self.hum_frequency = hum_frequency
+        self.harmonics = harmonics
+        self.noise_level = noise_level
+        self.piping_rate = piping_rate
+        self.piping_frequency = piping_frequency
+
+        self._phase = 0.0
+        self._drift = 0.0
+        self._t = 0.0
+        self._noise_state = np.zeros(1)
+        self._toot_remaining = 0
+        self._toot_phase = 0.0
+
+    def generate(self, frames):
+        """
+        Return the next frames of mono float32 audio
+        """
+        sr = self.sample_rate
+        t = self._t + np.arange(frames) / sr
+
+        # Fundamental drifts by a few Hz as a slow random walk
+        drift_end = np.clip(self._drift + self.rng.normal(0, 0.5 * np.sqrt(frames / sr)), -8, 8)
+        frequency = self.hum_frequency + np.linspace(self._drift, drift_end, frames, endpoint=False)
+        self._drift = drift_end
+
+        phase = self._phase + 2 * np.pi * np.cumsum(frequency) / sr
+        self._phase = float(phase[-1] % (2 * np.pi))
+        hum = sum(np.sin(k * phase) / k for k in range(1, self.harmonics + 1))
+        hum *= 0.8 + 0.2 * np.sin(2 * np.pi * 0.5 * t)
+
+        # One-pole low-passed noise, continuous across blocks
+        white = self.rng.normal(0, 1, frames)
+        noise, self._noise_state = signal.lfilter(
+            [1 - NOISE_POLE], [1, -NOISE_POLE], white, zi=self._noise_state
+        )
+        noise *= self.noise_level / np.sqrt((1 - NOISE_POLE) / (1 + NOISE_POLE))
+
+        y = 0.05 * hum + noise
+        y += self._tooting(frames)
+
+        self._t = float(t[-1] + 1 / sr) if frames else self._t
+        return y.astype(np.float32)
+
+    def _tooting(self, frames):
+        sr = self.sample_rate
+        out = np.zeros(frames)
+        position = 0
+        while position < frames:
+            if self._toot_remaining == 0:
+                if not self.piping_rate:
+                    break
+                # Wait for the next burst (exponential inter-arrival)
+                gap = int(self.rng.exponential(1 / self.piping_rate) * sr)
+                position += gap
+                if position >= frames:
+                    break
+                self._toot_remaining = int(self.rng.uniform(0.3, 1.0) * sr)
+            n = min(self._toot_remaining, frames - position)
+            phase = self._toot_phase + 2 * np.pi * self.piping_frequency * np.arange(1, n + 1) / sr
+            out[position:position + n] = 0.08 * (np.sin(phase) + 0.5 * np.sin(2 * phase))
+            self._toot_phase = float(phase[-1] % (2 * np.pi))
+            self._toot_remaining -= n
+            position += n
+        return out
+
+class SyntheticBackend(CaptureBackend):
+    """
+    Generate bee-like audio; one independent generator per virtual device
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, devices=None, speed=None, seed=None, **generator_options):
+        """
+        :param devices: Number of virtual input devices
+        :param speed: Generation pace; 1.0 is realtime, 0 as fast as possible
+        :param seed: Base random seed
+        :param generator_options: Extra BeeSoundGenerator arguments,
+            defaults to settings.AUDIO_SYNTHETIC_OPTIONS
+        """
+        self.devices = devices or getattr(settings, 'AUDIO_SYNTHETIC_DEVICES', 1)
+        self.speed = speed if speed is not None else getattr(settings, 'AUDIO_REPLAY_SPEED', 1.0)
+        self.seed = seed
+        self.generator_options = generator_options or getattr(settings, 'AUDIO_SYNTHETIC_OPTIONS', {})
+        self._generators = {}
+        self._lock = threading.Lock()
+
+    def _generator(self, device, sample_rate):
+        key = (device or 0, sample_rate)
+        with self._lock:
+            if key not in self._generators:
+                seed = None if self.seed is None else self.seed + key[0]
+                self._generators[key] = BeeSoundGenerator(sample_rate, seed, **self.generator_options)
+            return self._generators[key]
+
+    def record(self, duration, sample_rate, channels=1, device=None):
+        started = time.monotonic()
+        samples = self._generator(device, sample_rate).generate(int(duration * sample_rate))
+        _pace(started, duration, self.speed)
+        return _match_channels(samples, channels)
+
+    def open_stream(self, device, channels, sample_rate, blocksize, callback):
+        generator = self._generator(device, sample_rate)
+        return SimulatedStream(
+            lambda frames: _match_channels(generator.generate(frames), channels),
+            sample_rate, blocksize, callback, self.speed
+        )
+
+    def diagnose(self):
+        details = [
+            {'index': i, 'name': f'synthetic:{i}', 'max_input_channels': 1}
+            for i in range(self.devices)
+        ]
+        return [d['index'] for d in details], details
+
+CAPTURE_BACKENDS = {
+    SoundDeviceBackend.name: SoundDeviceBackend,
+    FileReplayBackend.name: FileReplayBackend,
+    SyntheticBackend.name: SyntheticBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_capture_backend(spec=None):
+    """
+    Return the capture backend for a spec, creating it once
+
+    :param spec: 'sounddevice', 'synthetic', 'file' or 'file:<path>[,<path>...]';
+        defaults to settings.AUDIO_CAPTURE_BACKEND
+    :return: CaptureBackend instance
+    """
+    spec = spec or getattr(settings, 'AUDIO_CAPTURE_BACKEND', DEFAULT_BACKEND)
+    name, _, argument = spec.partition(':')
+    name = name.lower()
+    if name not in CAPTURE_BACKENDS:
+        raise ValueError(f"Unknown capture backend '{name}', expected one of {sorted(CAPTURE_BACKENDS)}")
+
+    with _backends_lock:
+        if spec not in _backends:
+            if name == FileReplayBackend.name and argument:
+                _backends[spec] = FileReplayBackend(argument.split(','))
+            else:
+                _backends[spec] = CAPTURE_BACKENDS[name]()
+            logger.info(f"Using capture backend: {spec}")
+        return _backends[spec]
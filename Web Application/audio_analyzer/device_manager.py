@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# PortAudio may be missing on headless hosts that use another capture backend
+try:
+    import sounddevice as sd
+except (ImportError, OSError) as e:
+    sd = None
+    logger.warning(f"sounddevice unavailable, no hardware audio devices: {e}")
+
+# Seconds between background device re-enumerations
+DEFAULT_REFRESH_SECONDS = 30
+
+# Longest a caller waits for the very first enumeration
+INITIAL_ENUMERATION_TIMEOUT = 10
+
+class AudioDeviceManager:
+    """
+    Enumerate audio devices once and serve them from memory
+
+    A background thread re-enumerates on a timer or when notify_hotplug()
+    is called, so page loads and API calls never touch PortAudio. PortAudio
+    only sees newly plugged devices after re-initialization, which tears
+    down every open stream; it is therefore never done on the timer, only
+    after notify_hotplug() and only once no capture is registered. Captures
+    register with capture_started() before opening their stream. Per-device
+    health statistics are kept alongside the cached list.
+    """
+
+    def __init__(self, refresh_seconds=None):
+        """
+        :param refresh_seconds: Re-enumeration interval, defaults to
+            settings.AUDIO_DEVICE_REFRESH_SECONDS
+        """
+        self.refresh_seconds = refresh_seconds or getattr(
+            settings, 'AUDIO_DEVICE_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS
+        )
+        self._devices = None
+        self._health = {}
+        self._active_captures = 0
+        self._reinitialize = False
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.last_refresh = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audio-device-manager', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Audio device enumeration failed: {e}")
+            finally:
+                self._loaded.set()
+            self._wakeup.wait(self.refresh_seconds)
+            self._wakeup.clear()
+
+    def _enumerate(self):
+        if sd is None:
+            return []
+
+        # Re-open PortAudio so hotplugged devices show up. Captures register
+        # under the lock before opening a stream, so none can be opening or
+        # open while it is down; otherwise the request waits for them to stop.
+        with self._lock:
+            if self._reinitialize and self._active_captures == 0:
+                self._reinitialize = False
+                if self._devices is not None:
+                    sd._terminate()
+                    sd._initialize()
+
+        return [
+            {
+                'index': i,
+                'name': device.get('name', 'Unknown Device'),
+                'max_input_channels': device.get('max_input_channels', 0),
+                'max_output_channels': device.get('max_output_channels', 0),
+                'default_samplerate': device.get('default_samplerate'),
+                'hostapi': device.get('hostapi'),
+            }
+            for i, device in enumerate(sd.query_devices())
+        ]
+
+    def refresh(self):
+        """
+        Re-enumerate devices now and log any hotplug changes
+
+        :return: The new device list
+        """
+        devices = self._enumerate()
+        now = time.time()
+
+        with self._lock:
+            previous = {d['name'] for d in self._devices} if self._devices is not None else None
+            self._devices = devices
+            self.last_refresh = now
+            for device in devices:
+                health = self._health.setdefault(device['name'], _new_health())
+                health['last_seen'] = now
+
+        if previous is not None:
+            current = {d['name'] for d in devices}
+            for name in current - previous:
+                logger.info(f"Audio device connected: {name}")
+            for name in previous - current:
+                logger.warning(f"Audio device disconnected: {name}")
+
+        return devices
+
+    def notify_hotplug(self):
+        """
+        Ask the background thread to re-initialize PortAudio and re-enumerate
+
+        Re-initialization is deferred until no capture is registered.
+        """
+        with self._lock:
+            self._reinitialize = True
+        self._ensure_started()
+        self._wakeup.set()
+
+    def get_devices(self):
+        """
+        Return the cached list of all devices
+
+        Blocks only on the first call, until the initial enumeration
+        finishes or times out.
+        """
+        self._ensure_started()
+        if not self._loaded.is_set():
+            self._loaded.wait(INITIAL_ENUMERATION_TIMEOUT)
+        with self._lock:
+            return list(self._devices or [])
+
+    def get_input_devices(self):
+        """
+        Return the cached list of devices with input channels
+        """
+        return [
+            {
+                'index': device['index'],
+                'name': device['name'],
+                'max_input_channels': device['max_input_channels']
+            }
+            for device in self.get_devices()
+            if device['max_input_channels'] > 0
+        ]
+
+    def get_device(self, index):
+        """
+        Return the cached entry for one device index, or None
+        """
+        devices = self.get_devices()
+        return devices[index] if 0 <= index < len(devices) else None
+
+    def _device_name(self, device):
+        if isinstance(device, str):
+            return device
+        entry = self.get_device(device) if device is not None else None
+        return entry['name'] if entry else str(device)
+
+    def capture_started(self, device):
+        """
+        Register a capture on a device; call before opening its stream
+        """
+        name = self._device_name(device)
+        with self._lock:
+            self._active_captures += 1
+            health = self._health.setdefault(name, _new_health())
+            health['opens'] += 1
+
+    def capture_stopped(self, device):
+        """
+        Unregister a capture once its stream is closed (or failed to open)
+        """
+        with self._lock:
+            self._active_captures = max(0, self._active_captures - 1)
+            pending = self._reinitialize and self._active_captures == 0
+        if pending:
+            self._wakeup.set()
+
+    def capture_failed(self, device, error):
+        """
+        Record a failure to open or read a device
+        """
+        name = self._device_name(device)
+        with self._lock:
+            health = self._health.setdefault(name, _new_health())
+            health['failures'] += 1
+            health['last_error'] = str(error)
+            health['last_error_time'] = time.time()
+        self.notify_hotplug()
+
+    @contextmanager
+    def in_use(self, device):
+        """
+        Mark a device busy for a blocking recording such as sd.rec()
+
+        Usage: with device_manager.in_use(device_index): ...
+        """
+        self.capture_started(device)
+        try:
+            yield
+        except Exception as e:
+            self.capture_failed(device, e)
+            raise
+        finally:
+            self.capture_stopped(device)
+
+    def stream_status(self, device, status):
+        """
+        Record an overflow/underflow status reported by a stream callback
+        """
+        name = self._device_name(device)
+        with self._lock:
+            health = self._health.setdefault(name, _new_health())
+            health['status_errors'] += 1
+            health['last_status'] = str(status)
+
+    def get_health(self):
+        """
+        Return a copy of the per-device health statistics, keyed by name
+        """
+        with self._lock:
+            return {name: dict(health) for name, health in self._health.items()}
+
+def _new_health():
+    return {
+        'opens': 0,
+        'failures': 0,
+        'status_errors': 0,
+        'last_error': None,
+        'last_error_time': None,
+        'last_status': None,
+        'last_seen': None,
+    }
+
+# Create a global audio device manager instance
+device_manager = AudioDeviceManager()
@@ -1,13 +1,35 @@
 import discord
 import asyncio
+import atexit
 import logging
 import os
 import json
+import threading
+import time
+import concurrent.futures
 from django.conf import settings
 import aiohttp
+from PIL import Image
+
+from .spectrogram import encode_image
 
 logger = logging.getLogger('audio_analyzer.discord_utils')
 
+DISCORD_API_URL = 'https://discord.com/api/v10'
+
+# Messages waiting for delivery before new ones are refused
+DEFAULT_QUEUE_SIZE = 1000
+
+# Attempts for network errors and 5xx responses; 429s are retried indefinitely
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 2.0
+
+# Maximum (width, height) of WebP thumbnails sent instead of full images
+DEFAULT_THUMBNAIL_SIZE = (640, 256)
+
+# Seconds the process waits at exit for queued messages
+EXIT_FLUSH_SECONDS = 10
+
 def format_discord_notification(prediction_data, frequency_data=None):
     """
     Format a detailed Discord notification with prediction and frequency data
@@ -29,11 +51,13 @@ def format_discord_notification(prediction_data, frequency_data=None):
     # Add frequency data if available
     if frequency_data:
         notification["Frequency Analysis"] = {
-            "Dominant Frequency": frequency_data.get('dominant_frequency', 'N/A'),
+            "Peak Frequency": frequency_data.get('peak_frequency', 'N/A'),
             "Frequency Range": frequency_data.get('frequency_range', 'N/A'),
             "Spectral Centroid": frequency_data.get('spectral_centroid', 'N/A'),
             "Spectral Bandwidth": frequency_data.get('spectral_bandwidth', 'N/A'),
-            "Spectral Rolloff": frequency_data.get('spectral_rolloff', 'N/A')
+            "Spectral Rolloff": frequency_data.get('spectral_rolloff', 'N/A'),
+            "RMS Amplitude": frequency_data.get('rms', 'N/A'),
+            "Band Energy Ratios": frequency_data.get('band_energy_ratios', 'N/A')
         }
     
     # Convert to formatted JSON-like string
@@ -44,109 +68,291 @@ def format_discord_notification(prediction_data, frequency_data=None):
     
     return formatted_message
 
-async def send_discord_message_async(message, image_path=None, prediction_data=None, frequency_data=None):
+def open_attachment(image_path):
     """
-    Send a message to a Discord channel without running a full bot.
-    This function should be called from an async context or with asyncio.run()
-    
-    :param message: Optional custom message
-    :param image_path: Optional path to an image to attach
-    :param prediction_data: Optional prediction data for detailed notification
-    :param frequency_data: Optional frequency analysis data
+    Prepare an image for upload
+
+    With settings.DISCORD_ATTACHMENT = 'thumbnail' the image is downscaled
+    to DISCORD_THUMBNAIL_SIZE and encoded as WebP in memory; otherwise the
+    file itself is opened and streamed from disk when the message is sent.
+    An open handle keeps the file readable even if it is deleted meanwhile.
+
+    :param image_path: Image path
+    :return: (filename, bytes or open file), or None if the image is missing
     """
     try:
-        # Get Discord configuration from settings
+        if getattr(settings, 'DISCORD_ATTACHMENT', 'image') == 'thumbnail':
+            size = tuple(getattr(settings, 'DISCORD_THUMBNAIL_SIZE', DEFAULT_THUMBNAIL_SIZE))
+            with Image.open(image_path) as image:
+                image.thumbnail(size, reducing_gap=2.0)
+                data = encode_image(image.convert('RGB'), image_format='webp')
+            return os.path.splitext(os.path.basename(image_path))[0] + '.webp', data
+        return os.path.basename(image_path), open(image_path, 'rb')
+    except FileNotFoundError:
+        logger.warning(f"Discord attachment {image_path} not found, sending text only")
+        return None
+
+def _close_attachment(attachment):
+    if attachment is not None and hasattr(attachment[1], 'close'):
+        attachment[1].close()
+
+class DiscordNotifier:
+    """
+    Deliver Discord messages from one long-lived background event loop
+
+    Callers enqueue a message and return immediately. A single worker
+    coroutine sends them in order over one pooled aiohttp session, so the
+    TLS connection is reused between messages. Discord's rate limits are
+    tracked per route bucket from the X-RateLimit-* response headers: a
+    request waits until its bucket resets instead of running into a 429,
+    and a 429 is retried after its retry_after (per bucket or global)
+    without dropping the message.
+    """
+
+    def __init__(self, queue_size=None):
+        """
+        :param queue_size: Maximum queued messages, defaults to settings.DISCORD_QUEUE_SIZE
+        """
+        self._queue_size = queue_size
+        self._loop = None
+        self._queue = None
+        self._session = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+        # Route -> bucket id, and bucket id -> (remaining, reset at loop time)
+        self._route_buckets = {}
+        self._buckets = {}
+        self._global_reset = 0.0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(ready,), name='discord-notifier', daemon=True)
+                self._thread.start()
+                ready.wait()
+
+    def _run(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(self._queue_size or getattr(settings, 'DISCORD_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        self._loop.create_task(self._worker())
+        ready.set()
+        self._loop.run_forever()
+
+    def submit(self, message=None, image_path=None, prediction_data=None, frequency_data=None):
+        """
+        Queue a message for delivery
+
+        :param message: Optional custom message
+        :param image_path: Optional image to attach; opened now, so it may be
+            removed before the message is sent
+        :param prediction_data: Optional prediction data for detailed notification
+        :param frequency_data: Optional frequency analysis data
+        :return: concurrent.futures.Future resolving to True once delivered
+            (False if delivery failed), or None if the message was refused
+        """
         token = settings.DISCORD_BOT_TOKEN
         channel_id = settings.DISCORD_CHANNEL_ID
-        
-        logger.info(f"Discord async function called with token length {len(token) if token else 0} and channel ID {channel_id}")
-        
         if not token or channel_id == 0:
             logger.error("Discord configuration missing. Set DISCORD_BOT_TOKEN and DISCORD_CHANNEL_ID in settings.")
+            return None
+
+        if prediction_data:
+            # Use formatted notification if prediction data is provided
+            content = format_discord_notification(prediction_data, frequency_data)
+        else:
+            content = message or "No message provided"
+
+        attachment = open_attachment(image_path) if image_path else None
+
+        self._ensure_worker()
+        future = concurrent.futures.Future()
+        item = (token, channel_id, content, attachment, future)
+
+        def enqueue():
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                logger.error("Discord queue is full, dropping message")
+                _close_attachment(attachment)
+                self._done(future, None)
+
+        with self._lock:
+            self._pending += 1
+        self._loop.call_soon_threadsafe(enqueue)
+        return future
+
+    def _done(self, future, result):
+        future.set_result(result)
+        with self._lock:
+            self._pending -= 1
+            self._idle.notify_all()
+
+    async def _worker(self):
+        while True:
+            token, channel_id, content, attachment, future = await self._queue.get()
+            try:
+                result = await self._deliver(token, channel_id, content, attachment)
+            except Exception as e:
+                logger.error(f"Error sending Discord message: {e}")
+                result = False
+            finally:
+                _close_attachment(attachment)
+            self._done(future, result)
+
+    async def _deliver(self, token, channel_id, content, attachment):
+        route = f'POST /channels/{channel_id}/messages'
+        url = f'{DISCORD_API_URL}/channels/{channel_id}/messages'
+        headers = {"Authorization": f"Bot {token}"}
+
+        if attachment is None:
+            def payload():
+                return {'json': {'content': content}}
+        else:
+            # Text and image in one multipart request; aiohttp sets the boundary
+            filename, data = attachment
+
+            def payload():
+                body = data
+                if hasattr(data, 'fileno'):
+                    # aiohttp closes a streamed file when done: give each
+                    # attempt its own descriptor and keep the original open
+                    body = os.fdopen(os.dup(data.fileno()), 'rb')
+                    body.seek(0)
+                form = aiohttp.FormData()
+                form.add_field('payload_json', json.dumps({
+                    'content': content,
+                    'attachments': [{'id': 0, 'filename': filename}]
+                }), content_type='application/json')
+                form.add_field('files[0]', body, filename=filename)
+                return {'data': form}
+
+        if not await self._request(route, url, headers, payload):
             return False
-        
-        # Use async context manager for aiohttp session
-        async with aiohttp.ClientSession() as session:
-            # Create Discord API endpoint URL
-            url = f"https://discord.com/api/v10/channels/{channel_id}/messages"
-            
-            # Prepare headers
-            headers = {
-                "Authorization": f"Bot {token}",
-                "Content-Type": "application/json"
-            }
-            
-            # Prepare payload
-            if prediction_data:
-                # Use formatted notification if prediction data is provided
-                payload = {
-                    "content": format_discord_notification(
-                        prediction_data, 
-                        frequency_data
-                    )
-                }
-            else:
-                # Use default or custom message
-                payload = {
-                    "content": message or "No message provided"
-                }
-            
-            # Send message
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    logger.info("Discord message sent successfully")
-                    
-                    # Send image if provided
-                    if image_path and os.path.exists(image_path):
-                        # Create Discord API endpoint URL for image upload
-                        image_url = f"https://discord.com/api/v10/channels/{channel_id}/messages"
-                        
-                        # Prepare headers for image upload
-                        image_headers = {
-                            "Authorization": f"Bot {token}",
-                            "Content-Type": "multipart/form-data"
-                        }
-                        
-                        # Prepare payload for image upload
-                        image_payload = aiohttp.FormData()
-                        image_payload.add_field('file', open(image_path, 'rb'), filename=os.path.basename(image_path))
-                        image_payload.add_field('payload_json', '{"content": ""}')
-                        
-                        # Send image
-                        async with session.post(image_url, headers=image_headers, data=image_payload) as image_response:
-                            if image_response.status == 200:
-                                logger.info("Discord image sent successfully")
-                            else:
-                                logger.error(f"Failed to send Discord image. Status: {image_response.status}, Response: {await image_response.text()}")
-                    
-                    return True
-                else:
-                    logger.error(f"Failed to send Discord message. Status: {response.status}, Response: {await response.text()}")
+        logger.info("Discord message sent successfully" + (" with image" if attachment else ""))
+        return True
+
+    async def _request(self, route, url, headers, payload):
+        # payload() builds a fresh body per attempt: a FormData can only be sent once
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+
+        attempt = 0
+        while True:
+            await self._wait_for_bucket(route)
+            try:
+                async with self._session.post(url, headers=headers, **payload()) as response:
+                    self._update_bucket(route, response.headers)
+                    if response.status in (200, 201, 204):
+                        return True
+                    body = await response.text()
+                    if response.status == 429:
+                        self._rate_limited(route, response.headers, body)
+                        continue
+                    if response.status < 500:
+                        logger.error(f"Failed to send Discord message. Status: {response.status}, Response: {body}")
+                        return False
+                    error = f"Status: {response.status}, Response: {body}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+
+            attempt += 1
+            if attempt >= MAX_ATTEMPTS:
+                logger.error(f"Giving up on Discord message after {attempt} attempts: {error}")
+                return False
+            delay = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            logger.warning(f"Discord request failed ({error}), retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+    async def _wait_for_bucket(self, route):
+        now = self._loop.time()
+        wait = self._global_reset - now
+        bucket = self._buckets.get(self._route_buckets.get(route))
+        if bucket and bucket[0] <= 0:
+            wait = max(wait, bucket[1] - now)
+        if wait > 0:
+            logger.info(f"Discord rate limit reached, waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def _update_bucket(self, route, headers):
+        bucket_id = headers.get('X-RateLimit-Bucket')
+        if not bucket_id or 'X-RateLimit-Remaining' not in headers:
+            return
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset_after = float(headers.get('X-RateLimit-Reset-After', 0))
+        except ValueError:
+            return
+        self._route_buckets[route] = bucket_id
+        self._buckets[bucket_id] = (remaining, self._loop.time() + reset_after)
+
+    def _rate_limited(self, route, headers, body):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = {}
+        retry_after = float(data.get('retry_after') or headers.get('Retry-After') or 1.0)
+        reset_at = self._loop.time() + retry_after
+        if data.get('global') or headers.get('X-RateLimit-Global'):
+            self._global_reset = reset_at
+        else:
+            bucket_id = self._route_buckets.get(route, route)
+            self._route_buckets[route] = bucket_id
+            self._buckets[bucket_id] = (0, reset_at)
+        logger.warning(f"Discord rate limited {route}, retrying in {retry_after:.2f}s")
+
+    def flush(self, timeout=None):
+        """
+        Block until every queued message has been delivered or has failed
+
+        :param timeout: Maximum time to wait in seconds
+        :return: True if the queue drained
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            while self._pending:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
                     return False
-    
-    except Exception as e:
-        logger.error(f"Error in send_discord_message_async: {e}")
-        return False
+                self._idle.wait(remaining)
+        return True
 
-def send_discord_message(message, image_path=None, prediction_data=None, frequency_data=None):
+    def close(self, timeout=EXIT_FLUSH_SECONDS):
+        """
+        Deliver what is queued, then close the session
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        if not self.flush(timeout):
+            logger.warning(f"{self._pending} Discord message(s) still queued at exit")
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(5)
+
+def send_discord_message(message, image_path=None, prediction_data=None, frequency_data=None, wait=False):
     """
-    Synchronous wrapper for async Discord message sending
-    
+    Queue a Discord message on the background notifier
+
     :param message: Optional custom message
     :param image_path: Optional path to an image to attach
     :param prediction_data: Optional prediction data for detailed notification
     :param frequency_data: Optional frequency analysis data
-    :return: Boolean indicating message sending success
+    :param wait: Block until the message has been delivered
+    :return: Boolean indicating the message was queued (or, with wait, delivered)
     """
     try:
-        return asyncio.run(
-            send_discord_message_async(
-                message, 
-                image_path, 
-                prediction_data, 
-                frequency_data
-            )
-        )
+        future = discord_notifier.submit(message, image_path, prediction_data, frequency_data)
+        if future is None:
+            return False
+        if wait:
+            return bool(future.result(timeout=60))
+        return True
     except Exception as e:
-        logger.error(f"Error running async Discord message: {e}")
-        return False
\ No newline at end of file
+        logger.error(f"Error queueing Discord message: {e}")
+        return False
+
+# Global Discord notifier
+discord_notifier = DiscordNotifier()
+atexit.register(discord_notifier.close)
@@ -0,0 +1,507 @@
+import os
+import re
+import json
+import uuid
+import fcntl
+import queue
+import shutil
+import logging
+import threading
+import time
+import soundfile as sf
+from django.conf import settings
+
+from .archive_utils import ARCHIVE_FORMATS, get_archive_format
+
+logger = logging.getLogger(__name__)
+
+# Upload formats accepted from remote capture nodes
+UPLOAD_FORMATS = {'wav': '.wav', 'flac': '.flac', 'pcm': '.raw'}
+
+# Raw PCM sample types and their libsndfile subtypes
+PCM_SUBTYPES = {'int16': 'PCM_16', 'int32': 'PCM_32', 'float32': 'FLOAT'}
+
+# Bytes read from the request stream per write
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Frames per block when converting raw PCM to the archive format
+CONVERT_BLOCK_FRAMES = 65536
+
+# Default upper bound for a single upload (500 MB)
+DEFAULT_MAX_UPLOAD_BYTES = 500 * 1024 * 1024
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Statuses of completed uploads whose analysis has not finished
+PENDING_STATUSES = ('queued', 'analyzing')
+
+class UploadError(Exception):
+    """
+    Upload request that cannot be applied; carries the HTTP status to return
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def uploads_dir():
+    """
+    Return the directory that holds in-progress uploads
+    """
+    return os.path.join(settings.MEDIA_ROOT, 'uploads')
+
+class UploadStore:
+    """
+    Resumable uploads written straight to disk
+
+    Each upload is a '<id>.part' file plus a '<id>.json' metadata sidecar.
+    The byte offset is the size of the part file, so a node that lost its
+    connection asks for the offset and continues from there. Chunks are
+    streamed from the request in STREAM_CHUNK_SIZE pieces and never held
+    in memory as a whole body. Writers hold an exclusive flock on the part
+    file, so overlapping requests are rejected even across server processes.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, upload_id):
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _paths(self, upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            raise UploadError('Invalid upload id', status=404)
+        base = os.path.join(uploads_dir(), upload_id)
+        return base + '.part', base + '.json'
+
+    def _save_metadata(self, upload_id, metadata):
+        _, meta_path = self._paths(upload_id)
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, meta_path)
+
+    def create(self, hive_id, upload_format, total_size=None, sample_rate=None, channels=1, dtype='int16'):
+        """
+        Register a new upload
+
+        :param hive_id: Hive the audio was captured at
+        :param upload_format: 'wav', 'flac' or 'pcm'
+        :param total_size: Expected size in bytes, if known up front
+        :param sample_rate: Sampling rate, required for raw PCM
+        :param channels: Channel count for raw PCM
+        :param dtype: Sample type for raw PCM ('int16', 'int32' or 'float32')
+        :return: Upload metadata dictionary
+        """
+        if upload_format not in UPLOAD_FORMATS:
+            raise UploadError(f"Unsupported format '{upload_format}', expected one of {sorted(UPLOAD_FORMATS)}")
+        if upload_format == 'pcm':
+            if not sample_rate:
+                raise UploadError('sample_rate is required for raw PCM uploads')
+            if dtype not in PCM_SUBTYPES:
+                raise UploadError(f"Unsupported PCM dtype '{dtype}', expected one of {sorted(PCM_SUBTYPES)}")
+
+        max_bytes = getattr(settings, 'INGEST_MAX_UPLOAD_BYTES', DEFAULT_MAX_UPLOAD_BYTES)
+        if total_size is not None and total_size > max_bytes:
+            raise UploadError(f'Upload exceeds the {max_bytes} byte limit', status=413)
+
+        upload_id = uuid.uuid4().hex
+        part_path, _ = self._paths(upload_id)
+        os.makedirs(uploads_dir(), exist_ok=True)
+        open(part_path, 'wb').close()
+
+        metadata = {
+            'upload_id': upload_id,
+            'hive_id': re.sub(r'[^A-Za-z0-9_-]', '_', str(hive_id or 'remote')),
+            'format': upload_format,
+            'total_size': total_size,
+            'sample_rate': sample_rate,
+            'channels': channels,
+            'dtype': dtype,
+            'status': 'uploading',
+            'created': time.time(),
+        }
+        self._save_metadata(upload_id, metadata)
+        logger.info(f"Created upload {upload_id} for hive {metadata['hive_id']} ({upload_format})")
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        """
+        Return the metadata of an upload with its current 'offset'
+        """
+        part_path, meta_path = self._paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise UploadError('Upload not found', status=404)
+        with open(meta_path) as f:
+            metadata = json.load(f)
+        metadata['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else metadata.get('offset', 0)
+        return metadata
+
+    def append(self, upload_id, offset, stream):
+        """
+        Append the next chunk of an upload from a file-like stream
+
+        :param upload_id: Upload identifier
+        :param offset: Byte offset the chunk starts at; must equal the
+            current size of the upload
+        :param stream: File-like object read in STREAM_CHUNK_SIZE pieces
+        :return: New offset
+        """
+        max_bytes = getattr(settings, 'INGEST_MAX_UPLOAD_BYTES', DEFAULT_MAX_UPLOAD_BYTES)
+        part_path, _ = self._paths(upload_id)
+
+        with self._open_part(upload_id, part_path) as f:
+            # Checked under the file lock, so a writer in another process cannot slip in between
+            metadata = self.get(upload_id)
+            if metadata['status'] != 'uploading':
+                raise UploadError(f"Upload is already {metadata['status']}", status=409)
+            if offset != metadata['offset']:
+                raise UploadError(f"Offset mismatch, upload is at {metadata['offset']}", status=409)
+
+            limit = min(max_bytes, metadata['total_size'] or max_bytes)
+            written = offset
+            while True:
+                chunk = stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    # Keep what fits so the node can resume after fixing its request
+                    f.write(chunk[:len(chunk) - (written - limit)])
+                    raise UploadError(f'Upload exceeds the {limit} byte limit', status=413)
+                f.write(chunk)
+            return written
+
+    def _open_part(self, upload_id, part_path):
+        """
+        Open the part file for appending under an exclusive, non-blocking
+        flock, which also excludes writers in other server processes
+
+        :return: Open binary file; closing it releases the lock
+        :raises UploadError: Another request holds the lock, or the upload
+            was already completed
+        """
+        try:
+            # Never create it: a missing part file means the upload was completed
+            fd = os.open(part_path, os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            raise UploadError(f"Upload is already {self.get(upload_id)['status']}", status=409)
+        f = os.fdopen(fd, 'ab')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise UploadError('Another request is writing to this upload', status=409)
+        return f
+
+    def complete(self, upload_id):
+        """
+        Finish an upload and move it into its recording session
+
+        Raw PCM is converted block by block to the archive format; WAV and
+        FLAC uploads are checked to be decodable and moved as they are.
+
+        :return: Tuple of (metadata, absolute audio path)
+        """
+        part_path, _ = self._paths(upload_id)
+        lock = self._lock_for(upload_id)
+        with lock, self._open_part(upload_id, part_path):
+            metadata = self.get(upload_id)
+            if metadata['status'] != 'uploading':
+                raise UploadError(f"Upload is already {metadata['status']}", status=409)
+            if metadata['total_size'] is not None and metadata['offset'] != metadata['total_size']:
+                raise UploadError(
+                    f"Upload incomplete: {metadata['offset']} of {metadata['total_size']} bytes", status=409
+                )
+            if metadata['offset'] == 0:
+                raise UploadError('Upload is empty')
+
+            # Its own top-level session, pruned and listed like local recordings
+            session_dir = os.path.join(settings.MEDIA_ROOT, 'recordings', f'upload_{upload_id}')
+            os.makedirs(session_dir, exist_ok=True)
+            base_path = os.path.join(session_dir, f"{metadata['hive_id']}_recording")
+
+            try:
+                if metadata['format'] == 'pcm':
+                    audio_path = self._convert_pcm(part_path, base_path, metadata)
+                    os.remove(part_path)
+                else:
+                    audio_path = base_path + UPLOAD_FORMATS[metadata['format']]
+                    sf.info(part_path)
+                    os.replace(part_path, audio_path)
+                    os.chmod(audio_path, 0o644)
+            except UploadError:
+                raise
+            except Exception as e:
+                shutil.rmtree(session_dir, ignore_errors=True)
+                raise UploadError(f'Uploaded audio could not be decoded: {e}', status=422)
+
+            metadata['status'] = 'queued'
+            metadata['offset'] = os.path.getsize(audio_path)
+            metadata['audio_path'] = os.path.relpath(audio_path, settings.MEDIA_ROOT)
+            self._save_metadata(upload_id, metadata)
+
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+        logger.info(f"Completed upload {upload_id} -> {audio_path}")
+        return metadata, audio_path
+
+    def _convert_pcm(self, part_path, base_path, metadata):
+        # Opus needs resampling of the whole signal, so stream raw PCM to FLAC instead
+        archive_format = get_archive_format()
+        if archive_format == 'opus':
+            archive_format = 'flac'
+        spec = ARCHIVE_FORMATS[archive_format]
+        audio_path = base_path + spec['extension']
+
+        with sf.SoundFile(part_path, format='RAW', samplerate=int(metadata['sample_rate']),
+                          channels=int(metadata['channels']), subtype=PCM_SUBTYPES[metadata['dtype']]) as src, \
+             sf.SoundFile(audio_path, 'w', samplerate=src.samplerate, channels=src.channels,
+                          format=spec['format'], subtype=spec['subtype']) as dst:
+            for block in src.blocks(blocksize=CONVERT_BLOCK_FRAMES, dtype='float32'):
+                dst.write(block)
+        os.chmod(audio_path, 0o644)
+        return audio_path
+
+    def update_status(self, upload_id, status, result=None):
+        """
+        Record the analysis status (and result) of a completed upload
+        """
+        with self._lock_for(upload_id):
+            metadata = self.get(upload_id)
+            metadata['status'] = status
+            if result is not None:
+                metadata['result'] = result
+            self._save_metadata(upload_id, metadata)
+
+    def pending(self):
+        """
+        List completed uploads still waiting for (or interrupted during)
+        analysis, oldest first
+
+        :return: List of (upload_id, absolute audio path)
+        """
+        if not os.path.isdir(uploads_dir()):
+            return []
+        pending = []
+        for name in os.listdir(uploads_dir()):
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json' or not UPLOAD_ID_PATTERN.match(upload_id):
+                continue
+            try:
+                metadata = self.get(upload_id)
+            except (UploadError, OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable upload {upload_id}: {e}")
+                continue
+            if metadata['status'] in PENDING_STATUSES and metadata.get('audio_path'):
+                audio_path = os.path.join(settings.MEDIA_ROOT, metadata['audio_path'])
+                pending.append((metadata.get('created', 0), upload_id, audio_path))
+        return [(upload_id, audio_path) for _, upload_id, audio_path in sorted(pending)]
+
+    def claim(self, upload_id):
+        """
+        Take the analysis lock of an upload that is still pending
+
+        Several server processes can re-queue the same upload on startup;
+        only the one holding this lock analyzes it.
+
+        :return: Open lock file to pass to release(), or None if another
+            process holds it or the analysis already finished
+        """
+        lock_file = open(os.path.join(uploads_dir(), upload_id + '.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if self.get(upload_id)['status'] in PENDING_STATUSES:
+                return lock_file
+        except BlockingIOError:
+            pass
+        except BaseException:
+            lock_file.close()
+            raise
+        lock_file.close()
+        return None
+
+    def release(self, upload_id, lock_file):
+        """
+        Drop the analysis lock taken by claim()
+        """
+        try:
+            # A process that opened the old file rechecks the status after locking it
+            os.remove(lock_file.name)
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+    def delete(self, upload_id):
+        """
+        Abandon an upload that has not been completed
+        """
+        part_path, meta_path = self._paths(upload_id)
+        with self._lock_for(upload_id):
+            metadata = self.get(upload_id)
+            if metadata['status'] != 'uploading':
+                raise UploadError(f"Upload is already {metadata['status']}", status=409)
+            for path in (part_path, meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+class IngestQueue:
+    """
+    Analyze completed uploads one at a time on a background thread
+
+    Analysis runs sequentially so concurrent uploads never compete with
+    each other (or with local recordings) for the predictors. The queue
+    itself lives in memory; the upload metadata is the durable record, so
+    recover() re-queues whatever a previous process left unfinished.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='upload-analysis', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            upload_id, audio_path = self._queue.get()
+            lock_file = None
+            try:
+                lock_file = self.store.claim(upload_id)
+                if lock_file is None:
+                    logger.info(f"Upload {upload_id} is analyzed elsewhere or already done")
+                    continue
+                self.store.update_status(upload_id, 'analyzing')
+                status, result = analyze_upload(audio_path, hive_id=self.store.get(upload_id)['hive_id'])
+                self.store.update_status(upload_id, status, result)
+            except Exception as e:
+                logger.error(f"Analysis of upload {upload_id} failed: {e}")
+                try:
+                    self.store.update_status(upload_id, 'error', {'message': str(e)})
+                except Exception:
+                    pass
+            finally:
+                if lock_file is not None:
+                    self.store.release(upload_id, lock_file)
+                self._queue.task_done()
+
+    def recover(self):
+        """
+        Re-queue uploads left queued or mid-analysis by a previous process,
+        e.g. after a restart; called once by the WSGI entry point
+
+        :return: Number of uploads re-queued
+        """
+        pending = self.store.pending()
+        for upload_id, audio_path in pending:
+            self.submit(upload_id, audio_path)
+        if pending:
+            logger.info(f"Re-queued {len(pending)} unfinished upload analysis(es)")
+        return len(pending)
+
+    def submit(self, upload_id, audio_path):
+        """
+        Queue a completed upload for analysis
+
+        :return: Number of uploads waiting ahead of this one
+        """
+        self._ensure_worker()
+        waiting = self._queue.qsize()
+        self._queue.put((upload_id, audio_path))
+        return waiting
+
+def analyze_upload(audio_path, hive_id=None, chunk_seconds=None):
+    """
+    Run the capture quality gate and the shared analysis pipeline (bee band
+    decimation, piping gate, predictors) on an upload
+
+    Uploads can be over an hour long, so the file is streamed in
+    AUDIO_CHUNK_SECONDS blocks: features and the piping detector cover the
+    whole recording, the quality gate runs per block, and the predictors
+    read one block-sized window, centred on the strongest piping candidate
+    or else the first good block. Peak memory is bounded by the block
+    size, not the upload length.
+
+    :param audio_path: Absolute path of the uploaded recording
+    :param hive_id: Hive the node recorded, from the upload metadata
+    :param chunk_seconds: Block length in seconds, defaults to settings.AUDIO_CHUNK_SECONDS
+    :return: Tuple of (status, result dictionary)
+    """
+    # Import lazily: views imports this module
+    from .views import analyze_clip
+    from .audio_features import (
+        StreamingFeatureAccumulator, iter_audio_blocks, classify_activity, to_mono_float32, DEFAULT_CHUNK_SECONDS
+    )
+    from .audio_quality import assess_capture_quality
+    from .piping_detector import PipingDetector
+    from .pipeline import AudioClip
+
+    chunk_seconds = chunk_seconds or getattr(settings, 'AUDIO_CHUNK_SECONDS', DEFAULT_CHUNK_SECONDS)
+    accumulator = detector = window = None
+    piping_events = []
+    bad_windows, windows, reasons = 0, 0, []
+    sample_rate = frames = 0
+
+    for block, sample_rate in iter_audio_blocks(audio_path, chunk_seconds):
+        if accumulator is None:
+            accumulator = StreamingFeatureAccumulator(sample_rate)
+            detector = PipingDetector(sample_rate)
+        accumulator.update(block)
+        piping_events += detector.process(block)
+
+        windows += 1
+        block_quality = assess_capture_quality(block, sample_rate)
+        if block_quality['status'] != 'ok':
+            bad_windows += 1
+            reasons += [reason for reason in block_quality['reasons'] if reason not in reasons]
+        elif window is None:
+            window = AudioClip(block.copy(), sample_rate, source=hive_id)
+            window.quality()
+        frames += len(block)
+
+    if accumulator is None:
+        return 'bad_capture', {'quality': {'status': 'bad_capture', 'reasons': ['empty recording'], 'metrics': {}}}
+    piping_events += detector.flush()
+
+    quality = {
+        'status': 'ok' if window is not None else 'bad_capture',
+        'reasons': reasons,
+        'windows': windows,
+        'bad_windows': bad_windows,
+        'metrics': window.quality()['metrics'] if window is not None else {}
+    }
+    if window is None:
+        return 'bad_capture', {'quality': quality}
+
+    # Prefer the window around the strongest piping candidate, if it is a good capture
+    if piping_events:
+        strongest = max(piping_events, key=lambda event: event['score_db'])
+        center = (strongest['start'] + strongest['end']) / 2
+        start = int(max(0.0, min(center - chunk_seconds / 2, frames / sample_rate - chunk_seconds)) * sample_rate)
+        samples, _ = sf.read(audio_path, start=start, stop=start + int(chunk_seconds * sample_rate),
+                             dtype='float32', always_2d=True)
+        candidate = AudioClip(to_mono_float32(samples), sample_rate, source=hive_id)
+        if candidate.quality()['status'] == 'ok':
+            window = candidate
+
+    features = accumulator.result()
+    features['activity_level'] = classify_activity(features)
+
+    _, response, _ = analyze_clip(window, hive_id=hive_id, features=features)
+    result = json.loads(response.content.decode('utf-8'))
+    result['quality'] = quality
+    result['piping_events'] = piping_events
+    return ('done' if response.status_code == 200 else 'error'), result
+
+# Create global upload store and analysis queue instances
+upload_store = UploadStore()
+ingest_queue = IngestQueue(upload_store)
@@ -0,0 +1,99 @@
+import os
+import time
+import logging
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from audio_analyzer.archive_utils import is_audio_file
+from audio_analyzer.audio_features import load_audio
+from audio_analyzer.pipeline import AudioClip
+from audio_analyzer.spectrogram_cache import spectrogram_cache
+from audio_analyzer.spectrogram_pool import spectrogram_pool, SpectrogramPool
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Render the spectrograms of archived recordings in parallel into the spectrogram cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            help='Recordings or directories to render (default: MEDIA_ROOT/recordings)'
+        )
+        parser.add_argument(
+            '--since-days',
+            type=float,
+            default=None,
+            help='Only render recordings modified in the last N days'
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            nargs=2,
+            default=(1000, 400),
+            metavar=('WIDTH', 'HEIGHT'),
+            help='Image size in pixels (default: 1000 400)'
+        )
+        parser.add_argument(
+            '--format',
+            choices=('png', 'webp'),
+            default='png',
+            help='Image format (default: png)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Worker processes (default: settings.SPECTROGRAM_POOL_WORKERS)'
+        )
+
+    def _recordings(self, paths, since_days):
+        cutoff = time.time() - since_days * 86400 if since_days else None
+        for path in paths:
+            if os.path.isdir(path):
+                files = sorted(
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(path) for name in names if is_audio_file(name)
+                )
+            else:
+                files = [path]
+            for file_path in files:
+                if cutoff is None or os.path.getmtime(file_path) >= cutoff:
+                    yield file_path
+
+    def handle(self, *args, **options):
+        """
+        Decode each recording on demand and render all cache misses on the worker pool
+        """
+        paths = options['paths'] or [os.path.join(settings.MEDIA_ROOT, 'recordings')]
+        size = tuple(options['size'])
+        failed_loads = []
+
+        def items():
+            for file_path in self._recordings(paths, options['since_days']):
+                try:
+                    samples, sample_rate = load_audio(file_path)
+                except Exception as e:
+                    logger.error(f"Could not decode {file_path}: {e}")
+                    failed_loads.append(file_path)
+                    continue
+                title = os.path.splitext(os.path.basename(file_path))[0].replace('_', ' ')
+                yield AudioClip(samples, sample_rate, source=file_path), f'{title} Spectrogram', size
+
+        pool = SpectrogramPool(workers=options['workers']) if options['workers'] is not None else spectrogram_pool
+        started = time.monotonic()
+        hits = spectrogram_cache.hits
+        try:
+            results = spectrogram_cache.render_batch(items(), image_format=options['format'], pool=pool)
+        finally:
+            pool.shutdown()
+
+        rendered = sum(path is not None for path in results)
+        cached = spectrogram_cache.hits - hits
+        failed = len(results) - rendered + len(failed_loads)
+        message = (f"{rendered} spectrogram(s) available ({cached} already cached) "
+                   f"in {time.monotonic() - started:.1f}s, {failed} failed")
+        if failed:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
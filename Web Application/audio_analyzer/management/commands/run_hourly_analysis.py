@@ -1,12 +1,19 @@
 import os
+import json
+import argparse
 import logging
-import sounddevice as sd
-import soundfile as sf
-import numpy as np
+import tempfile
+from datetime import datetime
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from audio_analyzer.views import analyze_audio
-from django.http import HttpRequest
+from audio_analyzer.views import analyze_clip, save_spectrogram, WINDOW_PREDICTORS
+from audio_analyzer.anytime import anytime_capture
+from audio_analyzer.archive_utils import recording_archiver, prune_recordings
+from audio_analyzer.capture_backends import get_capture_backend
+from audio_analyzer.media import prune_previews
+from audio_analyzer.discord_utils import discord_notifier
+from audio_analyzer.spool import outbound_sync
+from audio_analyzer.pipeline import AudioClip
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +45,26 @@ class Command(BaseCommand):
             default=1, 
             help='Number of audio channels (default: 1)'
         )
+        parser.add_argument(
+            '--backend', 
+            type=str, 
+            default=None, 
+            help='Capture backend: sounddevice, synthetic, file or file:<path>[,<path>] '
+                 '(default: settings.AUDIO_CAPTURE_BACKEND)'
+        )
+        parser.add_argument(
+            '--hive-id', 
+            type=str, 
+            default=getattr(settings, 'HOURLY_HIVE_ID', 'default'), 
+            help='Hive whose anomaly baseline the recording updates (default: settings.HOURLY_HIVE_ID)'
+        )
+        parser.add_argument(
+            '--anytime', 
+            action=argparse.BooleanOptionalAction, 
+            default=getattr(settings, 'ANYTIME_ANALYSIS', False), 
+            help='Analyze windows during capture and stop early once predictions are stable; '
+                 '--duration becomes the maximum (default: settings.ANYTIME_ANALYSIS)'
+        )
 
     def handle(self, *args, **options):
         """
@@ -52,62 +79,88 @@ class Command(BaseCommand):
             device = options['device']
             sample_rate = options['sample_rate'] or getattr(settings, 'SAMPLE_RATE', 44100)
             channels = options['channels']
+            backend = get_capture_backend(options['backend'])
 
             # Log selected recording parameters
             logger.info(f"Recording Configuration:")
             logger.info(f"  Duration: {duration} seconds")
             logger.info(f"  Sample Rate: {sample_rate} Hz")
             logger.info(f"  Channels: {channels}")
+            logger.info(f"  Capture Backend: {backend.name}")
             
             # List available devices if no specific device is selected
             if device is None:
-                devices = sd.query_devices()
+                devices = backend.input_devices()
                 logger.info("Available Audio Devices:")
-                for idx, dev in enumerate(devices):
-                    logger.info(f"  Device {idx}: {dev['name']}")
+                for dev in devices:
+                    logger.info(f"  Device {dev['index']}: {dev['name']}")
                 
                 # Try to automatically select default input device
                 try:
-                    default_input = sd.default.device[0]
+                    if backend.name == 'sounddevice':
+                        import sounddevice as sd
+                        default_input = sd.default.device[0]
+                    else:
+                        default_input = devices[0]['index']
                     logger.info(f"Using default input device: {default_input}")
                     device = default_input
                 except Exception as e:
                     logger.warning(f"Could not select default input device: {e}")
 
-            # Create a mock HttpRequest for the analyze_audio function
-            request = HttpRequest()
-            request.method = 'POST'
-
-            # Create media directory if it doesn't exist
-            os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+            # Each run records into its own session, listed and pruned like the others
+            recordings_dir = os.path.join(settings.MEDIA_ROOT, 'recordings')
+            os.makedirs(recordings_dir, exist_ok=True)
+            session_dir = tempfile.mkdtemp(prefix=datetime.now().strftime('hourly_%Y%m%d_%H%M%S_'), dir=recordings_dir)
+            os.chmod(session_dir, 0o755)
 
-            # Generate unique filename for this recording
-            audio_filename = "hourly_recording_.wav"
-            audio_path = os.path.join(settings.MEDIA_ROOT, audio_filename)
+            # Extension set by the archive format
+            audio_path = os.path.join(session_dir, 'hourly_recording')
 
             # Record audio
             logger.info(f"Recording audio for {duration} seconds")
             try:
-                recording = sd.rec(
-                    int(duration * sample_rate), 
-                    samplerate=sample_rate, 
-                    channels=channels, 
-                    dtype='float32',
-                    device=device
-                )
-                sd.wait()  # Wait until recording is finished
-                sf.write(audio_path, recording, sample_rate)
+                if options['anytime']:
+                    anytime_result = anytime_capture(
+                        {name: WINDOW_PREDICTORS[name] for name in getattr(settings, 'ANYTIME_PREDICTORS', ['BNQ', 'QNQ'])},
+                        save_spectrogram,
+                        session_dir,
+                        max_duration=duration,
+                        sample_rate=sample_rate,
+                        device=device,
+                        backend=backend
+                    )
+                    clip = anytime_result['clip']
+                    logger.info(f"Anytime capture stopped after {anytime_result['duration']}s "
+                                f"(early: {anytime_result['stopped_early']})")
+                else:
+                    recording = backend.record(duration, sample_rate, channels=channels, device=device)
+
+                    # Every later stage reads this one float32 buffer
+                    clip = AudioClip(recording, sample_rate, source='hourly')
+
+                # Skip the full analysis (and its alerts) for broken captures
+                quality = clip.quality()
+                if quality['status'] != 'ok':
+                    logger.warning(f"Skipping hourly analysis, bad capture: {quality}")
+                    self.stdout.write(self.style.WARNING(
+                        f"Bad capture: {', '.join(quality['reasons'])}"
+                    ))
+                    return
+
+                # Optionally decimate to the bee band before storage and analysis
+                clip = clip.decimate()
+
+                # Archive in the background; analysis does not wait for the file
+                audio_path = clip.persist(audio_path)
             except Exception as recording_error:
                 logger.error(f"Audio recording failed: {recording_error}")
                 raise
 
             logger.info(f"Audio recorded to {audio_path}")
 
-            # Set the audio file in the request
-            request.FILES['audio'] = audio_path
-
-            # Perform analysis
-            response = analyze_audio(request)
+            # Perform analysis on the in-memory clip; TOOT only runs on piping candidates
+            clip, response, piping_events = analyze_clip(clip, hive_id=options['hive_id'])
+            logger.info(f"Piping candidates: {len(piping_events)}")
 
             # Log analysis results
             if hasattr(response, 'content'):
@@ -146,4 +199,19 @@ class Command(BaseCommand):
         except Exception as e:
             logger.error(f"Error during hourly audio analysis: {e}", exc_info=True)
 
+        # The archive writer is a daemon thread: finish the file before exiting
+        recording_archiver.flush()
+
+        # Discord messages are sent from a daemon thread too; spooled Sheets
+        # rows survive exit, but try to deliver them now
+        discord_notifier.flush(timeout=60)
+        outbound_sync.flush(timeout=30)
+
+        # Drop recording sessions past the retention period
+        try:
+            prune_recordings()
+            prune_previews()
+        except Exception as e:
+            logger.error(f"Error pruning old recordings: {e}")
+
         self.stdout.write(self.style.SUCCESS('Hourly audio analysis completed'))
\ No newline at end of file
@@ -0,0 +1,101 @@
+import time
+import logging
+import argparse
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from audio_analyzer.capture import CaptureManager
+from audio_analyzer.capture_backends import get_capture_backend
+from audio_analyzer.telemetry import TelemetryMonitor
+from audio_analyzer.anomaly import telemetry_detector
+from audio_analyzer.tiles import TileBuilder
+from audio_analyzer.piping_detector import PipingMonitor
+
+logger = logging.getLogger(__name__)
+
+# Seconds between ring buffer polls
+POLL_SECONDS = 0.25
+
+class Command(BaseCommand):
+    help = 'Continuously record per-second acoustic telemetry for every hive and flag anomalies and piping'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--duration',
+            type=int,
+            default=0,
+            help='Seconds to run before exiting (default: 0, run until interrupted)'
+        )
+        parser.add_argument(
+            '--sample-rate',
+            type=int,
+            default=None,
+            help='Custom sample rate (default: project settings)'
+        )
+        parser.add_argument(
+            '--backend',
+            type=str,
+            default=None,
+            help='Capture backend: sounddevice, synthetic, file or file:<path>[,<path>] '
+                 '(default: settings.AUDIO_CAPTURE_BACKEND)'
+        )
+        parser.add_argument(
+            '--tiles',
+            action=argparse.BooleanOptionalAction,
+            default=getattr(settings, 'SPECTROGRAM_TILES', False),
+            help='Also build the multi-resolution spectrogram tile pyramid of every hive '
+                 '(default: settings.SPECTROGRAM_TILES)'
+        )
+        parser.add_argument(
+            '--piping',
+            action=argparse.BooleanOptionalAction,
+            default=getattr(settings, 'PIPING_MONITOR', True),
+            help='Run the queen piping detector on every hive (default: settings.PIPING_MONITOR)'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Stream every hive input and append one summary per second to its ring file
+        """
+        backend = get_capture_backend(options['backend'])
+        manager = CaptureManager(
+            sample_rate=options['sample_rate'] or getattr(settings, 'SAMPLE_RATE', 44100),
+            buffer_seconds=10,
+            backend=backend
+        )
+        if not manager.hive_inputs:
+            self.stdout.write(self.style.ERROR("No hive inputs found"))
+            return
+
+        tile_builder = TileBuilder(manager.sample_rate) if options['tiles'] else None
+        piping_monitor = PipingMonitor(manager.sample_rate) if options['piping'] else None
+        monitor = TelemetryMonitor(
+            manager,
+            listeners=[telemetry_detector.observe],
+            audio_listeners=[builder.observe for builder in (tile_builder, piping_monitor) if builder]
+        )
+        hives = ', '.join(hive['hive_id'] for hive in manager.hive_inputs)
+        logger.info(f"Starting telemetry for {hives} on the {backend.name} backend")
+
+        deadline = time.monotonic() + options['duration'] if options['duration'] else None
+        written = 0
+        manager.start()
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                time.sleep(POLL_SECONDS)
+                written += monitor.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            manager.stop()
+            written += monitor.poll()
+            monitor.flush()
+            telemetry_detector.save()
+            if tile_builder:
+                tile_builder.flush()
+            if piping_monitor:
+                piping_monitor.flush()
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} telemetry second(s) for {hives}"))
+        if piping_monitor:
+            piping = sum(len(events) for events in piping_monitor.events.values())
+            self.stdout.write(f"Piping candidates: {piping}")
@@ -0,0 +1,55 @@
+import time
+import logging
+from django.core.management.base import BaseCommand
+from audio_analyzer.spool import outbound_spool, outbound_sync
+
+# Importing a sink module registers it with outbound_sync
+import audio_analyzer.sheets_utils  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Deliver spooled outbound rows (Google Sheets) with retries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help='Keep draining the spool until interrupted instead of exiting once it is empty'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=300,
+            help='Seconds to keep retrying before exiting (default: 300; ignored with --forever)'
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Retry items previously rejected as undeliverable'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Drain the outbound spool and report what is left
+        """
+        if options['retry_failed']:
+            reset = outbound_spool.reset_failed()
+            logger.info(f"Retrying {reset} failed outbound item(s)")
+
+        if options['forever']:
+            try:
+                outbound_sync.run_forever()
+            except KeyboardInterrupt:
+                pass
+        else:
+            started = time.monotonic()
+            drained = outbound_sync.flush(timeout=options['timeout'])
+            logger.info(f"Outbound sync finished in {time.monotonic() - started:.1f}s")
+
+        stats = outbound_spool.stats()
+        summary = ', '.join(f"{sink}: {s['pending']} pending, {s['failed']} failed" for sink, s in stats.items())
+        if not options['forever'] and not drained:
+            self.stdout.write(self.style.WARNING(f"Spool not drained ({summary})"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Outbound spool: {summary or 'empty'}"))
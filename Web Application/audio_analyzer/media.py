@@ -0,0 +1,326 @@
+import os
+import re
+import logging
+import mimetypes
+import threading
+from datetime import datetime
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from PIL import Image
+
+from .archive_utils import write_recording, is_audio_file
+from .audio_features import load_audio, resample_audio
+from .spectrogram import render_spectrogram, encode_image
+
+logger = logging.getLogger(__name__)
+
+# Previews and thumbnails mirror the media tree under this directory
+PREVIEW_DIRNAME = 'previews'
+
+# Low-bitrate mono Opus previews; the bee band is well below 8 kHz
+PREVIEW_SAMPLE_RATE = 16000
+PREVIEW_BITRATE = 24000
+PREVIEW_SUFFIX = '.preview.ogg'
+
+THUMBNAIL_SIZE = (320, 128)
+THUMBNAIL_SUFFIX = '.thumb.webp'
+
+# Media subdirectories that are never served (uploads still being written)
+PRIVATE_DIRS = ('uploads',)
+
+# Number of lock stripes serializing generation of the same preview
+LOCK_STRIPES = 64
+
+CONTENT_TYPES = {
+    '.wav': 'audio/wav',
+    '.flac': 'audio/flac',
+    '.opus': 'audio/ogg',
+    '.ogg': 'audio/ogg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+class FileRange:
+    """
+    Read-only view of a byte range of an open file
+
+    Reads stop at the end of the range, so Django streams exactly the
+    requested bytes. fileno() and tell() expose the underlying file, which
+    lets a WSGI server's file_wrapper send the range with sendfile() using
+    the response Content-Length.
+    """
+
+    def __init__(self, f, start, length):
+        self._file = f
+        self._remaining = length
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+def media_path(rel_path):
+    """
+    Resolve a media-relative path to an existing file inside MEDIA_ROOT
+
+    :param rel_path: Path relative to MEDIA_ROOT
+    :return: Absolute path
+    :raises FileNotFoundError: The path leaves MEDIA_ROOT, is private or does not exist
+    """
+    try:
+        path = safe_join(settings.MEDIA_ROOT, rel_path)
+    except SuspiciousFileOperation:
+        raise FileNotFoundError(rel_path)
+    parts = os.path.relpath(path, settings.MEDIA_ROOT).split(os.sep)
+    if parts[0] in PRIVATE_DIRS or not os.path.isfile(path):
+        raise FileNotFoundError(rel_path)
+    return path
+
+def content_type(path):
+    """
+    Return the Content-Type of a media file
+    """
+    ext = os.path.splitext(path)[1].lower()
+    return CONTENT_TYPES.get(ext) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header
+
+    :param header: Range header value
+    :param size: File size in bytes
+    :return: Inclusive (start, end), or None to send the whole file
+        (no header, multiple ranges or a malformed header)
+    :raises ValueError: The range is not satisfiable
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+def file_response(request, path, cache_control='no-cache'):
+    """
+    Serve a file with conditional requests and single byte ranges
+
+    The body is streamed from the open file, never read into memory; under
+    a WSGI server with a sendfile-capable file_wrapper (e.g. gunicorn) both
+    full and partial responses are sent zero-copy.
+
+    :param request: Django request
+    :param path: Absolute file path
+    :param cache_control: Cache-Control header value
+    :return: 200, 206, 304 or 416 response
+    """
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control,
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        not_modified = if_none_match.strip() == '*' or etag in (
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+        )
+    else:
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = since is not None and int(stat.st_mtime) <= since
+    if not_modified:
+        return HttpResponse(status=304, headers=headers)
+
+    # A stale If-Range validator asks for the whole, changed file
+    byte_range = None
+    if_range = request.headers.get('If-Range', '').strip()
+    if 'Range' in request.headers and (not if_range or if_range in (etag, headers['Last-Modified'])):
+        try:
+            byte_range = parse_range(request.headers['Range'], stat.st_size)
+        except ValueError:
+            headers['Content-Range'] = f'bytes */{stat.st_size}'
+            return HttpResponse(status=416, headers=headers)
+
+    start, end = byte_range or (0, stat.st_size - 1)
+    length = end - start + 1
+    headers['Content-Type'] = content_type(path)
+    headers['Content-Length'] = str(length)
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    status = 206 if byte_range else 200
+
+    if request.method == 'HEAD':
+        return HttpResponse(status=status, headers=headers)
+
+    response = FileResponse(FileRange(open(path, 'rb'), start, length), status=status)
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+def _derived_path(path, suffix):
+    rel_path = os.path.relpath(path, settings.MEDIA_ROOT)
+    return os.path.join(settings.MEDIA_ROOT, PREVIEW_DIRNAME, rel_path + suffix)
+
+def _is_fresh(derived, source):
+    try:
+        return os.path.getmtime(derived) >= os.path.getmtime(source)
+    except FileNotFoundError:
+        return False
+
+def _generate(path, suffix, write):
+    # Regenerated whenever the source is newer; concurrent requests share one write
+    derived = _derived_path(path, suffix)
+    if _is_fresh(derived, path):
+        return derived
+    with _locks[hash(derived) % LOCK_STRIPES]:
+        if not _is_fresh(derived, path):
+            os.makedirs(os.path.dirname(derived), exist_ok=True)
+            write(derived)
+    return derived
+
+def audio_preview(path):
+    """
+    Return a low-bitrate Opus preview of a recording, encoding it on first use
+
+    :param path: Absolute recording path inside MEDIA_ROOT
+    :return: Absolute path of the Ogg Opus preview
+    """
+    def write(preview_path):
+        samples, sample_rate = load_audio(path)
+        samples = resample_audio(samples, sample_rate, min(sample_rate, PREVIEW_SAMPLE_RATE))
+        tmp_path = f'{preview_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        write_recording(tmp_path, samples, min(sample_rate, PREVIEW_SAMPLE_RATE), 'opus',
+                        bitrate=getattr(settings, 'MEDIA_PREVIEW_BITRATE', PREVIEW_BITRATE))
+        os.replace(tmp_path, preview_path)
+        logger.debug(f"Encoded audio preview {preview_path}")
+
+    return _generate(path, PREVIEW_SUFFIX, write)
+
+def thumbnail(path):
+    """
+    Return a small WebP thumbnail of a spectrogram image, or of a
+    recording's spectrogram, generating it on first use
+
+    :param path: Absolute image or recording path inside MEDIA_ROOT
+    :return: Absolute path of the WebP thumbnail
+    """
+    size = tuple(getattr(settings, 'MEDIA_THUMBNAIL_SIZE', THUMBNAIL_SIZE))
+
+    def write(thumbnail_path):
+        if is_audio_file(path):
+            samples, sample_rate = load_audio(path)
+            render_spectrogram(samples, sample_rate, thumbnail_path, size=size, axes=False)
+        else:
+            with Image.open(path) as image:
+                image.thumbnail(size, reducing_gap=2.0)
+                encode_image(image.convert('RGB'), thumbnail_path)
+        logger.debug(f"Rendered thumbnail {thumbnail_path}")
+
+    return _generate(path, THUMBNAIL_SUFFIX, write)
+
+def prune_previews():
+    """
+    Delete previews and thumbnails whose source file no longer exists
+
+    :return: Number of files removed
+    """
+    preview_root = os.path.join(settings.MEDIA_ROOT, PREVIEW_DIRNAME)
+    removed = 0
+    for root, _, files in os.walk(preview_root, topdown=False):
+        for name in files:
+            source_name = next((name[:-len(s)] for s in (PREVIEW_SUFFIX, THUMBNAIL_SUFFIX) if name.endswith(s)), None)
+            rel_root = os.path.relpath(root, preview_root)
+            if source_name and os.path.exists(os.path.join(settings.MEDIA_ROOT, rel_root, source_name)):
+                continue
+            try:
+                os.remove(os.path.join(root, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if root != preview_root and not os.listdir(root):
+            os.rmdir(root)
+    if removed:
+        logger.info(f"Pruned {removed} orphaned preview(s)")
+    return removed
+
+def _session_dirs(recordings_dir):
+    # Sessions are the directories holding recordings; a directory holding
+    # only directories (e.g. the legacy recordings/uploads/<id> layout) is a
+    # container whose subdirectories are the sessions
+    for entry in os.scandir(recordings_dir):
+        if not entry.is_dir():
+            continue
+        children = list(os.scandir(entry.path))
+        if children and all(child.is_dir() for child in children):
+            for child in children:
+                yield f'{entry.name}/{child.name}', child
+        else:
+            yield entry.name, entry
+
+def list_recording_sessions(limit=20):
+    """
+    List recording sessions, newest first, without touching the audio
+
+    Multi-record, multi-hive, hourly and upload sessions each have their own
+    directory under recordings/; empty sessions are skipped.
+
+    :param limit: Maximum number of sessions
+    :return: List of {'session', 'modified', 'files': [{'path', 'bytes', 'audio'}]}
+        with media-relative paths
+    """
+    recordings_dir = os.path.join(settings.MEDIA_ROOT, 'recordings')
+    if not os.path.isdir(recordings_dir):
+        return []
+
+    entries = sorted(_session_dirs(recordings_dir), key=lambda item: item[1].stat().st_mtime, reverse=True)
+    sessions = []
+    for name, entry in entries:
+        if len(sessions) >= limit:
+            break
+        files = []
+        for file_entry in sorted(os.scandir(entry.path), key=lambda e: e.name):
+            if not file_entry.is_file() or file_entry.name.endswith('.tmp'):
+                continue
+            files.append({
+                'path': os.path.relpath(file_entry.path, settings.MEDIA_ROOT).replace(os.sep, '/'),
+                'bytes': file_entry.stat().st_size,
+                'audio': is_audio_file(file_entry.name)
+            })
+        if not files:
+            continue
+        sessions.append({
+            'session': name,
+            'modified': datetime.fromtimestamp(entry.stat().st_mtime).isoformat(),
+            'files': files
+        })
+    return sessions
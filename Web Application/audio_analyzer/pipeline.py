@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import time
+import numpy as np
+from django.conf import settings
+
+from .audio_features import to_mono_float32, decimate_to_bee_band, compute_audio_features, classify_activity
+from .audio_quality import assess_capture_quality
+from .archive_utils import recording_archiver
+
+logger = logging.getLogger(__name__)
+
+class AudioClip:
+    """
+    One capture held as a single read-only float32 buffer
+
+    Capture, the quality gate, feature extraction, spectrogram STFTs and
+    the archive writer all read the same array (or slices of it) instead
+    of re-reading a file from disk. Writing the archive file is a side
+    effect started by persist(); no later stage waits for it.
+    """
+
+    def __init__(self, samples, sample_rate, source=None, start_time=None):
+        """
+        :param samples: Captured samples; mono float32 input is wrapped
+            without copying, anything else is converted once
+        :param sample_rate: Sampling rate of the samples
+        :param source: Optional label, e.g. the predictor or hive id
+        :param start_time: Epoch time of the first sample, defaults to now
+        """
+        self.samples = to_mono_float32(samples)
+        self.samples.flags.writeable = False
+        self.sample_rate = int(sample_rate)
+        self.source = source
+        self.start_time = start_time if start_time is not None else time.time()
+        self.path = None
+        self._quality = None
+        self._features = None
+        self._digest = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        """
+        Length of the clip in seconds
+        """
+        return len(self.samples) / self.sample_rate
+
+    def segment(self, start, end):
+        """
+        Return a clip that shares this clip's buffer for a time window
+
+        :param start: Window start in seconds
+        :param end: Window end in seconds
+        :return: AudioClip backed by a view of self.samples
+        """
+        first = max(0, int(start * self.sample_rate))
+        last = min(len(self.samples), int(end * self.sample_rate))
+        return AudioClip(self.samples[first:last], self.sample_rate, self.source,
+                         self.start_time + first / self.sample_rate)
+
+    def decimate(self, target_rate=None):
+        """
+        Decimate to the bee band (settings.BEE_BAND_SAMPLE_RATE)
+
+        :return: A new clip at the lower rate, or this clip unchanged when
+            decimation is disabled
+        """
+        target_rate = target_rate or getattr(settings, 'BEE_BAND_SAMPLE_RATE', None)
+        if not target_rate or target_rate >= self.sample_rate:
+            return self
+        samples, sample_rate = decimate_to_bee_band(self.samples, self.sample_rate, target_rate)
+        return AudioClip(samples, sample_rate, self.source, self.start_time)
+
+    def digest(self):
+        """
+        Return a content hash of the samples and sampling rate, computed once
+        """
+        if self._digest is None:
+            h = hashlib.blake2b(digest_size=20)
+            h.update(str(self.sample_rate).encode())
+            h.update(memoryview(np.ascontiguousarray(self.samples)).cast('B'))
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def quality(self):
+        """
+        Return the capture quality assessment, computed once
+        """
+        if self._quality is None:
+            self._quality = assess_capture_quality(self.samples, self.sample_rate)
+        return self._quality
+
+    def features(self):
+        """
+        Return the acoustic features with 'activity_level', computed once
+        """
+        if self._features is None:
+            self._features = compute_audio_features(self.samples, self.sample_rate)
+            self._features['activity_level'] = classify_activity(self._features)
+        return self._features
+
+    def persist(self, base_path, archive_format=None):
+        """
+        Queue the clip for archiving on the background writer
+
+        The writer reads the shared buffer directly; it is read-only, so no
+        stage can modify it while the file is encoded.
+
+        :param base_path: Recording path, with or without an audio extension
+        :param archive_format: Archive format, defaults to the configured one
+        :return: Final path of the archived recording (written asynchronously)
+        """
+        self.path = recording_archiver.submit(base_path, self.samples, self.sample_rate, archive_format)
+        return self.path
+
+    def wait_persisted(self, timeout=30):
+        """
+        Block until the archive file exists, for callers that hand the path
+        to another process
+
+        :return: True if the file is on disk
+        """
+        return self.path is not None and recording_archiver.wait_for(self.path, timeout)
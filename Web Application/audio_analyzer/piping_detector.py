@@ -0,0 +1,260 @@
+import logging
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from django.conf import settings
+
+from .audio_features import to_mono_float32
+
+logger = logging.getLogger(__name__)
+
+# Queen tooting/quacking fundamentals (Hz) watched by the narrow-band bank
+DEFAULT_PIPING_FUNDAMENTALS = tuple(range(300, 525, 25))
+
+# Harmonics per fundamental (1 = fundamental only)
+DEFAULT_PIPING_HARMONICS = 2
+
+# Harmonic-averaged tone-to-broadband ratio (dB) that marks a candidate frame
+DEFAULT_PIPING_THRESHOLD_DB = 12.0
+
+# Colony hum (100-300 Hz) puts its 2nd and 3rd harmonics, and the skirt of
+# its fundamental, inside the piping bank. A peak at f is rejected as hum
+# when a guard bin at f/2, f/3 or just below f is within this many dB of it,
+# i.e. holds comparable energy.
+DEFAULT_SUBHARMONICS = (2, 3)
+DEFAULT_GUARD_RATIO_DB = -3.0
+
+# Offset of the lower guard bin, in DFT bin widths
+LOWER_GUARD_BINS = 1.5
+
+# Shortest tooting syllable reported as a candidate event
+DEFAULT_MIN_EVENT_SECONDS = 0.2
+
+# Analysis frame length; hop is half a frame
+FRAME_SECONDS = 0.05
+
+# Frames quieter than this RMS are never candidates
+MIN_FRAME_RMS = 1e-4
+
+# Recent events PipingMonitor keeps per hive
+MAX_MONITOR_EVENTS = 100
+
+class PipingDetector:
+    """
+    Streaming narrow-band detector for queen piping and tooting
+
+    Each frame is correlated with a bank of windowed complex exponentials
+    at the piping fundamentals and their harmonics. This is the same
+    single-bin DFT a Goertzel filter computes, done for every bin and
+    frame in one matrix product, at a small fraction of an FFT's or the
+    TOOT CNN's cost. Frames whose tonal energy stands out from the
+    broadband level are joined into timestamped candidate events. A tone
+    with comparable energy at half or a third of its frequency is a hum
+    harmonic, and one with comparable energy just below it is the skirt of
+    a lower tone; neither is piping.
+    """
+
+    def __init__(self, sample_rate, fundamentals=None, harmonics=None, threshold_db=None,
+                 min_event_seconds=None, start_time=None):
+        """
+        :param sample_rate: Sampling rate of the incoming audio
+        :param fundamentals: Fundamental frequencies to watch, in Hz
+        :param harmonics: Number of harmonics per fundamental
+        :param threshold_db: Candidate threshold in dB
+        :param min_event_seconds: Shortest event to report
+        :param start_time: Optional epoch time of the first sample; events
+            then also carry an absolute 'timestamp'
+        """
+        self.sample_rate = sample_rate
+        self.fundamentals = np.asarray(
+            fundamentals or getattr(settings, 'PIPING_FUNDAMENTALS', DEFAULT_PIPING_FUNDAMENTALS),
+            dtype=np.float32
+        )
+        harmonics = harmonics or getattr(settings, 'PIPING_HARMONICS', DEFAULT_PIPING_HARMONICS)
+        self.threshold_db = threshold_db or getattr(settings, 'PIPING_THRESHOLD_DB', DEFAULT_PIPING_THRESHOLD_DB)
+        self._guard_ratio = 10 ** (getattr(settings, 'PIPING_GUARD_RATIO_DB', DEFAULT_GUARD_RATIO_DB) / 10)
+        self.start_time = start_time
+
+        self.frame_length = int(sample_rate * FRAME_SECONDS)
+        self.hop_length = self.frame_length // 2
+        min_event_seconds = min_event_seconds or DEFAULT_MIN_EVENT_SECONDS
+        self.min_event_frames = max(1, int(np.ceil(min_event_seconds * sample_rate / self.hop_length)))
+
+        # (fundamentals x harmonics) bin frequencies; harmonics above Nyquist are dropped.
+        # The (fundamentals x guards) bins follow in the same basis.
+        bin_freqs = self.fundamentals[:, None] * np.arange(1, harmonics + 1, dtype=np.float32)
+        guard_freqs = np.concatenate((
+            self.fundamentals[:, None] / np.asarray(DEFAULT_SUBHARMONICS, dtype=np.float32),
+            self.fundamentals[:, None] - LOWER_GUARD_BINS * sample_rate / self.frame_length
+        ), axis=1)
+        self._harmonic_mask = (bin_freqs < sample_rate / 2).astype(np.float32)
+        all_freqs = np.concatenate((bin_freqs.ravel(), guard_freqs.ravel()))
+        window = np.hanning(self.frame_length).astype(np.float32)
+        n = np.arange(self.frame_length, dtype=np.float32)[:, None]
+        phase = -2j * np.pi * n * np.minimum(all_freqs, sample_rate / 2)[None, :] / sample_rate
+        self._basis = (window[:, None] * np.exp(phase)).astype(np.complex64)
+        self._noise_gain = float(np.sum(window ** 2))
+        self._bins_shape = bin_freqs.shape
+        self._guards_shape = guard_freqs.shape
+
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._frames_seen = 0
+        self._event = None
+
+    def _frame_time(self, frame_index):
+        return frame_index * self.hop_length / self.sample_rate
+
+    def _score_frames(self, frames):
+        """
+        Return the best fundamental and its score (dB) for every frame
+        """
+        all_power = np.abs(frames @ self._basis) ** 2
+        n_bins = self._harmonic_mask.size
+        power = all_power[:, :n_bins].reshape(len(frames), *self._bins_shape) * self._harmonic_mask
+        guard_power = all_power[:, n_bins:].reshape(len(frames), *self._guards_shape).max(axis=2)
+
+        frame_power = np.mean(np.square(frames), axis=1)
+        broadband = frame_power * self._noise_gain + 1e-20
+        snr = power.sum(axis=2) / self._harmonic_mask.sum(axis=1) / broadband[:, None]
+
+        # Harmonics and skirts of a lower fundamental (the colony hum) are not piping
+        snr[guard_power >= power[:, :, 0] * self._guard_ratio] = 0
+
+        best = np.argmax(snr, axis=1)
+        score_db = 10 * np.log10(snr[np.arange(len(frames)), best] + 1e-20)
+        score_db[np.sqrt(frame_power) < MIN_FRAME_RMS] = -np.inf
+        return self.fundamentals[best], score_db
+
+    def _close_event(self):
+        event, self._event = self._event, None
+        if event is None or event['frames'] < self.min_event_frames:
+            return None
+        result = {
+            'start': round(event['start'], 3),
+            'end': round(event['end'], 3),
+            'frequency': float(event['frequency']),
+            'score_db': round(float(event['score_db']), 2),
+        }
+        if self.start_time is not None:
+            result['timestamp'] = self.start_time + event['start']
+        return result
+
+    def process(self, block):
+        """
+        Feed the next block of audio
+
+        :param block: Samples in any WAV dtype, mono or multi-channel
+        :return: List of candidate events completed in this block
+        """
+        y = to_mono_float32(block)
+        buffer = np.concatenate((self._carry, y)) if len(self._carry) else y
+        if len(buffer) < self.frame_length:
+            self._carry = buffer.copy()
+            return []
+
+        frames = sliding_window_view(buffer, self.frame_length)[::self.hop_length]
+        frequencies, scores = self._score_frames(frames)
+        candidates = scores >= self.threshold_db
+
+        events = []
+        for offset in range(len(frames)):
+            frame_index = self._frames_seen + offset
+            if candidates[offset]:
+                start = self._frame_time(frame_index)
+                end = start + self.frame_length / self.sample_rate
+                if self._event is None:
+                    self._event = {'start': start, 'end': end, 'frames': 0,
+                                   'frequency': frequencies[offset], 'score_db': scores[offset]}
+                self._event['end'] = end
+                self._event['frames'] += 1
+                if scores[offset] > self._event['score_db']:
+                    self._event['frequency'] = frequencies[offset]
+                    self._event['score_db'] = scores[offset]
+            elif self._event is not None:
+                closed = self._close_event()
+                if closed:
+                    events.append(closed)
+
+        self._frames_seen += len(frames)
+        self._carry = buffer[len(frames) * self.hop_length:].copy()
+        return events
+
+    def flush(self):
+        """
+        Close any event still open at the end of the stream
+
+        :return: List with the final event, if it is long enough
+        """
+        closed = self._close_event()
+        return [closed] if closed else []
+
+def detect_piping(samples, sample_rate, **kwargs):
+    """
+    Run the piping detector over an in-memory recording
+
+    :param samples: Raw samples, any WAV dtype, mono or multi-channel
+    :param sample_rate: Sampling rate of the samples
+    :return: List of candidate events with 'start', 'end' (seconds),
+        'frequency' (Hz) and 'score_db'
+    """
+    detector = PipingDetector(sample_rate, **kwargs)
+    return detector.process(samples) + detector.flush()
+
+def candidate_window(events, duration, padding=1.0):
+    """
+    Return the time window that covers every candidate event
+
+    :param events: Events from PipingDetector or detect_piping
+    :param duration: Total recording duration in seconds
+    :param padding: Context added on both sides, in seconds
+    :return: Tuple of (start, end) in seconds, or None without events
+    """
+    if not events:
+        return None
+    start = max(0.0, min(event['start'] for event in events) - padding)
+    end = min(duration, max(event['end'] for event in events) + padding)
+    return start, end
+
+class PipingMonitor:
+    """
+    Continuous piping detection over live hive audio
+
+    A TelemetryMonitor audio listener: each hive gets its own streaming
+    PipingDetector anchored at the hive's first sample, so events carry
+    absolute timestamps. Completed events are logged, kept per hive and
+    passed to listeners: listener(hive_id, event).
+    """
+
+    def __init__(self, sample_rate, listeners=None, max_events=None):
+        """
+        :param sample_rate: Sampling rate of the observed audio
+        :param listeners: Optional callables notified for every event
+        :param max_events: Recent events kept per hive
+        """
+        self.sample_rate = sample_rate
+        self.listeners = list(listeners or [])
+        self.max_events = max_events or MAX_MONITOR_EVENTS
+        self.detectors = {}
+        self.events = {}
+
+    def _emit(self, hive_id, events):
+        for event in events:
+            logger.warning(f"Piping candidate on {hive_id}: {event['frequency']:.0f} Hz, "
+                           f"{event['end'] - event['start']:.2f}s, {event['score_db']} dB")
+            recent = self.events.setdefault(hive_id, [])
+            recent.append(event)
+            del recent[:-self.max_events]
+            for listener in self.listeners:
+                try:
+                    listener(hive_id, event)
+                except Exception as e:
+                    logger.error(f"Piping listener error for {hive_id}: {e}")
+
+    def observe(self, hive_id, samples, start_time):
+        detector = self.detectors.get(hive_id)
+        if detector is None:
+            detector = self.detectors[hive_id] = PipingDetector(self.sample_rate, start_time=start_time)
+        self._emit(hive_id, detector.process(samples))
+
+    def flush(self):
+        for hive_id, detector in self.detectors.items():
+            self._emit(hive_id, detector.flush())
@@ -1,9 +1,15 @@
 import os
 import logging
+import numbers
+import threading
+import time
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from datetime import datetime
+from django.conf import settings
+
+from .spool import outbound_sync, PermanentError
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -11,6 +17,49 @@ logger = logging.getLogger(__name__)
 # Google Sheets configuration
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
+# Worksheet that rows are appended to
+SHEET_TITLE = 'Sheet1'
+
+# Rows sent per batchUpdate, and the longest a queued row waits
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_SECONDS = 10
+
+# Seconds between reconnect attempts after a failed connection
+RECONNECT_SECONDS = 300
+
+def frequency_row(frequency_data):
+    """
+    Build the sheet row of a frequency analysis
+    """
+    return [
+        "",  # Timestamp replaced with empty string
+        frequency_data.get('peak_frequency', 'N/A'),
+        frequency_data.get('frequency_range', 'N/A'),
+        frequency_data.get('spectral_centroid', 'N/A'),
+        frequency_data.get('spectral_bandwidth', 'N/A'),
+        frequency_data.get('spectral_rolloff', 'N/A'),
+        frequency_data.get('rms', 'N/A')
+    ]
+
+def prediction_row(prediction_data):
+    """
+    Build the sheet row of a prediction
+    """
+    return [
+        "",  # Timestamp replaced with empty string
+        prediction_data.get('filename', 'N/A'),
+        prediction_data.get('prediction', 'N/A'),
+        prediction_data.get('confidence', 'N/A')
+    ]
+
+def _cell(value):
+    # Cell values as written by valueInputOption RAW
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, numbers.Number):
+        return {'userEnteredValue': {'numberValue': float(value)}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
 class BeemoSheetsClient:
     def __init__(self, spreadsheet_id=None, credentials_path=None, data_type=None):
         """
@@ -53,6 +102,8 @@ class BeemoSheetsClient:
         
         self.credentials_path = credentials_path
         self.service = self._connect_to_google_sheets()
+        self.connected_at = time.monotonic()
+        self._sheet_ids = {}
 
     def _connect_to_google_sheets(self):
         """
@@ -88,6 +139,72 @@ class BeemoSheetsClient:
             logger.error(traceback.format_exc())
             return None
 
+    def reconnect(self):
+        """
+        Retry a failed connection, at most once every RECONNECT_SECONDS
+        """
+        if self.service is None and time.monotonic() - self.connected_at >= RECONNECT_SECONDS:
+            self.service = self._connect_to_google_sheets()
+            self.connected_at = time.monotonic()
+        return self.service
+
+    def _sheet_id(self, spreadsheet_id, title=SHEET_TITLE):
+        # appendCells addresses worksheets by numeric id; looked up once
+        key = (spreadsheet_id, title)
+        if key not in self._sheet_ids:
+            spreadsheet = self.service.get(
+                spreadsheetId=spreadsheet_id,
+                fields='sheets.properties(sheetId,title)'
+            ).execute()
+            for sheet in spreadsheet.get('sheets', []):
+                self._sheet_ids[(spreadsheet_id, sheet['properties']['title'])] = sheet['properties']['sheetId']
+        return self._sheet_ids[key]
+
+    def existing_keys(self, spreadsheet_id=None):
+        """
+        Return the idempotency keys stored by append_rows in a sheet
+
+        :param spreadsheet_id: Spreadsheet, defaults to this client's
+        :return: Set of keys
+        """
+        spreadsheet = self.service.get(
+            spreadsheetId=spreadsheet_id or self.spreadsheet_id,
+            ranges=[f'{SHEET_TITLE}!A:A'],
+            fields='sheets(data(rowData(values(note))))'
+        ).execute()
+        return {
+            values[0]['note']
+            for sheet in spreadsheet.get('sheets', [])
+            for data in sheet.get('data', [])
+            for row in data.get('rowData', [])
+            for values in [row.get('values') or [{}]]
+            if values[0].get('note')
+        }
+
+    def append_rows(self, rows, spreadsheet_id=None, keys=None):
+        """
+        Append many rows in a single batchUpdate request
+
+        :param rows: List of row value lists
+        :param spreadsheet_id: Spreadsheet, defaults to this client's
+        :param keys: Optional idempotency key per row, stored as the note of its first cell
+        :return: Response from Google Sheets API
+        :raises HttpError: The request failed
+        """
+        spreadsheet_id = spreadsheet_id or self.spreadsheet_id
+        body = {
+            'requests': [{
+                'appendCells': {
+                    'sheetId': self._sheet_id(spreadsheet_id),
+                    'rows': [{'values': [_cell(value) for value in row]} for row in rows],
+                    'fields': 'userEnteredValue,note' if keys else 'userEnteredValue'
+                }
+            }]
+        }
+        for row, key in zip(body['requests'][0]['appendCells']['rows'], keys or []):
+            row['values'][0]['note'] = key
+        return self.service.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+
     def append_frequency_data(self, frequency_data):
         """
         Append frequency analysis data to Google Sheets
@@ -101,14 +218,7 @@ class BeemoSheetsClient:
 
         try:
             # Prepare row data with timestamp
-            row_data = [
-                "",  # Timestamp replaced with empty string
-                frequency_data.get('dominant_frequency', 'N/A'),
-                frequency_data.get('frequency_range', 'N/A'),
-                frequency_data.get('spectral_centroid', 'N/A'),
-                frequency_data.get('spectral_bandwidth', 'N/A'),
-                frequency_data.get('spectral_rolloff', 'N/A')
-            ]
+            row_data = frequency_row(frequency_data)
 
             body = {'values': [row_data]}
             result = self.service.values().append(
@@ -143,12 +253,7 @@ class BeemoSheetsClient:
 
         try:
             # Prepare row data with timestamp
-            row_data = [
-                "",  # Timestamp replaced with empty string
-                prediction_data.get('filename', 'N/A'),
-                prediction_data.get('prediction', 'N/A'),
-                prediction_data.get('confidence', 'N/A')
-            ]
+            row_data = prediction_row(prediction_data)
 
             body = {'values': [row_data]}
             result = self.service.values().append(
@@ -162,57 +267,93 @@ class BeemoSheetsClient:
             logger.error(f"Error appending {prediction_type} prediction data: {err}")
             return None
 
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_sheets_client(data_type='frequency'):
+    """
+    Return the shared client of a data type
+
+    Clients are created once per spreadsheet, so the credentials file is
+    read and the API discovery document is built only on first use.
+
+    :param data_type: Type of data ('frequency', 'bnb', 'qnq', 'toot')
+    :return: BeemoSheetsClient
+    """
+    with _clients_lock:
+        client = _clients.get(data_type)
+        if client is None:
+            client = _clients[data_type] = BeemoSheetsClient(data_type=data_type)
+        return client
+
+def deliver_spooled_rows(data_type, items):
+    """
+    Outbound spool sink: append spooled rows to the spreadsheet of a data type
+
+    Each row's idempotency key is stored as the note of its first cell.
+    When a batch is retried, rows whose key is already in the sheet were
+    appended by an attempt that failed afterwards and are skipped.
+
+    :param data_type: Type of data ('frequency', 'bnb', 'qnq', 'toot')
+    :param items: Spooled items with 'key', 'payload' (the row) and 'attempts'
+    :raises PermanentError: The request was rejected and will not succeed on retry
+    """
+    client = get_sheets_client(data_type)
+    if client.reconnect() is None:
+        raise ConnectionError("Google Sheets service not initialized")
+
+    try:
+        if any(item['attempts'] > 1 for item in items):
+            present = client.existing_keys()
+            items = [item for item in items if item['key'] not in present]
+            if not items:
+                return
+        client.append_rows([item['payload'] for item in items], keys=[item['key'] for item in items])
+    except HttpError as err:
+        if err.resp.status != 429 and err.resp.status < 500:
+            raise PermanentError(f"Error appending {data_type} data: {err}") from err
+        raise
+    except KeyError as err:
+        raise PermanentError(f"Spreadsheet {client.spreadsheet_id} has no worksheet {err}") from err
+    logger.info(f"Saved {len(items)} {data_type} row(s) to Google Sheets "
+                f"(Spreadsheet ID: {client.spreadsheet_id})")
+
 def save_frequency_to_sheets(frequency_data):
     """
-    Utility function to save frequency data to Google Sheets
-    
+    Spool frequency data for Google Sheets
+
     :param frequency_data: Dictionary of frequency analysis results
-    :return: Boolean indicating success or failure
+    :return: Boolean indicating the row was durably spooled
     """
     try:
-        sheets_client = BeemoSheetsClient(data_type='frequency')
-        result = sheets_client.append_frequency_data(frequency_data)
-        
-        if result:
-            # Log successful save with details
-            logger.info(
-                f"Frequency data saved to Google Sheets successfully. "
-                f"Spreadsheet ID: {sheets_client.spreadsheet_id}, "
-                f"Data: {frequency_data}"
-            )
-            return True
-        else:
-            logger.warning("Failed to save frequency data to Google Sheets")
-            return False
+        outbound_sync.append('sheets', 'frequency', frequency_row(frequency_data))
+        return True
     except Exception as e:
-        logger.error(f"Unexpected error saving frequency data to Google Sheets: {e}")
+        logger.error(f"Unexpected error spooling frequency data for Google Sheets: {e}")
         return False
 
 def save_prediction_to_sheets(prediction_type, prediction_data):
     """
-    Utility function to save prediction data to Google Sheets
-    
+    Spool prediction data for Google Sheets
+
     :param prediction_type: Type of prediction ('bnb', 'qnq', 'toot')
     :param prediction_data: Dictionary of prediction results
-    :return: Boolean indicating success or failure
+    :return: Boolean indicating the row was durably spooled
     """
+    if prediction_type not in ('bnb', 'qnq', 'toot'):
+        logger.error(f"Invalid prediction type: {prediction_type}")
+        return False
     try:
-        sheets_client = BeemoSheetsClient(data_type=prediction_type)
-        result = sheets_client.append_prediction_data(prediction_type, prediction_data)
-        
-        if result:
-            # Log successful save with detailed information
-            logger.info(
-                f"{prediction_type.upper()} prediction data saved to Google Sheets successfully. "
-                f"Spreadsheet ID: {sheets_client.spreadsheet_id}, "
-                f"Filename: {prediction_data.get('filename', 'N/A')}, "
-                f"Prediction: {prediction_data.get('prediction', 'N/A')}, "
-                f"Confidence: {prediction_data.get('confidence', 'N/A')}"
-            )
-            return True
-        else:
-            logger.warning(f"Failed to save {prediction_type.upper()} prediction data to Google Sheets")
-            return False
+        outbound_sync.append('sheets', prediction_type, prediction_row(prediction_data))
+        return True
     except Exception as e:
-        logger.error(f"Unexpected error saving {prediction_type.upper()} prediction data to Google Sheets: {e}")
-        return False
\ No newline at end of file
+        logger.error(f"Unexpected error spooling {prediction_type.upper()} prediction data for Google Sheets: {e}")
+        return False
+
+# Rows are written to the outbound spool first and appended in batches
+outbound_sync.register(
+    'sheets',
+    deliver_spooled_rows,
+    batch_size=getattr(settings, 'SHEETS_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+    max_delay=getattr(settings, 'SHEETS_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+)
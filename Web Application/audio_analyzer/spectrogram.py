@@ -0,0 +1,244 @@
+import os
+import io
+import math
+import logging
+import threading
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from django.conf import settings
+
+from .audio_features import magnitude_spectrogram
+
+logger = logging.getLogger(__name__)
+
+# STFT parameters matching librosa.stft defaults used by the predictors' training images
+SPECTROGRAM_N_FFT = 2048
+SPECTROGRAM_HOP = 512
+
+# Dynamic range below the loudest bin, as librosa.amplitude_to_db(top_db=80)
+TOP_DB = 80.0
+AMIN = 1e-5
+
+# Magma at 11 evenly spaced stops; used when matplotlib is not installed
+MAGMA_STOPS = [
+    '#000004', '#140e36', '#3b0f70', '#641a80', '#8c2981', '#b73779',
+    '#de4968', '#f7705c', '#fe9f6d', '#fecf92', '#fcfdbf'
+]
+
+# Figure layout in pixels around the plot area, close to pyplot's tight_layout
+MARGIN_LEFT = 62
+MARGIN_RIGHT = 105
+MARGIN_TOP = 30
+MARGIN_BOTTOM = 42
+COLORBAR_GAP = 18
+COLORBAR_WIDTH = 18
+TICK_LENGTH = 4
+FONT_SIZE = 12
+
+@lru_cache(maxsize=8)
+def colormap_lut(name='magma', size=256):
+    """
+    Return a read-only (size, 3) uint8 lookup table for a colormap
+
+    Uses matplotlib's table when it is installed so images match the
+    legacy renderer; otherwise magma is interpolated from MAGMA_STOPS.
+    """
+    try:
+        from matplotlib import colormaps
+        rgb = colormaps[name](np.linspace(0, 1, size))[:, :3]
+    except ImportError:
+        if name != 'magma':
+            logger.warning(f"matplotlib not installed, using magma instead of {name}")
+        stops = np.array([[int(h[i:i + 2], 16) for i in (1, 3, 5)] for h in MAGMA_STOPS], dtype=np.float64) / 255
+        x = np.linspace(0, 1, size)
+        positions = np.linspace(0, 1, len(stops))
+        rgb = np.stack([np.interp(x, positions, stops[:, c]) for c in range(3)], axis=1)
+    lut = np.round(rgb * 255).astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+_fonts = threading.local()
+
+def _font():
+    # FreeType fonts are not shared between threads
+    font = getattr(_fonts, 'font', None)
+    if font is None:
+        try:
+            font = ImageFont.load_default(size=FONT_SIZE)
+        except TypeError:
+            font = ImageFont.load_default()
+        _fonts.font = font
+    return font
+
+def spectrogram_db(samples, n_fft=SPECTROGRAM_N_FFT, hop_length=SPECTROGRAM_HOP):
+    """
+    Compute the dB spectrogram relative to its loudest bin
+
+    Equivalent to librosa.amplitude_to_db(abs(stft(y)), ref=np.max).
+
+    :param samples: 1-D float32 samples
+    :return: Tuple of (S_db with shape (1 + n_fft // 2, frames), n_fft)
+    """
+    S, n_fft = magnitude_spectrogram(samples, n_fft, hop_length=hop_length)
+    ref = max(float(S.max()), AMIN)
+    S_db = 20.0 * np.log10(np.maximum(S, AMIN) / ref)
+    np.maximum(S_db, -TOP_DB, out=S_db)
+    return S_db, n_fft
+
+def colorize(S_db, width, height, vmin=-TOP_DB, vmax=0.0, cmap='magma'):
+    """
+    Map a dB spectrogram to an RGB image of the given size
+
+    Rows and columns are picked by nearest-neighbour index arithmetic before
+    the colormap lookup, so the cost depends on the output size only.
+
+    :param S_db: dB values with shape (bins, frames), low frequencies first
+    :return: uint8 array of shape (height, width, 3), low frequencies at the bottom
+    """
+    bins, frames = S_db.shape
+    rows = ((np.arange(height)[::-1] + 0.5) * bins / height).astype(np.intp)
+    cols = ((np.arange(width) + 0.5) * frames / width).astype(np.intp)
+    scaled = (S_db[rows[:, None], cols[None, :]] - vmin) * (255.0 / (vmax - vmin))
+    indices = np.clip(scaled, 0, 255).astype(np.uint8)
+    return colormap_lut(cmap)[indices]
+
+def _nice_ticks(vmax, target=8):
+    if vmax <= 0:
+        return np.array([0.0])
+    raw = vmax / target
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw)
+    return np.arange(0, vmax + step * 1e-6, step)
+
+def _format_tick(value):
+    return f'{value:g}' if value < 1000 or value != int(value) else str(int(value))
+
+def render_spectrogram_image(S_db, sample_rate, hop_length=SPECTROGRAM_HOP, size=(1000, 400),
+                             title=None, axes=True, cmap='magma'):
+    """
+    Render a dB spectrogram to a Pillow image without matplotlib
+
+    :param S_db: dB values from spectrogram_db
+    :param sample_rate: Sampling rate of the audio
+    :param hop_length: Hop between STFT frames
+    :param size: Image (width, height) in pixels
+    :param title: Optional title above the plot
+    :param axes: Draw time/frequency axes and a dB colorbar; False renders
+        the bare spectrogram filling the whole image
+    :param cmap: Colormap name
+    :return: PIL.Image in RGB mode
+    """
+    width, height = size
+    if not axes:
+        return Image.fromarray(colorize(S_db, width, height, cmap=cmap), 'RGB')
+
+    left, top = MARGIN_LEFT, MARGIN_TOP
+    right, bottom = width - MARGIN_RIGHT, height - MARGIN_BOTTOM
+    plot_width, plot_height = right - left, bottom - top
+
+    canvas = Image.new('RGB', size, 'white')
+    canvas.paste(Image.fromarray(colorize(S_db, plot_width, plot_height, cmap=cmap), 'RGB'), (left, top))
+    draw = ImageDraw.Draw(canvas)
+    font = _font()
+    draw.rectangle((left - 1, top - 1, right, bottom), outline='black')
+
+    # Time axis
+    duration = S_db.shape[1] * hop_length / sample_rate
+    for t in _nice_ticks(duration):
+        x = left + int(round(t / duration * plot_width)) if duration else left
+        draw.line((x, bottom, x, bottom + TICK_LENGTH), fill='black')
+        draw.text((x, bottom + TICK_LENGTH + 2), _format_tick(round(t, 3)), fill='black', font=font, anchor='mt')
+    draw.text((left + plot_width // 2, height - 4), 'Time', fill='black', font=font, anchor='mb')
+
+    # Frequency axis (linear, as specshow y_axis='hz')
+    nyquist = sample_rate / 2
+    for f in _nice_ticks(nyquist, target=6):
+        y = bottom - int(round(f / nyquist * plot_height))
+        draw.line((left - TICK_LENGTH - 1, y, left - 1, y), fill='black')
+        draw.text((left - TICK_LENGTH - 3, y), _format_tick(f), fill='black', font=font, anchor='rm')
+    draw.text((4, top + plot_height // 2), 'Hz', fill='black', font=font, anchor='lm')
+
+    # Colorbar
+    bar_left = right + COLORBAR_GAP
+    bar_right = bar_left + COLORBAR_WIDTH
+    gradient = colormap_lut(cmap)[np.linspace(255, 0, plot_height).astype(np.uint8)]
+    bar = np.repeat(gradient[:, None, :], COLORBAR_WIDTH, axis=1)
+    canvas.paste(Image.fromarray(np.ascontiguousarray(bar), 'RGB'), (bar_left, top))
+    draw.rectangle((bar_left - 1, top - 1, bar_right, bottom), outline='black')
+    for db in range(0, -int(TOP_DB) - 1, -10):
+        y = top + int(round(-db / TOP_DB * (plot_height - 1)))
+        draw.line((bar_right, y, bar_right + TICK_LENGTH, y), fill='black')
+        draw.text((bar_right + TICK_LENGTH + 2, y), f'{db:+2.0f} dB', fill='black', font=font, anchor='lm')
+
+    if title:
+        draw.text((left + plot_width // 2, top // 2), title, fill='black', font=font, anchor='mm')
+    return canvas
+
+def encode_image(image, path=None, image_format=None):
+    """
+    Encode an image as PNG or WebP
+
+    :param image: PIL.Image
+    :param path: Destination file; the format follows its extension
+    :param image_format: 'png' or 'webp' when writing to memory
+    :return: path when given, otherwise the encoded bytes
+    """
+    if image_format is None:
+        image_format = 'webp' if path and path.lower().endswith('.webp') else 'png'
+    options = {'quality': 80, 'method': 0} if image_format == 'webp' else {'compress_level': 1}
+
+    if path is None:
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format.upper(), **options)
+        return buffer.getvalue()
+
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    image.save(tmp_path, format=image_format.upper(), **options)
+    os.replace(tmp_path, path)
+    os.chmod(path, 0o644)
+    return path
+
+def _render_matplotlib(samples, sample_rate, path, title, size):
+    # Legacy renderer on the object-oriented API: no pyplot global state
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import librosa
+    import librosa.display
+
+    S_db, _ = spectrogram_db(samples)
+    figure = Figure(figsize=(size[0] / 100, size[1] / 100), dpi=100)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    mesh = librosa.display.specshow(S_db, sr=sample_rate, hop_length=SPECTROGRAM_HOP,
+                                    x_axis='time', y_axis='hz', ax=ax)
+    figure.colorbar(mesh, ax=ax, format='%+2.0f dB')
+    ax.set_title(title)
+    figure.tight_layout()
+    figure.savefig(path)
+    os.chmod(path, 0o644)
+    return path
+
+def render_spectrogram(samples, sample_rate, path, title=None, size=(1000, 400), axes=True, renderer=None):
+    """
+    Compute and write the spectrogram image of mono audio
+
+    Safe to call from many threads at once. settings.SPECTROGRAM_RENDERER
+    'matplotlib' switches to the slower legacy renderer, e.g. to reproduce
+    the exact images a model was trained on.
+
+    :param samples: 1-D float32 samples
+    :param sample_rate: Sampling rate of the samples
+    :param path: Destination .png or .webp path
+    :param title: Optional title above the plot
+    :param size: Image (width, height) in pixels
+    :param axes: Draw axes and colorbar
+    :param renderer: 'pillow' or 'matplotlib', defaults to settings.SPECTROGRAM_RENDERER
+    :return: path
+    """
+    if (renderer or getattr(settings, 'SPECTROGRAM_RENDERER', 'pillow')) == 'matplotlib':
+        return _render_matplotlib(samples, sample_rate, path, title, size)
+
+    S_db, _ = spectrogram_db(samples)
+    image = render_spectrogram_image(S_db, sample_rate, size=size, title=title, axes=axes)
+    return encode_image(image, path)
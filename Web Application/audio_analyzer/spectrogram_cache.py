@@ -0,0 +1,341 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+from .spectrogram import render_spectrogram
+from .spectrogram_pool import spectrogram_pool
+from .audio_features import load_audio
+from .archive_utils import recording_archiver
+
+logger = logging.getLogger(__name__)
+
+# Bump when rendering changes so stale images are never served
+CACHE_VERSION = 1
+
+# Default on-disk budget for cached spectrogram images
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Number of lock stripes serializing renders of the same key
+LOCK_STRIPES = 64
+
+IMAGE_FORMATS = ('png', 'webp')
+
+# Render specs are cached next to the images and evicted with them
+SPEC_EXTENSION = 'json'
+
+# Registered audio is copied losslessly into the cache under its content digest
+AUDIO_FORMAT = 'flac'
+
+# Registered clips kept in memory so lazy renders need no decoding
+MAX_PENDING_CLIPS = 16
+
+class SpectrogramCache:
+    """
+    Content-addressed spectrogram images with a size-bounded LRU
+
+    The key hashes the audio content together with every render parameter,
+    so identical requests map to the same file and different requests can
+    never overwrite each other. Files are written to a temporary name and
+    renamed into place. Each file's mtime records its last use, so the LRU
+    order survives restarts; the oldest files are evicted once the cache
+    exceeds settings.SPECTROGRAM_CACHE_MAX_BYTES.
+
+    Images can also be registered without rendering: register() stores a
+    small render spec under the key, plus a copy of the audio under its
+    content digest, and render_registered() produces the image the first
+    time it is requested. The copy never changes, unlike recording paths
+    that are reused by every capture, so a key always renders its own audio.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        :param directory: Cache directory, defaults to
+            settings.SPECTROGRAM_CACHE_DIR (inside MEDIA_ROOT so images are served)
+        :param max_bytes: Size budget, defaults to settings.SPECTROGRAM_CACHE_MAX_BYTES
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._index = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._render_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._pending_clips = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self):
+        return str(self._directory or getattr(settings, 'SPECTROGRAM_CACHE_DIR',
+                                              os.path.join(settings.MEDIA_ROOT, 'spectrogram_cache')))
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or getattr(settings, 'SPECTROGRAM_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    @staticmethod
+    def make_key(digest, **params):
+        """
+        Combine an audio content digest with render parameters into a cache key
+
+        :param digest: Content hash of the audio, e.g. AudioClip.digest()
+        :param params: Render parameters; every value changes the key
+        :return: Hex key
+        """
+        params['renderer'] = getattr(settings, 'SPECTROGRAM_RENDERER', 'pillow')
+        params['version'] = CACHE_VERSION
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.blake2b(f'{digest}:{payload}'.encode(), digest_size=20).hexdigest()
+
+    def clip_key(self, clip, title=None, size=(1000, 400), axes=True):
+        """
+        Return the cache key of a clip's spectrogram
+        """
+        return self.make_key(clip.digest(), title=title, size=list(size), axes=axes)
+
+    def path_for(self, key, image_format='png'):
+        """
+        Return the file path of a cache key (two-level fan-out)
+        """
+        return os.path.join(self.directory, key[:2], f'{key}.{image_format}')
+
+    def _load_index(self):
+        # Rebuild the LRU order from file mtimes on first use
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.rsplit('.', 1)[-1] not in IMAGE_FORMATS + (SPEC_EXTENSION, AUDIO_FORMAT):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._total_bytes = sum(self._index.values())
+
+    def lookup(self, key, image_format='png'):
+        """
+        Return the cached path for a key and mark it as recently used,
+        or None on a miss
+        """
+        path = self.path_for(key, image_format)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            if path in self._index:
+                self._index.move_to_end(path)
+            else:
+                # Written by another process
+                size = os.path.getsize(path)
+                self._index[path] = size
+                self._total_bytes += size
+        return path
+
+    def get_or_render(self, samples, sample_rate, digest, title=None, size=(1000, 400), axes=True,
+                      image_format='png'):
+        """
+        Return the spectrogram image of some audio, rendering it only on a miss
+
+        :param samples: 1-D float32 samples
+        :param sample_rate: Sampling rate of the samples
+        :param digest: Content hash of samples and sample_rate
+        :param title: Title drawn above the plot
+        :param size: Image (width, height) in pixels
+        :param axes: Draw axes and colorbar
+        :param image_format: 'png' or 'webp'
+        :return: Absolute path of the cached image
+        """
+        key = self.make_key(digest, title=title, size=list(size), axes=axes)
+        return self._get_or_render_key(key, lambda: (samples, sample_rate), title, size, axes, image_format)
+
+    def _get_or_render_key(self, key, load, title, size, axes, image_format):
+        path = self.lookup(key, image_format)
+        if path:
+            self.hits += 1
+            return path
+
+        # Concurrent requests for the same image render it once
+        with self._render_locks[int(key[:8], 16) % LOCK_STRIPES]:
+            path = self.lookup(key, image_format)
+            if path:
+                self.hits += 1
+                return path
+
+            self.misses += 1
+            samples, sample_rate = load()
+            path = self.path_for(key, image_format)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            render_spectrogram(samples, sample_rate, path, title, size, axes)
+
+        self._add(path)
+        return path
+
+    def _add(self, path):
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            size_bytes = os.path.getsize(path)
+            self._total_bytes += size_bytes - self._index.pop(path, 0)
+            self._index[path] = size_bytes
+            self._evict()
+
+    def render_batch(self, items, image_format='png', axes=True, pool=None):
+        """
+        Return the spectrogram images of many clips, rendering the misses
+        together on the worker process pool
+
+        Items are consumed lazily, so they can be loaded on demand.
+
+        :param items: Iterable of (clip, title, size)
+        :param image_format: 'png' or 'webp'
+        :param axes: Draw axes and colorbar
+        :param pool: SpectrogramPool, defaults to the global spectrogram_pool
+        :return: List with each item's cached image path, or None where rendering failed
+        """
+        paths = []
+        queued = set()
+
+        def misses():
+            for clip, title, size in items:
+                key = self.clip_key(clip, title, size, axes)
+                path = self.lookup(key, image_format)
+                if path:
+                    self.hits += 1
+                    paths.append(path)
+                    continue
+                path = self.path_for(key, image_format)
+                paths.append(path)
+                if path in queued:
+                    continue
+                queued.add(path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                yield clip.samples, clip.sample_rate, path, title, size, axes
+
+        rendered = [path for path in (pool or spectrogram_pool).render_batch(misses()) if path]
+        for path in rendered:
+            self.misses += 1
+            self._add(path)
+        failed = queued.difference(rendered)
+        return [None if path in failed else path for path in paths]
+
+    def register(self, clip, title=None, size=(1000, 400), axes=True):
+        """
+        Record how to render a clip's spectrogram without rendering it
+
+        The audio is written to the cache on the background archiver, so
+        the image can be rendered later by any process; until then the clip
+        is also kept in memory.
+
+        :param clip: AudioClip
+        :param title: Title drawn above the plot
+        :param size: Image (width, height) in pixels
+        :param axes: Draw axes and colorbar
+        :return: Cache key identifying the image
+        """
+        key = self.clip_key(clip, title, size, axes)
+        with self._lock:
+            self._pending_clips[key] = clip
+            self._pending_clips.move_to_end(key)
+            while len(self._pending_clips) > MAX_PENDING_CLIPS:
+                self._pending_clips.popitem(last=False)
+
+        digest = clip.digest()
+        audio_path = self.path_for(digest, AUDIO_FORMAT)
+        if self.lookup(digest, AUDIO_FORMAT) is None:
+            recording_archiver.submit(audio_path, clip.samples, clip.sample_rate, AUDIO_FORMAT, on_written=self._add)
+
+        if self.lookup(key, SPEC_EXTENSION) is None:
+            spec = {
+                'digest': digest,
+                'frames': len(clip),
+                'sample_rate': clip.sample_rate,
+                'title': title,
+                'size': list(size),
+                'axes': axes
+            }
+            path = self.path_for(key, SPEC_EXTENSION)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(spec, f)
+            os.replace(tmp_path, path)
+            self._add(path)
+        return key
+
+    def render_registered(self, key, image_format='png'):
+        """
+        Return the image of a registered key, rendering it on first request
+
+        :param key: Key returned by register()
+        :param image_format: 'png' or 'webp'
+        :return: Absolute path of the cached image
+        :raises KeyError: The key is unknown or its spec was evicted
+        :raises ValueError: The cached audio has been evicted or does not match
+        """
+        path = self.lookup(key, image_format)
+        if path:
+            self.hits += 1
+            return path
+
+        with self._lock:
+            clip = self._pending_clips.get(key)
+        spec_path = self.lookup(key, SPEC_EXTENSION)
+        if spec_path is None:
+            raise KeyError(key)
+        with open(spec_path) as f:
+            spec = json.load(f)
+
+        def load():
+            if clip is not None:
+                return clip.samples, clip.sample_rate
+            # Specs written before audio was copied into the cache point at reusable paths
+            if not spec.get('digest'):
+                raise ValueError('Spectrogram source is no longer available')
+            audio_path = self.path_for(spec['digest'], AUDIO_FORMAT)
+            if not recording_archiver.wait_for(audio_path) or self.lookup(spec['digest'], AUDIO_FORMAT) is None:
+                raise ValueError('Spectrogram source has expired')
+            samples, sample_rate = load_audio(audio_path)
+            if len(samples) != spec['frames'] or sample_rate != spec['sample_rate']:
+                raise ValueError('Spectrogram source does not match')
+            return samples, sample_rate
+
+        return self._get_or_render_key(key, load, spec['title'], spec['size'], spec['axes'], image_format)
+
+    def _evict(self):
+        # Caller holds self._lock; never evict the entry just added
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            path, size_bytes = self._index.popitem(last=False)
+            self._total_bytes -= size_bytes
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            logger.debug(f"Evicted cached spectrogram {path}")
+
+    def stats(self):
+        """
+        Return cache size and hit statistics
+        """
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            return {
+                'entries': len(self._index),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Global spectrogram cache
+spectrogram_cache = SpectrogramCache()
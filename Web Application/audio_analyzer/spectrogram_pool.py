@@ -0,0 +1,168 @@
+import os
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from django.conf import settings
+
+from .spectrogram import render_spectrogram
+
+logger = logging.getLogger(__name__)
+
+# Default worker processes; leave one core for the web server and capture
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+# Jobs submitted per worker before submit() blocks
+PENDING_PER_WORKER = 4
+
+# Batches smaller than this many jobs per worker are rendered inline: starting
+# the spawned workers costs seconds, an inline render tens of milliseconds
+INLINE_JOBS_PER_WORKER = 2
+
+def _render_shared(shm_name, frames, sample_rate, path, title, size, axes, renderer):
+    # Runs in a worker process: render straight from the parent's shared
+    # memory, so only the segment name crosses the process boundary
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        samples = np.ndarray((frames,), dtype=np.float32, buffer=shm.buf)
+        render_spectrogram(samples, sample_rate, path, title, size, axes, renderer=renderer)
+        error = None
+    except Exception as e:
+        # The traceback would keep the shared buffer exported past close()
+        error = RuntimeError(f'{type(e).__name__}: {e}')
+    samples = None
+    shm.close()
+    if error is not None:
+        raise error
+    return path
+
+def _render_inline(job, renderer):
+    try:
+        return render_spectrogram(*job, renderer=renderer)
+    except Exception as e:
+        logger.error(f"Failed to render spectrogram {job[2]}: {e}")
+        return None
+
+class SpectrogramPool:
+    """
+    Render batches of spectrograms on a pool of worker processes
+
+    Rendering holds the GIL for most of its time, so threads do not help
+    with backfills and exports. Each job's samples are copied once into a
+    shared memory segment that the worker maps; the STFT and the image are
+    computed in the worker and only the output path comes back. At most
+    max_pending jobs (and so shared segments) are in flight; submitting
+    more blocks until a worker finishes, which keeps memory bounded for
+    batches of any size.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        """
+        :param workers: Worker processes, defaults to settings.SPECTROGRAM_POOL_WORKERS;
+            0 renders in the calling process
+        :param max_pending: Jobs in flight, defaults to PENDING_PER_WORKER per worker
+        """
+        self._workers = workers
+        self._max_pending = max_pending
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self):
+        if self._workers is not None:
+            return self._workers
+        return getattr(settings, 'SPECTROGRAM_POOL_WORKERS', DEFAULT_WORKERS)
+
+    def _ensure_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned workers do not inherit the server's threads and locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._slots = threading.BoundedSemaphore(self._max_pending or self.workers * PENDING_PER_WORKER)
+            return self._executor, self._slots
+
+    def _submit(self, samples, sample_rate, path, title, size, axes, renderer):
+        executor, slots = self._ensure_executor()
+        slots.acquire()
+        shm = None
+
+        def release(_):
+            shm.close()
+            shm.unlink()
+            slots.release()
+
+        try:
+            samples = np.ascontiguousarray(samples, dtype=np.float32)
+            shm = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+            np.ndarray(samples.shape, dtype=np.float32, buffer=shm.buf)[:] = samples
+            future = executor.submit(_render_shared, shm.name, len(samples), sample_rate, path,
+                                     title, tuple(size), axes, renderer)
+        except BaseException as e:
+            # Give the slot back even if the segment could not be created
+            # (e.g. /dev/shm is full), or later submits block forever
+            if shm is None:
+                slots.release()
+            else:
+                release(None)
+            if isinstance(e, BrokenProcessPool):
+                self.shutdown(wait=False)
+            raise
+        future.add_done_callback(release)
+        return future
+
+    def render_batch(self, jobs):
+        """
+        Render spectrograms and wait for all of them
+
+        Jobs are consumed lazily, so a generator that loads audio on demand
+        never holds more than max_pending clips. Small batches (fewer than
+        INLINE_JOBS_PER_WORKER jobs per worker, e.g. the images of one
+        interactive session), or any batch with no workers, are rendered in
+        the calling process; the pool is for backfills and exports.
+
+        :param jobs: Iterable of (samples, sample_rate, path, title, size, axes)
+        :return: List with each job's path, or None where rendering failed
+        """
+        renderer = getattr(settings, 'SPECTROGRAM_RENDERER', 'pillow')
+        jobs = iter(jobs)
+        inline_below = max(2, self.workers * INLINE_JOBS_PER_WORKER)
+        head = list(itertools.islice(jobs, inline_below))
+
+        if len(head) < inline_below or self.workers <= 0:
+            return [_render_inline(job, renderer) for job in head]
+
+        futures = [(job[2], self._submit(*job, renderer)) for job in itertools.chain(head, jobs)]
+
+        results = []
+        for path, future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory); start a fresh pool next time
+                logger.error(f"Spectrogram worker pool broke while rendering {path}: {e}")
+                self.shutdown(wait=False)
+                results.append(None)
+            except Exception as e:
+                logger.error(f"Failed to render spectrogram {path}: {e}")
+                results.append(None)
+        return results
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker processes; the next batch starts a new pool
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+# Global spectrogram worker pool
+spectrogram_pool = SpectrogramPool()
@@ -0,0 +1,341 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# A claimed batch is handed to another sync worker if not settled by then
+DEFAULT_LEASE_SECONDS = 120
+
+# Retry delay after the n-th failed attempt: BASE * 2 ** (n - 1), capped
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 3600.0
+
+# Seconds between spool scans when nothing wakes the sync worker
+POLL_SECONDS = 5.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbound (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sink TEXT NOT NULL,
+    target TEXT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    lease_until REAL NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbound_due ON outbound (sink, failed, next_attempt);
+'''
+
+def _json_default(value):
+    # numpy scalars become plain numbers
+    return value.item() if hasattr(value, 'item') else str(value)
+
+class PermanentError(Exception):
+    """
+    Raised by a sink for items that can never be delivered; they are kept
+    in the spool marked as failed instead of being retried
+    """
+
+class OutboundSpool:
+    """
+    Durable write-behind spool for outbound rows, in SQLite WAL mode
+
+    Every item is committed to local disk before anything is sent, so a
+    slow or unreachable service never blocks the caller and nothing is
+    lost across outages or restarts. Each item has an idempotency key,
+    unique in the spool, that sinks can use to skip items a previous
+    attempt already delivered. Items are claimed with a lease, so several
+    sync workers (threads or processes) never send the same item at once.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: SQLite file, defaults to settings.OUTBOUND_SPOOL_PATH
+        """
+        self._path = path
+        self._local = threading.local()
+
+    @property
+    def path(self):
+        return str(self._path or getattr(settings, 'OUTBOUND_SPOOL_PATH',
+                                         os.path.join(settings.BASE_DIR, 'outbound_spool.sqlite3')))
+
+    def _connection(self):
+        # sqlite3 connections are per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f"PRAGMA synchronous={getattr(settings, 'OUTBOUND_SPOOL_SYNCHRONOUS', 'FULL')}")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _executemany(self, sql, params):
+        # One transaction, and so one sync, per batch
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(sql, params)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def append(self, sink, target, payload, key=None):
+        """
+        Durably record an outbound item
+
+        :param sink: Sink name, e.g. 'sheets'
+        :param target: Destination within the sink, e.g. a spreadsheet data type
+        :param payload: JSON-serializable item
+        :param key: Idempotency key; a key already in the spool is ignored
+        :return: The idempotency key
+        """
+        key = key or uuid.uuid4().hex
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR IGNORE INTO outbound (sink, target, key, payload, created, next_attempt) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (sink, target, key, json.dumps(payload, default=_json_default), now, now)
+        )
+        return key
+
+    def claim(self, sink, limit, max_delay=0.0, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Lease the next batch of due items of one sink target
+
+        Items of the oldest due target are returned once `limit` of them
+        are due or the oldest has waited `max_delay` seconds.
+
+        :param sink: Sink name
+        :param limit: Maximum items
+        :param max_delay: Seconds to wait for a fuller batch
+        :param lease_seconds: Seconds before unsettled items can be claimed again
+        :return: (target, [{'id', 'key', 'payload', 'attempts'}]), or (None, [])
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            due = 'sink = ? AND failed = 0 AND next_attempt <= ? AND lease_until <= ?'
+            oldest = connection.execute(
+                f'SELECT target, MIN(created) FROM outbound WHERE {due} GROUP BY target ORDER BY MIN(created) LIMIT 1',
+                (sink, now, now)
+            ).fetchone()
+            if oldest is None:
+                connection.execute('COMMIT')
+                return None, []
+            target, created = oldest
+            rows = connection.execute(
+                f'SELECT id, key, payload, attempts FROM outbound WHERE {due} AND target = ? ORDER BY id LIMIT ?',
+                (sink, now, now, target, limit)
+            ).fetchall()
+            if len(rows) < limit and now - created < max_delay:
+                connection.execute('COMMIT')
+                return None, []
+            connection.executemany(
+                'UPDATE outbound SET lease_until = ?, attempts = attempts + 1 WHERE id = ?',
+                [(now + lease_seconds, row[0]) for row in rows]
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return target, [
+            {'id': row[0], 'key': row[1], 'payload': json.loads(row[2]), 'attempts': row[3] + 1}
+            for row in rows
+        ]
+
+    def complete(self, items):
+        """
+        Remove delivered items
+        """
+        self._executemany('DELETE FROM outbound WHERE id = ?', [(item['id'],) for item in items])
+
+    def retry(self, items, error):
+        """
+        Schedule claimed items for another attempt with exponential backoff
+        """
+        now = time.time()
+        self._executemany(
+            'UPDATE outbound SET lease_until = 0, next_attempt = ?, last_error = ? WHERE id = ?',
+            [(now + min(RETRY_BASE_SECONDS * 2 ** (item['attempts'] - 1), RETRY_MAX_SECONDS), str(error), item['id'])
+             for item in items]
+        )
+
+    def fail(self, items, error):
+        """
+        Keep undeliverable items for inspection without retrying them
+        """
+        self._executemany(
+            'UPDATE outbound SET lease_until = 0, failed = 1, last_error = ? WHERE id = ?',
+            [(str(error), item['id']) for item in items]
+        )
+
+    def reset_failed(self, sink=None):
+        """
+        Make failed items deliverable again, e.g. after fixing credentials
+
+        :return: Number of items reset
+        """
+        query = 'UPDATE outbound SET failed = 0, next_attempt = ? WHERE failed = 1'
+        params = [time.time()]
+        if sink:
+            query += ' AND sink = ?'
+            params.append(sink)
+        return self._connection().execute(query, params).rowcount
+
+    def next_due(self, sink, max_delay=0.0):
+        """
+        Return the earliest time an item of a sink can be claimed, or None
+
+        :param sink: Sink name
+        :param max_delay: Batching delay of the sink
+        """
+        row = self._connection().execute(
+            'SELECT MIN(MAX(next_attempt, lease_until, created + ?)) FROM outbound WHERE sink = ? AND failed = 0',
+            (max_delay, sink)
+        ).fetchone()
+        return row[0]
+
+    def stats(self):
+        """
+        Return pending and failed item counts per sink
+        """
+        rows = self._connection().execute(
+            'SELECT sink, SUM(failed = 0), SUM(failed), MIN(CASE WHEN failed = 0 THEN created END) '
+            'FROM outbound GROUP BY sink'
+        ).fetchall()
+        return {
+            sink: {'pending': pending, 'failed': failed,
+                   'oldest_age': round(time.time() - oldest, 1) if oldest else None}
+            for sink, pending, failed, oldest in rows
+        }
+
+class OutboundSync:
+    """
+    Drain the spool into registered sinks
+
+    A sink is a function taking (target, items) that delivers the items'
+    payloads. Returning normally completes them; an exception retries them
+    with backoff; PermanentError marks them failed. The worker runs as a
+    daemon thread in any process that appends, and the sync_outbound
+    command can drain the spool from a separate process.
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+        self._sinks = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, name, handler, batch_size=50, max_delay=0.0):
+        """
+        Register a sink
+
+        :param name: Sink name used with OutboundSpool.append
+        :param handler: Function (target, items) delivering a batch
+        :param batch_size: Maximum items per call
+        :param max_delay: Seconds to wait for a full batch
+        """
+        self._sinks[name] = (handler, batch_size, max_delay)
+
+    def append(self, sink, target, payload, key=None):
+        """
+        Spool an item and wake the sync worker
+
+        :return: The idempotency key
+        """
+        key = self.spool.append(sink, target, payload, key)
+        self._ensure_worker()
+        self._wake.set()
+        return key
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run_forever, name='outbound-sync', daemon=True)
+                self._thread.start()
+
+    def run_once(self, force=False):
+        """
+        Deliver every batch that is due
+
+        :param force: Ignore the batching delay
+        :return: Number of items delivered
+        """
+        delivered = 0
+        for name, (handler, batch_size, max_delay) in list(self._sinks.items()):
+            while True:
+                target, items = self.spool.claim(name, batch_size, 0.0 if force else max_delay)
+                if not items:
+                    break
+                try:
+                    handler(target, items)
+                except PermanentError as e:
+                    logger.error(f"Dropping {len(items)} {name}/{target} item(s): {e}")
+                    self.spool.fail(items, e)
+                    continue
+                except Exception as e:
+                    logger.warning(f"Delivery of {len(items)} {name}/{target} item(s) failed, will retry: {e}")
+                    self.spool.retry(items, e)
+                    break
+                self.spool.complete(items)
+                delivered += len(items)
+        return delivered
+
+    def _sleep_seconds(self):
+        now = time.time()
+        waits = [POLL_SECONDS]
+        for name, (_, _, max_delay) in self._sinks.items():
+            due = self.spool.next_due(name, max_delay)
+            if due is not None:
+                waits.append(due - now)
+        return max(min(waits), 0.05)
+
+    def run_forever(self):
+        while True:
+            try:
+                self.run_once()
+                timeout = self._sleep_seconds()
+            except Exception as e:
+                logger.error(f"Outbound sync error: {e}")
+                timeout = POLL_SECONDS
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def flush(self, timeout=None):
+        """
+        Try to deliver everything due now, ignoring batching delays
+
+        :param timeout: Maximum time to keep trying in seconds
+        :return: True if no deliverable items are left
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            self.run_once(force=True)
+            pending = {name: self.spool.next_due(name) for name in self._sinks}
+            pending = [due for due in pending.values() if due is not None]
+            if not pending:
+                return True
+            wait = max(min(pending) - time.time(), 0.1)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# Global outbound spool and its sync worker
+outbound_spool = OutboundSpool()
+outbound_sync = OutboundSync(outbound_spool)
@@ -0,0 +1,527 @@
+import os
+import re
+import logging
+import threading
+import time
+import warnings
+import numpy as np
+from django.conf import settings
+
+from .audio_features import (
+    DEFAULT_N_FFT, get_bee_bands, magnitude_spectrogram, features_from_psd, to_mono_float32
+)
+
+logger = logging.getLogger(__name__)
+
+# Default telemetry retention: 30 days of 1-second rows per hive
+DEFAULT_RETENTION_SECONDS = 30 * 86400
+
+# Header: magic, capacity, field count, last written slot, seconds per slot
+RING_MAGIC = 0x42454D38  # 'BEM8'
+HEADER_WORDS = 5
+HEADER_BYTES = HEADER_WORDS * 8
+
+# Ring files per hive: every field once per second, and their means once per
+# minute as the coarse level for long range queries
+SECONDS_SUFFIX = '.seconds.u8ring'
+MINUTES_SUFFIX = '.minutes.u8ring'
+MINUTE_SECONDS = 60
+
+# FFT length for the per-second summaries
+TELEMETRY_N_FFT = 2048
+
+# Floor for band energies stored in dB
+MIN_ENERGY_DB = -120.0
+
+# Values are stored as one byte: codes 0-254 span the field's range, 255 is missing
+MISSING_CODE = 255
+MAX_CODE = 254
+
+# Quantisation per field: (transform, low, high) in the transformed domain.
+# RMS in dBFS (0.5 dB steps), peak frequency on a log scale (~1.4% steps)
+# and band energies in dB (0.8 dB steps).
+FIELD_SCALES = {
+    'rms': ('db', MIN_ENERGY_DB, 6.0),
+    'peak_frequency': ('log10', 1.0, np.log10(24000.0)),
+}
+BAND_DB_SCALE = ('linear', MIN_ENERGY_DB, 90.0)
+
+def get_telemetry_fields(bands=None):
+    """
+    Return the column names stored per second
+
+    :return: ['rms', 'peak_frequency', '<band>_db', ...]
+    """
+    bands = bands or get_bee_bands()
+    return ['rms', 'peak_frequency'] + [f'{name}_db' for name in bands]
+
+def telemetry_values(features, bands=None):
+    """
+    Pick the telemetry fields out of a feature dictionary
+
+    :param features: Dictionary returned by features_from_psd
+    :param bands: Optional band definitions, defaults to get_bee_bands()
+    :return: Ordered dictionary of field name to value, as in get_telemetry_fields()
+    """
+    bands = bands or get_bee_bands()
+    values = {'rms': float(features['rms']), 'peak_frequency': float(features['peak_frequency'])}
+    for name in bands:
+        energy = features['band_energies'].get(name, 0.0)
+        values[f'{name}_db'] = max(MIN_ENERGY_DB, float(10 * np.log10(energy + 1e-20)))
+    return values
+
+class FieldCodec:
+    """
+    Quantise telemetry rows to one byte per field and back
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: Field names, in column order
+        """
+        scales = [FIELD_SCALES.get(field, BAND_DB_SCALE) for field in fields]
+        self.transforms = [transform for transform, _, _ in scales]
+        self.low = np.array([low for _, low, _ in scales])
+        self.high = np.array([high for _, _, high in scales])
+
+    def encode(self, values):
+        """
+        :param values: Array of shape (rows, fields); NaN marks missing values
+        :return: uint8 codes of the same shape
+        """
+        values = np.array(values, dtype=np.float64, ndmin=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, transform in enumerate(self.transforms):
+                if transform == 'db':
+                    values[:, i] = 20 * np.log10(np.maximum(values[:, i], 1e-12))
+                elif transform == 'log10':
+                    values[:, i] = np.log10(np.maximum(values[:, i], 10.0 ** self.low[i]))
+            scaled = np.rint((values - self.low) / (self.high - self.low) * MAX_CODE)
+        missing = np.isnan(scaled)
+        codes = np.clip(np.where(missing, 0, scaled), 0, MAX_CODE).astype(np.uint8)
+        codes[missing] = MISSING_CODE
+        return codes
+
+    def decode(self, codes):
+        """
+        :param codes: uint8 array of shape (rows, fields)
+        :return: float32 values; missing values are NaN
+        """
+        values = self.low + codes.astype(np.float64) / MAX_CODE * (self.high - self.low)
+        for i, transform in enumerate(self.transforms):
+            if transform == 'db':
+                values[:, i] = 10.0 ** (values[:, i] / 20)
+            elif transform == 'log10':
+                values[:, i] = 10.0 ** values[:, i]
+        values[codes == MISSING_CODE] = np.nan
+        return values.astype(np.float32)
+
+def telemetry_dir():
+    """
+    Return the directory holding the per-hive ring files
+    """
+    return str(getattr(settings, 'TELEMETRY_DIR', os.path.join(settings.BASE_DIR, 'telemetry')))
+
+def _ring_path(hive_id, suffix):
+    if not re.match(r'^[A-Za-z0-9_-]+$', hive_id or ''):
+        raise ValueError(f"Invalid hive id: {hive_id!r}")
+    return os.path.join(telemetry_dir(), f'{hive_id}{suffix}')
+
+class TelemetryRing:
+    """
+    Fixed-size, memory-mapped ring of one-byte quantised rows
+
+    Each row covers `resolution` seconds; row i holds the slot s (epoch
+    second // resolution) with s % capacity == i. The header records the
+    last written slot, so any slot in (last - capacity, last] maps to
+    exactly one row; slots skipped by the writer are marked missing.
+    The file never grows and readers map it without loading it.
+    """
+
+    def __init__(self, path, fields, capacity=None, resolution=1, readonly=False):
+        """
+        :param path: Ring file path
+        :param fields: Field names stored per row
+        :param capacity: Rows in the ring, defaults to settings.TELEMETRY_RETENTION_SECONDS
+            divided by resolution; ignored for existing files
+        :param resolution: Seconds per row; ignored for existing files
+        :param readonly: Open an existing ring for queries only
+        """
+        self.path = path
+        self.readonly = readonly
+        self.codec = FieldCodec(fields)
+        self._lock = threading.Lock()
+        n_fields = len(fields)
+
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError(path)
+            retention = int(getattr(settings, 'TELEMETRY_RETENTION_SECONDS', DEFAULT_RETENTION_SECONDS))
+            self._create(int(capacity or max(1, retention // resolution)), n_fields, resolution)
+
+        mode = 'r' if readonly else 'r+'
+        self.header = np.memmap(path, dtype=np.int64, mode=mode, shape=(HEADER_WORDS,))
+        if self.header[0] != RING_MAGIC or self.header[2] != n_fields:
+            raise ValueError(f"{path} is not a telemetry ring with {n_fields} fields")
+        self.capacity = int(self.header[1])
+        self.resolution = int(self.header[4])
+        self.n_fields = n_fields
+        self.data = np.memmap(path, dtype=np.uint8, mode=mode, offset=HEADER_BYTES,
+                              shape=(self.capacity, n_fields))
+
+    def _create(self, capacity, n_fields, resolution):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        header = np.memmap(tmp_path, dtype=np.int64, mode='w+', shape=(HEADER_WORDS,))
+        header[:] = (RING_MAGIC, capacity, n_fields, -1, resolution)
+        header.flush()
+        del header
+        data = np.memmap(tmp_path, dtype=np.uint8, mode='r+', offset=HEADER_BYTES, shape=(capacity, n_fields))
+        data[:] = MISSING_CODE
+        data.flush()
+        del data
+        os.replace(tmp_path, self.path)
+        logger.info(f"Created telemetry ring {self.path} ({capacity} x {resolution}s x {n_fields} fields)")
+
+    @property
+    def last_second(self):
+        """
+        Epoch second at the start of the newest row, or None for an empty ring
+        """
+        last = int(self.header[3])
+        return None if last < 0 else last * self.resolution
+
+    def write(self, second, values):
+        """
+        Store the summary of one row
+
+        :param second: Integer epoch second within the row
+        :param values: Sequence of n_fields numbers
+        """
+        slot = int(second) // self.resolution
+        codes = self.codec.encode([values])[0]
+        with self._lock:
+            last = int(self.header[3])
+            if last >= 0 and slot <= last:
+                # Late or repeated row: overwrite it while it is still in the ring
+                if slot > last - self.capacity:
+                    self.data[slot % self.capacity] = codes
+                return
+
+            # Mark skipped rows as missing
+            if last >= 0 and slot - last > 1:
+                gap = np.arange(last + 1, slot)[-self.capacity:] % self.capacity
+                self.data[gap] = MISSING_CODE
+
+            self.data[slot % self.capacity] = codes
+            self.header[3] = slot
+
+    def query(self, start, end, step=1):
+        """
+        Read rows for a time range, optionally averaged into coarser steps
+
+        :param start: First epoch second (inclusive)
+        :param end: Last epoch second (inclusive)
+        :param step: Seconds per returned row, rounded to whole rows; each
+            row is the NaN-aware mean
+        :return: Tuple of (epoch second of the first row, float32 array of
+            shape (rows, n_fields)); missing values are NaN
+        """
+        last = int(self.header[3])
+        step = max(1, int(step) // self.resolution)
+        first = max(int(start) // self.resolution, last - self.capacity + 1)
+        end = min(int(end) // self.resolution, last)
+        if last < 0 or end < first:
+            return first * self.resolution, np.empty((0, self.n_fields), dtype=np.float32)
+
+        rows = np.arange(first, end + 1) % self.capacity
+        values = self.codec.decode(self.data[rows])
+
+        if step > 1:
+            pad = (-len(values)) % step
+            if pad:
+                values = np.concatenate((values, np.full((pad, self.n_fields), np.nan, dtype=np.float32)))
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                values = np.nanmean(values.reshape(-1, step, self.n_fields), axis=1)
+        return first * self.resolution, values
+
+    def flush(self):
+        """
+        Write dirty pages back to the ring file
+        """
+        if not self.readonly:
+            self.header.flush()
+            self.data.flush()
+
+class HiveTelemetry:
+    """
+    The telemetry of one hive: every field once per second, plus minute
+    means that answer queries with steps of a minute or more
+
+    At one byte per value this is about 18 MB per hive for 30 days, so
+    seconds-long events such as a piping burst in piping_db are kept.
+    """
+
+    def __init__(self, hive_id, readonly=False):
+        """
+        :param hive_id: Hive identifier
+        :param readonly: Open existing rings for queries only
+        """
+        self.fields = get_telemetry_fields()
+        self.seconds = TelemetryRing(_ring_path(hive_id, SECONDS_SUFFIX), self.fields, readonly=readonly)
+        self.minutes = TelemetryRing(_ring_path(hive_id, MINUTES_SUFFIX), self.fields,
+                                     resolution=MINUTE_SECONDS, readonly=readonly)
+        self._minute = None
+        self._sums = np.zeros(len(self.fields))
+        self._counts = np.zeros(len(self.fields))
+
+    @property
+    def last_second(self):
+        return self.seconds.last_second
+
+    def write(self, second, values):
+        """
+        Store one second and fold it into the running minute mean
+
+        :param second: Integer epoch second
+        :param values: Values of every field, as in get_telemetry_fields()
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.seconds.write(second, values)
+
+        minute = int(second) // MINUTE_SECONDS
+        if self._minute is not None and minute < self._minute:
+            return
+        if minute != self._minute:
+            self._write_minute()
+            self._minute = minute
+            self._sums[:] = 0
+            self._counts[:] = 0
+        present = ~np.isnan(values)
+        self._sums[present] += values[present]
+        self._counts[present] += 1
+
+    def _write_minute(self):
+        if self._minute is not None and self._counts.any():
+            with np.errstate(invalid='ignore'):
+                self.minutes.write(self._minute * MINUTE_SECONDS, self._sums / self._counts)
+
+    def query(self, start, end, step=1):
+        """
+        Read a time range from the seconds ring, or from the minute ring
+        for steps of a minute or more (rounded up to whole minutes)
+
+        :return: Tuple of (epoch second of the first row, step in seconds,
+            float32 array of shape (rows, fields))
+        """
+        step = max(1, int(step))
+        if step >= MINUTE_SECONDS:
+            step = -(-step // MINUTE_SECONDS) * MINUTE_SECONDS
+            first, values = self.minutes.query(start, end, step)
+            return first, step, values
+
+        first, values = self.seconds.query(start, end, step)
+        return first, step, values
+
+    def resolutions(self):
+        """
+        Return the stored resolution of each field in seconds
+        """
+        return {field: 1 for field in self.fields}
+
+    def flush(self):
+        """
+        Store the current partial minute and write both rings to disk
+        """
+        self._write_minute()
+        self.seconds.flush()
+        self.minutes.flush()
+
+def open_ring(hive_id, readonly=False):
+    """
+    Open (or create) the telemetry rings of a hive
+
+    :param hive_id: Hive identifier
+    :param readonly: Open existing rings for queries only
+    :return: HiveTelemetry
+    """
+    return HiveTelemetry(hive_id, readonly=readonly)
+
+def list_telemetry_hives():
+    """
+    Return the hive ids that have telemetry
+    """
+    directory = telemetry_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len(SECONDS_SUFFIX)] for name in os.listdir(directory) if name.endswith(SECONDS_SUFFIX))
+
+class SecondSummarizer:
+    """
+    Turn a live stream into one feature row per second of audio
+    """
+
+    def __init__(self, sample_rate, start_time=None, bands=None):
+        """
+        :param sample_rate: Sampling rate of the stream
+        :param start_time: Epoch time of the first sample, defaults to now
+        :param bands: Optional band definitions, defaults to get_bee_bands()
+        """
+        self.sample_rate = sample_rate
+        self.start_time = start_time if start_time is not None else time.time()
+        self.bands = bands or get_bee_bands()
+        self.n_fft = min(TELEMETRY_N_FFT, DEFAULT_N_FFT, sample_rate)
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._seconds_done = 0
+
+    def summarize(self, y):
+        """
+        Summarize one second of mono float32 audio
+
+        :return: Feature dictionary from features_from_psd
+        """
+        S, n_fft = magnitude_spectrogram(y, self.n_fft, center=False)
+        psd = np.mean(np.square(S), axis=1)
+        freqs = np.fft.rfftfreq(n_fft, 1.0 / self.sample_rate)
+        rms = float(np.sqrt(np.mean(np.square(y))))
+        return features_from_psd(freqs, psd, self.sample_rate, rms, len(y) / self.sample_rate, self.bands)
+
+    def row(self, features):
+        """
+        Convert a feature dictionary to the stored column values
+        """
+        return list(telemetry_values(features, self.bands).values())
+
+    def update(self, block):
+        """
+        Feed the next block of samples
+
+        :param block: Samples in any WAV dtype, mono or multi-channel
+        :return: List of (epoch second, feature dictionary) for every
+            second completed by this block
+        """
+        y = to_mono_float32(block)
+        buffer = np.concatenate((self._carry, y)) if len(self._carry) else y
+        completed = len(buffer) // self.sample_rate
+
+        results = []
+        for n in range(completed):
+            second = buffer[n * self.sample_rate:(n + 1) * self.sample_rate]
+            timestamp = int(self.start_time + self._seconds_done)
+            results.append((timestamp, self.summarize(second)))
+            self._seconds_done += 1
+
+        self._carry = buffer[completed * self.sample_rate:].copy()
+        return results
+
+class TelemetryMonitor:
+    """
+    Continuous per-second telemetry for every hive of a CaptureManager
+
+    Polls the capture ring buffers, summarizes each completed second per
+    hive, writes it to the hive's ring file and passes it to listeners,
+    e.g. an anomaly detector: listener(hive_id, second, features). Audio
+    listeners receive the raw samples of every poll instead, e.g. a tile
+    builder: audio_listener(hive_id, samples, start_time).
+    """
+
+    def __init__(self, manager, listeners=None, flush_seconds=60, audio_listeners=None):
+        """
+        :param manager: Started CaptureManager
+        :param listeners: Optional callables notified for every second
+        :param flush_seconds: Interval between ring file flushes
+        :param audio_listeners: Optional callables receiving each new block of samples
+        """
+        self.manager = manager
+        self.listeners = list(listeners or [])
+        self.audio_listeners = list(audio_listeners or [])
+        self._samples_seen = {}
+        self.flush_seconds = flush_seconds
+        self.fields = get_telemetry_fields()
+        self.rings = {hive['hive_id']: open_ring(hive['hive_id']) for hive in manager.hive_inputs}
+        self.summarizers = {}
+        self._positions = {device: 0 for device in manager.devices}
+        self._last_flush = time.monotonic()
+
+    def poll(self):
+        """
+        Process every frame captured since the previous poll
+
+        :return: Number of seconds written across all hives
+        """
+        written = 0
+        blocks = {}
+        for device, capture in self.manager.devices.items():
+            blocks[device], self._positions[device] = capture.buffer.read_since(self._positions[device])
+
+        for hive_input in self.manager.hive_inputs:
+            hive_id = hive_input['hive_id']
+            block = blocks[hive_input['device']]
+            if not len(block):
+                continue
+            channel = block[:, hive_input.get('channel', 0)]
+
+            if hive_id not in self.summarizers:
+                # Timestamp the first sample from the wall clock and the block length
+                start_time = time.time() - len(channel) / self.manager.sample_rate
+                self.summarizers[hive_id] = SecondSummarizer(self.manager.sample_rate, start_time)
+            summarizer = self.summarizers[hive_id]
+
+            seen = self._samples_seen.get(hive_id, 0)
+            self._samples_seen[hive_id] = seen + len(channel)
+            for audio_listener in self.audio_listeners:
+                try:
+                    audio_listener(hive_id, channel, summarizer.start_time + seen / self.manager.sample_rate)
+                except Exception as e:
+                    logger.error(f"Telemetry audio listener error for {hive_id}: {e}")
+
+            for second, features in summarizer.update(channel):
+                self.rings[hive_id].write(second, summarizer.row(features))
+                written += 1
+                for listener in self.listeners:
+                    try:
+                        listener(hive_id, second, features)
+                    except Exception as e:
+                        logger.error(f"Telemetry listener error for {hive_id}: {e}")
+
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+        return written
+
+    def flush(self):
+        """
+        Flush every ring file to disk
+        """
+        for ring in self.rings.values():
+            ring.flush()
+        self._last_flush = time.monotonic()
+
+def query_telemetry(hive_id, start, end, step=1, max_points=None):
+    """
+    Range query over a hive's telemetry for dashboards
+
+    :param hive_id: Hive identifier
+    :param start: First epoch second (inclusive)
+    :param end: Last epoch second (inclusive)
+    :param step: Requested seconds per point
+    :param max_points: Upper bound on returned points; step grows to fit
+    :return: Dictionary with 'fields', the stored 'resolution' of each
+        field in seconds, 'start', 'step' and 'values' (rows of floats,
+        None for missing data)
+    """
+    if max_points:
+        step = max(int(step), int(np.ceil((int(end) - int(start) + 1) / max_points)))
+
+    ring = open_ring(hive_id, readonly=True)
+    first, step, values = ring.query(start, end, step)
+    values = np.round(values.astype(np.float64), 4)
+    return {
+        'hive_id': hive_id,
+        'fields': ring.fields,
+        'resolution': ring.resolutions(),
+        'start': first,
+        'step': step,
+        'last_second': ring.last_second,
+        'values': [[None if np.isnan(v) else float(v) for v in row] for row in values]
+    }
@@ -0,0 +1,53 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from .piping_detector import PipingMonitor, detect_piping
+
+SAMPLE_RATE = 16000
+
+def colony_hum(fundamental, seconds=10, second_harmonic=1.0, seed=0):
+    """
+    Harmonic-rich colony hum whose 2nd harmonic falls inside the piping bank
+    """
+    t = np.arange(seconds * SAMPLE_RATE) / SAMPLE_RATE
+    rng = np.random.default_rng(seed)
+    hum = (np.sin(2 * np.pi * fundamental * t)
+           + second_harmonic * np.sin(2 * np.pi * 2 * fundamental * t)
+           + 0.3 * np.sin(2 * np.pi * 3 * fundamental * t))
+    return (0.3 * hum + 0.01 * rng.normal(size=len(t))).astype(np.float32), t
+
+def add_toot(y, t, frequency=410, start=4.0, end=5.0):
+    y = y.copy()
+    mask = (t > start) & (t < end)
+    y[mask] += 0.3 * np.sin(2 * np.pi * frequency * t[mask])
+    return y
+
+class PipingDetectorTests(SimpleTestCase):
+    def test_hum_without_tooting_is_not_piping(self):
+        for fundamental in (120, 150, 180, 200, 230, 250, 280):
+            for second_harmonic in (0.5, 1.0):
+                with self.subTest(fundamental=fundamental, second_harmonic=second_harmonic):
+                    y, _ = colony_hum(fundamental, second_harmonic=second_harmonic)
+                    self.assertEqual(detect_piping(y, SAMPLE_RATE), [])
+
+    def test_tooting_over_hum_is_detected(self):
+        for fundamental in (230, 250, 280):
+            with self.subTest(fundamental=fundamental):
+                y, t = colony_hum(fundamental)
+                events = detect_piping(add_toot(y, t), SAMPLE_RATE)
+                self.assertEqual(len(events), 1)
+                self.assertAlmostEqual(events[0]['start'], 4.0, delta=0.1)
+                self.assertAlmostEqual(events[0]['end'], 5.0, delta=0.1)
+                self.assertEqual(events[0]['frequency'], 400.0)
+
+    def test_monitor_timestamps_streamed_events(self):
+        y, t = colony_hum(250)
+        y = add_toot(y, t)
+        received = []
+        monitor = PipingMonitor(SAMPLE_RATE, listeners=[lambda hive_id, event: received.append(hive_id)])
+        for start in range(0, len(y), SAMPLE_RATE // 4):
+            monitor.observe('hive-1', y[start:start + SAMPLE_RATE // 4], 1000.0 + start / SAMPLE_RATE)
+        monitor.flush()
+
+        self.assertEqual(received, ['hive-1'])
+        self.assertAlmostEqual(monitor.events['hive-1'][0]['timestamp'], 1004.0, delta=0.1)
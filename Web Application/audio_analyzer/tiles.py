@@ -0,0 +1,329 @@
+import os
+import re
+import math
+import time
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+from django.conf import settings
+
+from .audio_features import to_mono_float32
+from .spectrogram import colormap_lut, encode_image
+
+logger = logging.getLogger(__name__)
+
+# Tiles are TILE_SIZE x TILE_SIZE pixels, one column per time step
+TILE_SIZE = 256
+
+# Level 0: one column every BASE_COLUMN_SECONDS, LEVEL0_ROWS frequency rows
+BASE_COLUMN_SECONDS = 0.25
+LEVEL0_ROWS = 512
+
+# Defaults for settings.SPECTROGRAM_TILE_* overrides
+DEFAULT_LEVELS = 14                  # Level 13 tiles span about 6 days
+DEFAULT_MAX_FREQUENCY = 4000.0       # Hz covered by the rows
+DEFAULT_DB_RANGE = (-100.0, -20.0)   # dBFS mapped onto the colormap
+DEFAULT_FINE_RETENTION_DAYS = 7
+DEFAULT_FINE_LEVELS = 6              # Levels below this are pruned after the retention
+
+# Open tile files kept mapped per pyramid
+MAX_OPEN_TILES = 16
+
+# Seconds between retention sweeps
+PRUNE_SECONDS = 3600
+
+def level_info(level):
+    """
+    Describe one pyramid level
+
+    Each level halves the time resolution of the one below; the frequency
+    resolution halves too until a single tile row covers the whole band.
+
+    :return: Dictionary with 'column_seconds', 'tile_seconds', 'rows' and 'y_tiles'
+    """
+    rows = max(TILE_SIZE, LEVEL0_ROWS >> level)
+    column_seconds = BASE_COLUMN_SECONDS * 2 ** level
+    return {
+        'level': level,
+        'column_seconds': column_seconds,
+        'tile_seconds': column_seconds * TILE_SIZE,
+        'rows': rows,
+        'y_tiles': rows // TILE_SIZE
+    }
+
+def tiles_dir(hive_id=None):
+    """
+    Return the tile root, or the directory of one hive
+    """
+    root = str(getattr(settings, 'SPECTROGRAM_TILE_DIR', os.path.join(settings.BASE_DIR, 'spectrogram_tiles')))
+    if hive_id is None:
+        return root
+    if not re.match(r'^[A-Za-z0-9_-]+$', hive_id or ''):
+        raise ValueError(f"Invalid hive id: {hive_id!r}")
+    return os.path.join(root, hive_id)
+
+def _tile_path(hive_id, level, x):
+    return os.path.join(tiles_dir(hive_id), str(level), f'{x}.npy')
+
+def _db_range():
+    return tuple(getattr(settings, 'SPECTROGRAM_TILE_DB_RANGE', DEFAULT_DB_RANGE))
+
+class TilePyramid:
+    """
+    Incrementally built multi-resolution spectrogram of one hive
+
+    Audio is cut into BASE_COLUMN_SECONDS columns aligned to epoch time;
+    each column's power spectrum is averaged into LEVEL0_ROWS frequency
+    rows. Every two columns of a level are averaged into one column of the
+    next, so all levels are updated in O(levels) per column and nothing is
+    ever recomputed. Tiles are memory-mapped uint8 .npy files holding
+    quantized dB (0 = no data), one per level and TILE_SIZE columns.
+    """
+
+    def __init__(self, hive_id, sample_rate, start_time, levels=None, max_frequency=None):
+        """
+        :param hive_id: Hive identifier
+        :param sample_rate: Sampling rate of the stream
+        :param start_time: Epoch time of the first sample
+        :param levels: Number of levels, defaults to settings.SPECTROGRAM_TILE_LEVELS
+        :param max_frequency: Top of the frequency axis in Hz
+        """
+        self.hive_id = hive_id
+        self.sample_rate = sample_rate
+        self.levels = levels or getattr(settings, 'SPECTROGRAM_TILE_LEVELS', DEFAULT_LEVELS)
+        self.max_frequency = max_frequency or getattr(settings, 'SPECTROGRAM_TILE_MAX_FREQUENCY', DEFAULT_MAX_FREQUENCY)
+        self.db_min, self.db_max = _db_range()
+
+        # Each column averages overlapping FFT frames spanning its samples
+        self.column_samples = int(round(sample_rate * BASE_COLUMN_SECONDS))
+        self.n_fft = 2 ** int(math.log2(self.column_samples))
+        frame_count = max(1, int(round(2 * self.column_samples / self.n_fft)) - 1)
+        self.frame_offsets = np.linspace(0, self.column_samples - self.n_fft, frame_count).astype(np.intp)
+        self.window = np.hanning(self.n_fft).astype(np.float32)
+        self.scale = (self.window.sum() / 2) ** 2  # Full-scale sine peak = 0 dBFS
+
+        # Row r averages the FFT bins in [edges[r], edges[r + 1]); narrow rows take the nearest bin
+        freqs = np.fft.rfftfreq(self.n_fft, 1.0 / sample_rate)
+        row_edges = np.linspace(0, self.max_frequency, LEVEL0_ROWS + 1)
+        self.edges = np.minimum(np.searchsorted(freqs, row_edges[:-1]), len(freqs) - 1)
+        self.stop = max(int(np.searchsorted(freqs, row_edges[-1])), int(self.edges[-1]) + 1)
+        self.counts = np.maximum(1, np.diff(np.append(self.edges, self.stop)))
+        self.valid_rows = row_edges[:-1] < sample_rate / 2
+
+        self._column = int(math.floor(start_time / BASE_COLUMN_SECONDS))
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._pending = {}
+        self._tiles = OrderedDict()
+
+    def _column_power(self, samples):
+        frames = samples[self.frame_offsets[:, None] + np.arange(self.n_fft)] * self.window
+        power = np.mean(np.abs(np.fft.rfft(frames, axis=1)) ** 2, axis=0) / self.scale
+        rows = np.add.reduceat(power[:self.stop], self.edges) / self.counts
+        rows[~self.valid_rows] = np.nan
+        return rows.astype(np.float32)
+
+    def update(self, block):
+        """
+        Feed the next block of the stream
+
+        :param block: Samples in any WAV dtype, mono or multi-channel
+        :return: Number of level 0 columns completed
+        """
+        y = to_mono_float32(block)
+        buffer = np.concatenate((self._carry, y)) if len(self._carry) else y
+        completed = len(buffer) // self.column_samples
+        for n in range(completed):
+            samples = buffer[n * self.column_samples:(n + 1) * self.column_samples]
+            self._emit(0, self._column, self._column_power(samples))
+            self._column += 1
+        self._carry = buffer[completed * self.column_samples:].copy()
+        return completed
+
+    def _emit(self, level, column, power):
+        self._write(level, column, power)
+        if level + 1 >= self.levels:
+            return
+
+        # Pair columns 2k and 2k + 1 into column k of the next level
+        pending = self._pending.get(level)
+        if pending is not None and pending[0] // 2 != column // 2:
+            # The partner never arrived (gap in the stream): promote alone
+            del self._pending[level]
+            self._promote(level, pending[0] // 2, pending[1])
+            pending = None
+        if pending is None:
+            if column % 2 == 0:
+                self._pending[level] = (column, power)
+            else:
+                self._promote(level, column // 2, power)
+            return
+        del self._pending[level]
+        self._promote(level, column // 2, (pending[1] + power) / 2)
+
+    def _promote(self, level, column, power):
+        if level_info(level + 1)['rows'] < len(power):
+            power = power.reshape(-1, 2).mean(axis=1)
+        self._emit(level + 1, column, power)
+
+    def _tile(self, level, x):
+        key = (level, x)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        path = _tile_path(self.hive_id, level, x)
+        if os.path.exists(path):
+            tile = np.load(path, mmap_mode='r+')
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tile = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                             shape=(level_info(level)['rows'], TILE_SIZE))
+        self._tiles[key] = tile
+        while len(self._tiles) > MAX_OPEN_TILES:
+            _, closed = self._tiles.popitem(last=False)
+            closed.flush()
+        return tile
+
+    def _write(self, level, column, power):
+        x, offset = divmod(column, TILE_SIZE)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            db = 10 * np.log10(np.maximum(power, 1e-30))
+            scaled = (db - self.db_min) * (254.0 / (self.db_max - self.db_min))
+        values = np.clip(np.nan_to_num(scaled, nan=-1.0), 0, 254).astype(np.uint8) + 1
+        values[np.isnan(power)] = 0
+        self._tile(level, x)[:, offset] = values
+
+    def flush(self):
+        """
+        Write every open tile back to disk
+        """
+        for tile in self._tiles.values():
+            tile.flush()
+
+class TileBuilder:
+    """
+    Feed per-hive audio from a TelemetryMonitor into tile pyramids
+
+    Use observe() as an audio listener: listener(hive_id, samples, start_time).
+    Fine levels are pruned after settings.SPECTROGRAM_TILE_FINE_RETENTION_DAYS.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.pyramids = {}
+        self._last_prune = 0.0
+
+    def observe(self, hive_id, samples, start_time):
+        pyramid = self.pyramids.get(hive_id)
+        if pyramid is None:
+            pyramid = self.pyramids[hive_id] = TilePyramid(hive_id, self.sample_rate, start_time)
+        pyramid.update(samples)
+
+        if time.monotonic() - self._last_prune >= PRUNE_SECONDS:
+            self._last_prune = time.monotonic()
+            prune_tiles()
+
+    def flush(self):
+        for pyramid in self.pyramids.values():
+            pyramid.flush()
+
+def prune_tiles(max_age_days=None, fine_levels=None):
+    """
+    Delete fine-level tiles older than the retention period; coarse levels
+    are small and kept indefinitely
+
+    :return: Number of tiles removed
+    """
+    max_age_days = max_age_days if max_age_days is not None else getattr(
+        settings, 'SPECTROGRAM_TILE_FINE_RETENTION_DAYS', DEFAULT_FINE_RETENTION_DAYS)
+    fine_levels = fine_levels if fine_levels is not None else getattr(
+        settings, 'SPECTROGRAM_TILE_FINE_LEVELS', DEFAULT_FINE_LEVELS)
+    root = tiles_dir()
+    if not max_age_days or not os.path.isdir(root):
+        return 0
+
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for hive_id in os.listdir(root):
+        for level in range(fine_levels):
+            level_dir = os.path.join(root, hive_id, str(level))
+            if not os.path.isdir(level_dir):
+                continue
+            tile_seconds = level_info(level)['tile_seconds']
+            for name in os.listdir(level_dir):
+                x = name[:-len('.npy')]
+                if x.lstrip('-').isdigit() and (int(x) + 1) * tile_seconds < cutoff:
+                    os.remove(os.path.join(level_dir, name))
+                    removed += 1
+
+    if removed:
+        logger.info(f"Pruned {removed} spectrogram tile(s) older than {max_age_days} days")
+    return removed
+
+def tile_metadata(hive_id):
+    """
+    Describe a hive's pyramid for tile clients
+
+    Tile x of a level starts at epoch second x * tile_seconds; tile y = 0 is
+    the top (highest frequencies) of the band.
+
+    :return: Dictionary with the level geometry and the available x range per level
+    """
+    root = tiles_dir(hive_id)
+    if not os.path.isdir(root):
+        raise FileNotFoundError(root)
+
+    levels = []
+    for level in range(getattr(settings, 'SPECTROGRAM_TILE_LEVELS', DEFAULT_LEVELS)):
+        info = level_info(level)
+        level_dir = os.path.join(root, str(level))
+        xs = [int(name[:-4]) for name in os.listdir(level_dir) if name.endswith('.npy')] if os.path.isdir(level_dir) else []
+        info['x_range'] = [min(xs), max(xs)] if xs else None
+        levels.append(info)
+
+    return {
+        'hive_id': hive_id,
+        'tile_size': TILE_SIZE,
+        'max_frequency': getattr(settings, 'SPECTROGRAM_TILE_MAX_FREQUENCY', DEFAULT_MAX_FREQUENCY),
+        'db_range': list(_db_range()),
+        'levels': levels
+    }
+
+def read_tile(hive_id, level, x, y):
+    """
+    Return the quantized values of one tile, top row = highest frequency
+
+    :return: uint8 array of shape (TILE_SIZE, TILE_SIZE), or None when no
+        audio has been recorded for the tile
+    :raises ValueError: level or y is out of range
+    """
+    info = level_info(level)
+    if not 0 <= level < getattr(settings, 'SPECTROGRAM_TILE_LEVELS', DEFAULT_LEVELS) or not 0 <= y < info['y_tiles']:
+        raise ValueError(f"No tile {level}/{x}/{y}")
+
+    path = _tile_path(hive_id, level, x)
+    if not os.path.exists(path):
+        return None
+    data = np.load(path, mmap_mode='r')
+    band = info['y_tiles'] - 1 - y
+    return np.ascontiguousarray(data[band * TILE_SIZE:(band + 1) * TILE_SIZE][::-1])
+
+@lru_cache(maxsize=4)
+def _tile_lut(cmap='magma'):
+    # Value 0 (no data) is transparent, 1-255 span the colormap
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[1:, :3] = colormap_lut(cmap)[np.linspace(0, 255, 255).astype(np.uint8)]
+    lut[1:, 3] = 255
+    lut.setflags(write=False)
+    return lut
+
+def render_tile(values, image_format='png'):
+    """
+    Encode tile values as an RGBA image with missing data transparent
+
+    :return: Encoded image bytes
+    """
+    return encode_image(Image.fromarray(_tile_lut()[values], 'RGBA'), image_format=image_format)
@@ -16,9 +16,35 @@ urlpatterns = [
     # Spectrogram generation endpoint
     path('spectrogram/', views.generate_spectrogram, name='generate_spectrogram'),
     
+    # Lazily rendered, content-addressed spectrogram images
+    path('spectrograms/<str:key>.<str:image_format>', views.spectrogram_image, name='spectrogram_image'),
+    
     # Analysis results endpoint
     path('analyze/', views.analyze_audio, name='analyze_audio'),
     
+    # Parallel multi-hive recording endpoint
+    path('record-hives/', views.record_hives, name='record_hives'),
+    
+    # Resumable audio uploads from remote capture nodes
+    path('upload/', views.create_upload, name='create_upload'),
+    path('upload/<str:upload_id>/', views.upload_audio, name='upload_audio'),
+    
+    # Per-second hive telemetry for dashboards
+    path('telemetry/', views.telemetry_hives, name='telemetry_hives'),
+    path('telemetry/<str:hive_id>/', views.hive_telemetry, name='hive_telemetry'),
+    
+    # Recording sessions with lightweight previews
+    path('sessions/', views.recording_sessions, name='recording_sessions'),
+    path('previews/<path:path>', views.media_preview, name='media_preview'),
+    path('thumbnails/<path:path>', views.media_thumbnail, name='media_thumbnail'),
+    
+    # Multi-resolution spectrogram tile pyramid
+    path('tiles/<str:hive_id>/', views.spectrogram_tiles, name='spectrogram_tiles'),
+    path('tiles/<str:hive_id>/<int:level>/<int:x>/<int:y>.png', views.spectrogram_tile, name='spectrogram_tile'),
+    
+    # Online per-hive anomaly detector state
+    path('anomalies/', views.hive_anomalies, name='hive_anomalies'),
+    
     # Multi-recording and spectrogram generation endpoint
     path('multi-record/', views.record_and_generate_spectrograms, name='record_and_generate_spectrograms'),
     
@@ -1,21 +1,16 @@
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend before importing pyplot
-
 import os
 import logging
 import numpy as np
-import sounddevice as sd
-import librosa
-import matplotlib.pyplot as plt
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, HttpResponse
+from django.urls import reverse
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.core.files.storage import default_storage
-from scipy.io import wavfile
 import json
-import soundfile as sf
+import hashlib
+import functools
 import re
+import tempfile
 import traceback
 import requests
 import time
@@ -38,23 +33,66 @@ from .blynk_utils import blynk_connection
 # Import Google Sheets utility
 from .sheets_utils import save_frequency_to_sheets
 
+# Import shared acoustic feature engine
+from .audio_features import (
+    compute_file_features, classify_activity, format_frequency_summary, load_audio,
+    decimate_to_bee_band
+)
+
+# Import thread-safe numpy/Pillow spectrogram renderer
+from .spectrogram import render_spectrogram
+from .spectrogram_cache import spectrogram_cache
+
+# Import multi-hive capture
+from .capture import CaptureManager, get_hive_inputs
+
+# Import compressed recording archive
+from .archive_utils import recording_archiver, is_audio_file
+
+# Import narrow-band queen piping pre-detector
+from .piping_detector import detect_piping, candidate_window
+
+# Import cached audio device manager
+from .device_manager import device_manager
+
+# Import pluggable capture backends (hardware, file replay, synthetic)
+from .capture_backends import get_capture_backend
+
+# Import in-memory pipeline data model
+from .pipeline import AudioClip
+
+# Import anytime analysis with early stopping
+from .anytime import anytime_capture, predict_window
+
+# Import streaming upload ingestion for remote capture nodes
+from .ingest import upload_store, ingest_queue, UploadError
+
+# Import per-second hive telemetry
+from .telemetry import query_telemetry, list_telemetry_hives, get_telemetry_fields
+
+# Import online per-hive anomaly detection
+from .anomaly import recording_detector, recording_values, summarize_anomaly_state
+
+# Import media delivery (byte ranges, previews, thumbnails)
+from .media import media_path, file_response, audio_preview, thumbnail, list_recording_sessions
+
+# Import multi-resolution spectrogram tiles
+from .tiles import tile_metadata, read_tile, render_tile, level_info
+
 logger = logging.getLogger(__name__)
 
+# Side-effect-free window scorers used by anytime analysis
+WINDOW_PREDICTORS = {
+    name: functools.partial(predict_window, module.model, preprocess=module.load_and_preprocess_image)
+    for name, module in (('BNQ', BNBpredictor), ('QNQ', QNQpredictor), ('TOOT', TOOTpredictor))
+}
+
 def index(request):
     """
     Render the main index page for bee audio analysis
     """
-    # Get list of available audio input devices
-    devices = sd.query_devices()
-    input_devices = [
-        {
-            'index': i, 
-            'name': device['name'], 
-            'max_input_channels': device['max_input_channels']
-        } 
-        for i, device in enumerate(devices) 
-        if device['max_input_channels'] > 0
-    ]
+    # Get list of available audio input devices of the capture backend
+    input_devices = get_capture_backend().input_devices()
     
     return render(request, 'index.html', {
         'input_devices': input_devices
@@ -71,25 +109,17 @@ def record_audio(request):
         duration = float(request.POST.get('duration', 5))  # seconds
         sample_rate = int(request.POST.get('sample_rate', 44100))  # Hz
         
-        # Record audio from specified device
-        recording = sd.rec(
-            int(duration * sample_rate), 
-            samplerate=sample_rate, 
-            channels=1, 
-            dtype='float64',
-            device=device_index
-        )
-        sd.wait()
-        
-        # Save recording
-        audio_filename = 'bee_recording.wav'
-        audio_path = os.path.join(settings.MEDIA_ROOT, audio_filename)
+        # Record audio from specified device on the configured capture backend
+        recording = get_capture_backend().record(duration, sample_rate, channels=1, device=device_index)
         
-        # Ensure media directory exists
-        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+        # Optionally decimate to the bee band before storage
+        recording, sample_rate = decimate_to_bee_band(recording, sample_rate)
         
-        # Write audio file using scipy
-        wavfile.write(audio_path, sample_rate, (recording * 32767).astype(np.int16))
+        # Save recording in the archive format on the background writer
+        audio_path = recording_archiver.submit(
+            os.path.join(settings.MEDIA_ROOT, 'bee_recording'), recording, sample_rate
+        )
+        audio_filename = os.path.basename(audio_path)
         
         return JsonResponse({
             'status': 'success', 
@@ -110,35 +140,21 @@ def get_audio_devices(request):
     List available audio input devices
     """
     try:
-        import sounddevice as sd
-        
-        # Get the list of all devices
-        all_devices = sd.query_devices()
-        
-        # Get the list of input devices
-        input_devices = [
-            {
-                'index': i, 
-                'name': device['name'], 
-                'max_input_channels': device['max_input_channels']
-            } 
-            for i, device in enumerate(all_devices) 
-            if device['max_input_channels'] > 0
-        ]
+        # Get the list of input devices of the capture backend (cached for hardware)
+        input_devices = get_capture_backend().input_devices()
         
         # Log input devices for debugging
         logger.info(f"Input devices found: {input_devices}")
         
+        # Attach health statistics (opens, failures, stream errors) per device
+        health = device_manager.get_health()
+        for device in input_devices:
+            device['health'] = health.get(device['name'], {})
+        
         return JsonResponse({
             'status': 'success', 
             'devices': input_devices
         })
-    except ImportError as e:
-        logger.error(f"Failed to import sounddevice: {str(e)}")
-        return JsonResponse({
-            'status': 'error', 
-            'message': f'Sounddevice import failed: {str(e)}'
-        }, status=500)
     except Exception as e:
         import traceback
         logger.error(f"Error listing audio devices: {str(e)}")
@@ -185,39 +201,24 @@ def generate_spectrogram(request=None, audio_path=None, predictor_type='BNQ'):
                 'message': 'Audio file not found'
             }, status=404)
         
-        # Generate timestamp for unique filename
-        timestamp = ""
-        
-        # Create spectrogram filename with predictor type
-        spectrogram_filename = f'BeemoDosSpectrogram_{predictor_type}_{timestamp}.png'
-        spectrogram_path = os.path.join(settings.MEDIA_ROOT, spectrogram_filename)
+        # Load audio file at its native sampling rate
+        y, sr = load_audio(audio_path)
+        clip = AudioClip(y, sr)
+        clip.path = audio_path
+        title = f'Spectrogram - {predictor_type}'
         
-        # Load audio file
-        y, sr = librosa.load(audio_path)
-        
-        # Create spectrogram
-        plt.figure(figsize=(12, 8))
-        librosa.display.specshow(
-            librosa.amplitude_to_db(np.abs(librosa.stft(y)), ref=np.max), 
-            sr=sr, 
-            x_axis='time', 
-            y_axis='hz'
-        )
-        plt.colorbar(format='%+2.0f dB')
-        plt.title(f'Spectrogram - {predictor_type}')
-        plt.tight_layout()
-        
-        # Save spectrogram
-        plt.savefig(spectrogram_path)
-        plt.close()
-        
-        # If called from URL route, return JSON response
+        # If called from URL route, return the image URL; it is rendered when first viewed
         if request is not None:
+            spectrogram_url = lazy_spectrogram_url(clip, title, size=(1200, 800))
             return JsonResponse({
                 'status': 'success',
-                'spectrogram_path': spectrogram_filename
+                'spectrogram_path': spectrogram_url.lstrip('/'),
+                'spectrogram_url': spectrogram_url
             })
         
+        # Cached by audio content and render parameters; repeated requests reuse the image
+        spectrogram_path = cached_spectrogram(clip, title, size=(1200, 800))
+        
         # If called programmatically, return spectrogram path
         return spectrogram_path
     
@@ -234,16 +235,80 @@ def generate_spectrogram(request=None, audio_path=None, predictor_type='BNQ'):
         # If called programmatically, return None
         return None
 
+def save_spectrogram(clip, spectrogram_path, title):
+    """
+    Render the spectrogram image of an in-memory clip
+
+    :param clip: AudioClip to render
+    :param spectrogram_path: Destination .png or .webp path
+    :param title: Plot title
+    :return: spectrogram_path
+    """
+    return render_spectrogram(clip.samples, clip.sample_rate, spectrogram_path, title)
+
+def cached_spectrogram(clip, title, size=(1000, 400)):
+    """
+    Return the spectrogram image of an in-memory clip from the
+    content-addressed cache, rendering it only on a miss
+
+    :param clip: AudioClip to render
+    :param title: Plot title
+    :param size: Image (width, height) in pixels
+    :return: Absolute path of the cached PNG
+    """
+    return spectrogram_cache.get_or_render(clip.samples, clip.sample_rate, clip.digest(), title, size)
+
+def cached_spectrograms(items):
+    """
+    Return the spectrogram images of several clips, rendering the misses
+    in parallel on the worker process pool
+
+    :param items: Iterable of (clip, title, size)
+    :return: List of absolute PNG paths, None where rendering failed
+    """
+    return spectrogram_cache.render_batch(items)
+
+def lazy_spectrogram_url(clip, title, size=(1000, 400)):
+    """
+    Register a clip's spectrogram and return its URL without rendering it;
+    the image is rendered by spectrogram_image when first requested
+
+    :param clip: Persisted AudioClip
+    :param title: Plot title
+    :param size: Image (width, height) in pixels
+    :return: URL path of the image
+    """
+    key = spectrogram_cache.register(clip, title, size)
+    return reverse('audio_analyzer:spectrogram_image', args=[key, 'png'])
+
+def resolve_spectrogram_path(path):
+    """
+    Map a lazy spectrogram URL to its image file, rendering it if needed
+
+    :param path: URL or path; anything but a lazy spectrogram URL is returned unchanged
+    :return: Absolute image path for lazy URLs, otherwise path
+    """
+    match = re.search(r'spectrograms/([0-9a-f]{40})\.(png|webp)$', path or '')
+    if not match:
+        return path
+    return spectrogram_cache.render_registered(match.group(1), match.group(2))
+
 @csrf_exempt
 def record_and_generate_spectrograms(request):
     """
     Record audio for multiple predictors and generate spectrograms
+
+    With 'anytime' in the body (or settings.ANYTIME_ANALYSIS), one capture
+    is analyzed window by window while it runs and stops early once the
+    predictors are confident; 'duration' is then the maximum.
     """
     try:
         # Parse request data
         data = json.loads(request.body)
         duration = data.get('duration', 5)  # Default 5 seconds
         device_index = data.get('device_index', None)
+        hive_id = data.get('hive_id', 'default')
+        anytime = data.get('anytime', getattr(settings, 'ANYTIME_ANALYSIS', False))
 
         # Validate inputs
         if not isinstance(duration, (int, float)) or duration <= 0:
@@ -257,15 +322,20 @@ def record_and_generate_spectrograms(request):
         num_recordings = 1
 
         # Prepare storage for recordings and spectrograms
+        clips = {}
         all_recordings = {}
         all_spectrograms = {}
         analysis_results = {}
+        predictor_spectrograms = {}
+        skip_predictors = {}
+        piping_events = []
+        eager_spectrograms = []
 
-        # Create directory for this recording session
-        session_timestamp = ""
+        # Create a directory per request, so concurrent sessions never share audio paths
         recordings_base_dir = os.path.join(settings.MEDIA_ROOT, 'recordings')
-        session_dir = os.path.join(recordings_base_dir, session_timestamp)
-        os.makedirs(session_dir, exist_ok=True)
+        os.makedirs(recordings_base_dir, exist_ok=True)
+        session_dir = tempfile.mkdtemp(prefix=datetime.now().strftime('%Y%m%d_%H%M%S_'), dir=recordings_base_dir)
+        session_timestamp = os.path.basename(session_dir)
 
         # Ensure proper permissions
         os.chmod(session_dir, 0o755)
@@ -294,63 +364,97 @@ def record_and_generate_spectrograms(request):
             print(f"Error listing recording sessions: {dir_list_error}")
             existing_sessions = []
 
+        # Anytime mode: a single capture, stopped once the window predictions settle
+        anytime_result = None
+        if anytime:
+            anytime_result = anytime_capture(
+                {name: WINDOW_PREDICTORS[name] for name in getattr(settings, 'ANYTIME_PREDICTORS', ['BNQ', 'QNQ'])},
+                save_spectrogram,
+                session_dir,
+                max_duration=duration,
+                sample_rate=44100,
+                device=device_index
+            )
+
         # Record and process for each predictor
         for predictor in predictors:
             predictor_recordings = []
-            predictor_spectrograms = []
+            spectrogram_urls = []
 
             for i in range(num_recordings):
                 # Generate unique filenames
-                audio_filename = f'{predictor}_recording_{i+1}.wav'
-                spectrogram_filename = f'{predictor}_spectrogram_{i+1}.png'
+                audio_filename = f'{predictor}_recording_{i+1}'
                 
                 # Full paths with absolute resolution
                 audio_path = os.path.abspath(os.path.join(session_dir, audio_filename))
-                spectrogram_path = os.path.abspath(os.path.join(session_dir, spectrogram_filename))
-
-                # Record audio
-                sample_rate = 44100
-                recording = sd.rec(
-                    int(duration * sample_rate), 
-                    samplerate=sample_rate, 
-                    channels=1, 
-                    dtype='float64',
-                    device=device_index
-                )
-                sd.wait()  # Wait for recording to complete
-
-                # Save audio file
-                sf.write(audio_path, recording, sample_rate)
-                os.chmod(audio_path, 0o644)
-
-                # Generate spectrogram
-                plt.figure(figsize=(10, 4))
-                librosa.display.specshow(
-                    librosa.amplitude_to_db(
-                        np.abs(librosa.stft(recording.flatten())), 
-                        ref=np.max
-                    ), 
-                    sr=sample_rate, 
-                    x_axis='time', 
-                    y_axis='hz'
-                )
-                plt.colorbar(format='%+2.0f dB')
-                plt.title(f'{predictor} Spectrogram')
-                plt.tight_layout()
-                plt.savefig(spectrogram_path)
-                os.chmod(spectrogram_path, 0o644)
-                plt.close()
+
+                if anytime_result is not None and clips:
+                    # The single anytime capture serves every predictor
+                    clip = clips['BNQ']
+                    audio_path = clip.path
+                else:
+                    # Record audio
+                    sample_rate = 44100
+                    if anytime_result is not None:
+                        clip = anytime_result['clip']
+                    else:
+                        recording = get_capture_backend().record(
+                            duration, sample_rate, channels=1, device=device_index
+                        )
+
+                        # Every later stage reads this one float32 buffer
+                        clip = AudioClip(recording, sample_rate, source=predictor)
+
+                    # Skip spectrograms, inference and notifications for broken captures
+                    quality = clip.quality()
+                    if quality['status'] != 'ok':
+                        return JsonResponse({
+                            'status': 'bad_capture',
+                            'message': f"Bad capture: {', '.join(quality['reasons'])}",
+                            'quality': quality
+                        })
+
+                    # Optionally decimate to the bee band before spectrograms and storage
+                    clip = clip.decimate()
+
+                    # Save audio file in the archive format on the background writer
+                    audio_path = clip.persist(audio_path)
+                clips[predictor] = clip
+
+                # Cheap narrow-band pre-detector: the TOOT CNN only runs on the
+                # window around piping candidates, or not at all without any
+                spectrogram_clip = clip
+                if predictor == 'TOOT':
+                    piping_events = detect_piping(clip.samples, clip.sample_rate)
+                    window = candidate_window(piping_events, clip.duration)
+                    if window:
+                        spectrogram_clip = clip.segment(*window)
+                    else:
+                        skip_predictors['TOOT'] = 'No piping candidates detected'
 
                 # Relative paths for frontend
                 rel_audio_path = os.path.relpath(audio_path, settings.MEDIA_ROOT)
-                rel_spectrogram_path = os.path.relpath(spectrogram_path, settings.MEDIA_ROOT)
+
+                # Only the first predictor's image and the TOOT window are read by
+                # the models; the others are rendered lazily when first viewed
+                if predictor == predictors[0] or spectrogram_clip is not clip:
+                    # Content-addressed, so concurrent sessions never collide;
+                    # rendered together on the worker pool after the loop
+                    title = f'{predictor} Spectrogram'
+                    eager_spectrograms.append((spectrogram_clip, title, (1000, 400)))
+                    spectrogram_path = spectrogram_cache.path_for(spectrogram_cache.clip_key(spectrogram_clip, title))
+                    rel_spectrogram_path = os.path.relpath(spectrogram_path, settings.MEDIA_ROOT)
+                    spectrogram_url = f'{settings.MEDIA_URL}{rel_spectrogram_path}'
+                    if spectrogram_clip is not clip:
+                        predictor_spectrograms['TOOT'] = rel_spectrogram_path
+                else:
+                    spectrogram_url = lazy_spectrogram_url(spectrogram_clip, f'{predictor} Spectrogram')
+                    rel_spectrogram_path = spectrogram_url.lstrip('/')
 
                 # Detailed path logging
                 print(f"\nSpectrogram for {predictor}:")
-                print(f"  Full Path: {spectrogram_path}")
                 print(f"  Relative Path: {rel_spectrogram_path}")
-                print(f"  Media URL Path: {settings.MEDIA_URL}{rel_spectrogram_path}")
-                print(f"  File Exists: {os.path.exists(spectrogram_path)}")
+                print(f"  URL Path: {spectrogram_url}")
 
                 # Store recordings and spectrograms
                 predictor_recordings.append({
@@ -358,20 +462,24 @@ def record_and_generate_spectrograms(request):
                     'spectrogram_path': rel_spectrogram_path
                 })
                 
-                # Use full media URL
-                predictor_spectrograms.append(f'{settings.MEDIA_URL}{rel_spectrogram_path}')
+                spectrogram_urls.append(spectrogram_url)
 
             # Store for each predictor
             all_recordings[predictor] = predictor_recordings
-            all_spectrograms[predictor] = predictor_spectrograms
+            all_spectrograms[predictor] = spectrogram_urls
+
+        # Render the images the models read in one batch
+        if None in cached_spectrograms(eager_spectrograms):
+            raise RuntimeError('Spectrogram rendering failed')
 
         # Collect all spectrogram paths for analysis
         all_spectrogram_paths = []
         for predictor, paths in all_spectrograms.items():
             # Convert from media URL to relative path
             for path in paths:
-                rel_path = path.replace(settings.MEDIA_URL, '')
-                all_spectrogram_paths.append(rel_path)
+                # Lazily rendered images are not analyzed
+                if path.startswith(settings.MEDIA_URL):
+                    all_spectrogram_paths.append(path.replace(settings.MEDIA_URL, '', 1))
         
         # Initialize analysis_results with default values
         analysis_results = {
@@ -387,12 +495,17 @@ def record_and_generate_spectrograms(request):
             # Create a mock request with the spectrogram paths in the body
             class MockRequest:
                 method = 'POST'
-                body = json.dumps({'spectrograms': all_spectrogram_paths}).encode('utf-8')
+                body = json.dumps({
+                    'spectrograms': all_spectrogram_paths,
+                    'predictor_spectrograms': predictor_spectrograms,
+                    'skip_predictors': skip_predictors,
+                    'hive_id': hive_id
+                }).encode('utf-8')
             
             # Call analyze_audio
             try:
                 logger.info(f"About to call analyze_audio with paths: {all_spectrogram_paths}")
-                analysis_response = analyze_audio(MockRequest())
+                analysis_response = analyze_audio(MockRequest(), clip=clips.get('BNQ'))
                 logger.info(f"analyze_audio response status: {analysis_response.status_code}")
                 
                 # Debug the response content
@@ -415,6 +528,10 @@ def record_and_generate_spectrograms(request):
             'recordings': all_recordings,
             'spectrograms': all_spectrograms,
             'analysis_results': analysis_results,
+            'piping_events': piping_events,
+            'anytime': {
+                key: anytime_result[key] for key in ('stopped_early', 'windows', 'duration', 'decisions')
+            } if anytime_result else None,
             'debug_info': {
                 'existing_sessions': existing_sessions,
                 'current_session': session_timestamp
@@ -438,8 +555,42 @@ def predictors_view(request):
     """
     return render(request, 'predictors.html')
 
+def find_session_audio(spectrogram_path):
+    """
+    Locate the recording that belongs to a session spectrogram
+
+    :param spectrogram_path: Spectrogram path relative to MEDIA_ROOT,
+        e.g. recordings/20250313_152709/BNQ_spectrogram_1.png
+    :return: Absolute path to the audio file, or None if not found
+    """
+    audio_dir = os.path.dirname(os.path.join(settings.MEDIA_ROOT, spectrogram_path))
+    logger.info(f"Looking for audio files in: {audio_dir}")
+
+    if not os.path.isdir(audio_dir):
+        logger.warning(f"Audio directory not found: {audio_dir}")
+        return None
+
+    # Make sure recordings still being encoded are on disk
+    recording_archiver.flush()
+
+    audio_files = sorted(f for f in os.listdir(audio_dir) if is_audio_file(f))
+    if not audio_files:
+        logger.warning(f"No audio files found in directory: {audio_dir}")
+        return None
+
+    return os.path.join(audio_dir, audio_files[0])
+
 @csrf_exempt
-def analyze_audio(request):
+def analyze_audio(request, clip=None, features=None):
+    """
+    Run the predictors on spectrograms and send notifications
+
+    :param request: POST request with a JSON body listing 'spectrograms'
+    :param clip: Optional in-memory AudioClip of the session; when given,
+        acoustic features come from its buffer instead of the archive file
+    :param features: Optional acoustic features already computed over the
+        whole recording, e.g. when clip is only a window of a long upload
+    """
     try:
         # Ensure Django settings are imported at the top of the function
         from django.conf import settings
@@ -451,6 +602,10 @@ def analyze_audio(request):
         data = json.loads(request.body)
         spectrograms = data.get('spectrograms', [])
 
+        # Optional per-predictor spectrograms and predictors to skip (with reason)
+        predictor_spectrograms = data.get('predictor_spectrograms', {})
+        skip_predictors = data.get('skip_predictors', {})
+
         # Validate input
         if not spectrograms:
             return JsonResponse({'error': 'No spectrograms provided'}, status=400)
@@ -479,9 +634,22 @@ def analyze_audio(request):
 
         # Process each predictor
         for predictor in predictors:
+            if predictor['name'] in skip_predictors:
+                logger.info(f"Skipping {predictor['name']}: {skip_predictors[predictor['name']]}")
+                analysis_results[predictor['name']] = {
+                    'predicted_class': 0,
+                    'confidence': 0.0,
+                    'label': predictor['labels'][0],
+                    'f1_score': 0.0,
+                    'precision': 0.0,
+                    'raw_result': [0, 0.0, 0.0, 0.0],
+                    'skipped': skip_predictors[predictor['name']]
+                }
+                continue
+
             try:
                 # Convert relative path to absolute path if needed
-                spectrogram_path = spectrograms[0]
+                spectrogram_path = predictor_spectrograms.get(predictor['name'], spectrograms[0])
                 if not os.path.isabs(spectrogram_path):
                     spectrogram_path = os.path.join(settings.MEDIA_ROOT, spectrogram_path)
                 
@@ -529,6 +697,39 @@ def analyze_audio(request):
                     'error': str(e)
                 }
 
+        # Compute acoustic features once; Blynk, Discord and the API all read this result
+        frequency_data, frequency_error = None, 'No spectrograms available'
+        try:
+            audio_path = None if clip is not None or features is not None else find_session_audio(spectrograms[0])
+            if features is not None:
+                frequency_data = features
+                logger.info(f"Frequency analysis complete: {frequency_data}")
+            elif clip is not None:
+                # Captured in this process: read the shared buffer, don't wait for the archive
+                frequency_data = clip.features()
+                logger.info(f"Frequency analysis complete: {frequency_data}")
+            elif audio_path:
+                logger.info(f"Using audio file for analysis: {audio_path}")
+                frequency_data = compute_file_features(audio_path)
+                frequency_data['activity_level'] = classify_activity(frequency_data)
+                logger.info(f"Frequency analysis complete: {frequency_data}")
+            else:
+                frequency_error = 'Could not locate audio file'
+        except Exception as e:
+            logger.error(f"Error in frequency analysis: {e}")
+            logger.error(traceback.format_exc())
+            frequency_error = 'Error during analysis'
+
+        # Compare the recording with what is normal for this hive, then learn from it
+        anomalies = []
+        if frequency_data:
+            try:
+                anomalies = recording_detector.update_shared(
+                    data.get('hive_id') or 'default', recording_values(frequency_data)
+                )
+            except Exception as e:
+                logger.error(f"Anomaly detection error: {e}")
+
         # Trigger Blynk event with analysis results
         try:
             # Convert analysis results to native types to ensure JSON serializability
@@ -609,6 +810,7 @@ def analyze_audio(request):
                     toot_result=toot_result,
                     spectrogram_path=spectrograms[0] if spectrograms else None,
                     confidence_levels=confidence_levels,
+                    frequency_data=frequency_data,
                     blynk_connection=active_blynk_connection
                 )
             else:
@@ -665,108 +867,11 @@ def analyze_audio(request):
             # Add recording analysis information
             message += "**Recording Analysis**\n"
             
-            # Try to extract frequency information if available
-            try:
-                # Calculate frequency information from the audio file
-                if spectrograms and len(spectrograms) > 0:
-                    # Get the audio file path from the spectrogram path
-                    spectrogram_path = spectrograms[0]
-                    logger.info(f"Attempting frequency analysis for spectrogram: {spectrogram_path}")
-                    
-                    # Extract session directory from spectrogram path
-                    # Format appears to be: recordings/20250313_152709/BNQ_spectrogram_1.png
-                    match = re.match(r'recordings/(\d+_\d+)/', spectrogram_path)
-                    if match:
-                        session_dir = match.group(1)
-                        audio_dir = os.path.join(settings.MEDIA_ROOT, 'recordings', session_dir)
-                        logger.info(f"Looking for audio files in: {audio_dir}")
-                        
-                        # Look for WAV files in the session directory
-                        if os.path.exists(audio_dir):
-                            audio_files = [f for f in os.listdir(audio_dir) if f.endswith('.wav')]
-                            logger.info(f"Found audio files in {audio_dir}: {audio_files}")
-                            
-                            if audio_files:
-                                # Use the first audio file found
-                                audio_path = os.path.join(audio_dir, audio_files[0])
-                                logger.info(f"Using audio file for analysis: {audio_path}")
-                                
-                                # Load the audio file
-                                sample_rate, samples = wavfile.read(audio_path)
-                                
-                                # Convert stereo to mono if needed
-                                if len(samples.shape) > 1 and samples.shape[1] > 1:
-                                    samples = np.mean(samples, axis=1)
-                                
-                                # Perform FFT
-                                fft_data = np.fft.fft(samples)
-                                frequencies = np.fft.fftfreq(len(samples), 1/sample_rate)
-                                
-                                # Filter out low-frequency noise (below 20 Hz)
-                                MIN_FREQUENCY = 20
-                                mask = np.abs(frequencies) >= MIN_FREQUENCY
-                                filtered_freqs = frequencies[mask]
-                                filtered_fft = np.abs(fft_data[mask])
-                                
-                                # Compute frequency statistics
-                                if len(filtered_freqs) > 0 and len(filtered_fft) > 0:
-                                    # Find the index of the maximum amplitude in the filtered FFT data
-                                    max_idx = np.argmax(filtered_fft)
-                                    peak_freq = filtered_freqs[max_idx]
-                                    avg_freq = np.mean(np.abs(filtered_freqs))
-                                    
-                                    # Compute RMS amplitude for activity classification
-                                    rms_amplitude = np.sqrt(np.mean(samples**2)) / 32768.0
-                                    
-                                    # Classify activity level based on frequency and amplitude
-                                    if avg_freq < 100:
-                                        base_level = "Low"
-                                    elif 100 <= avg_freq <= 300:
-                                        base_level = "Normal"
-                                    elif 300 < avg_freq <= 500:
-                                        base_level = "High"
-                                    else:
-                                        base_level = "Chaotic"
-                                    
-                                    # Amplitude-based refinement
-                                    if rms_amplitude < 0.1:
-                                        activity = f"Very {base_level}"
-                                    elif 0.1 <= rms_amplitude < 0.3:
-                                        activity = f"{base_level}"
-                                    elif 0.3 <= rms_amplitude < 0.6:
-                                        activity = f"Intense {base_level}"
-                                    else:
-                                        activity = f"Extremely {base_level}"
-                                    
-                                    # Add frequency information to the message
-                                    message += "Frequency Data: Average " + str(avg_freq) + "Hz, Peak " + str(peak_freq) + "Hz\n"
-                                    message += "Activity Level: " + activity + " Activity\n"
-                                    
-                                    logger.info(f"Frequency analysis complete: Avg={avg_freq}Hz, Peak={peak_freq}Hz, Activity={activity}")
-                                else:
-                                    logger.warning("No valid frequency data found after filtering")
-                                    message += "Frequency Data: No valid frequency data found\n"
-                                    message += "Activity Level: Unknown\n"
-                            else:
-                                logger.warning(f"No audio files found in directory: {audio_dir}")
-                                message += "Frequency Data: No audio files found\n"
-                                message += "Activity Level: Unknown\n"
-                        else:
-                            logger.warning(f"Audio directory not found: {audio_dir}")
-                            message += "Frequency Data: Audio directory not found\n"
-                            message += "Activity Level: Unknown\n"
-                    else:
-                        logger.warning(f"Could not extract session directory from path: {spectrogram_path}")
-                        message += "Frequency Data: Could not locate audio file\n"
-                        message += "Activity Level: Unknown\n"
-                else:
-                    logger.warning("No spectrograms available for frequency analysis")
-                    message += "Frequency Data: No spectrograms available\n"
-                    message += "Activity Level: Unknown\n"       
-            except Exception as e:
-                logger.error(f"Error in frequency analysis: {e}")
-                logger.error(traceback.format_exc())
-                message += "Frequency Data: Error during analysis\n"
+            # Frequency information comes from the shared feature engine
+            if frequency_data:
+                message += format_frequency_summary(frequency_data)
+            else:
+                message += "Frequency Data: " + frequency_error + "\n"
                 message += "Activity Level: Unknown\n"
             
             # Add interpretation and recommendations based on predictions
@@ -844,14 +949,21 @@ def analyze_audio(request):
 
             # Combine all notification messages
             full_notification_message = "\n\n".join(notification_messages.values())
+            if frequency_data:
+                full_notification_message += "\n\n" + format_frequency_summary(frequency_data)
+            if anomalies:
+                full_notification_message += "\n\n⚠️ Unusual for this hive: " + ", ".join(
+                    f"{anomaly['feature']} {anomaly['direction']} ({anomaly['value']}, z {anomaly['z_score']})"
+                    for anomaly in anomalies
+                )
 
-            # Send the message to Discord
+            # Queue the message for Discord; delivery happens in the background
             discord_result = send_discord_message(full_notification_message, spectrogram_path)
             
             if discord_result:
-                logger.info("Successfully sent analysis results to Discord")
+                logger.info("Queued analysis results for Discord")
             else:
-                logger.warning("Failed to send message to Discord")
+                logger.warning("Failed to queue message for Discord")
         except Exception as discord_error:
             logger.error(f"Error sending Discord notification: {discord_error}")
             logger.error(traceback.format_exc())
@@ -879,7 +991,9 @@ def analyze_audio(request):
             'success': True,
             'recording_count': 1,  # Assuming single recording
             'status': 'Processed successfully',
-            'analysis_results': serializable_results
+            'analysis_results': serializable_results,
+            'frequency_analysis': frequency_data,
+            'anomalies': anomalies
         }
 
         # Log the entire response for verification
@@ -896,6 +1010,47 @@ def analyze_audio(request):
             'error': str(e)
         }, status=500)
 
+def analyze_clip(clip, hive_id=None, features=None):
+    """
+    Run the predictors on a capture that passed the quality gate
+
+    The shared pipeline for captures that are not part of an interactive
+    session (hourly runs, remote uploads): the clip is decimated to the bee
+    band, BNQ and QNQ read its full spectrogram, and the TOOT CNN only
+    reads the window around piping candidates, or is skipped without any.
+
+    :param clip: AudioClip at its capture rate
+    :param hive_id: Hive whose anomaly baseline the recording updates
+    :param features: Optional features of the whole recording the clip was cut from
+    :return: Tuple of (decimated clip, analyze_audio response, piping events)
+    """
+    clip = clip.decimate()
+
+    jobs = [(clip, 'BNQ Spectrogram', (1000, 400))]
+    skip_predictors = {}
+    piping_events = detect_piping(clip.samples, clip.sample_rate)
+    window = candidate_window(piping_events, clip.duration)
+    if window:
+        jobs.append((clip.segment(*window), 'TOOT Spectrogram', (1000, 400)))
+    else:
+        skip_predictors['TOOT'] = 'No piping candidates detected'
+
+    paths = cached_spectrograms(jobs)
+    if None in paths:
+        raise RuntimeError('Spectrogram rendering failed')
+    paths = [os.path.relpath(path, settings.MEDIA_ROOT) for path in paths]
+
+    class MockRequest:
+        method = 'POST'
+        body = json.dumps({
+            'spectrograms': paths[:1],
+            'predictor_spectrograms': {'TOOT': paths[1]} if window else {},
+            'skip_predictors': skip_predictors,
+            'hive_id': hive_id
+        }).encode('utf-8')
+
+    return clip, analyze_audio(MockRequest(), clip=clip, features=features), piping_events
+
 @csrf_exempt
 def retrain_model(request):
     """
@@ -938,6 +1093,12 @@ def retrain_model(request):
             if spectrogram_path.startswith('/media/'):
                 spectrogram_path = spectrogram_path.replace('/media/', '', 1)
 
+            # Lazily rendered images resolve to their cached file
+            try:
+                spectrogram_path = resolve_spectrogram_path(spectrogram_path)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Could not resolve spectrogram {spectrogram_path}: {e}")
+
             # Detailed parameter validation
             errors = []
             if not model_type:
@@ -1061,13 +1222,13 @@ def send_discord_notification(request):
         if image_path and not os.path.exists(image_path):
             return JsonResponse({'success': False, 'error': 'Image file not found'}, status=404)
         
-        # Send to Discord
+        # Queue for Discord; the background notifier handles rate limits
         result = send_discord_message(message, image_path)
         
         if result:
-            return JsonResponse({'success': True})
+            return JsonResponse({'success': True, 'queued': True}, status=202)
         else:
-            return JsonResponse({'success': False, 'error': 'Failed to send message'}, status=500)
+            return JsonResponse({'success': False, 'error': 'Failed to queue message'}, status=500)
     except Exception as e:
         logger.error(f'Error in send_discord_notification: {e}')
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
@@ -1081,8 +1242,8 @@ def test_discord(request):
         logger.info("Testing Discord notification")
         message = "This is a test message from BeemoDos"
         
-        # Send the message to Discord
-        result = send_discord_message(message)
+        # Wait for delivery so the test reports the real outcome
+        result = send_discord_message(message, wait=True)
         
         if result:
             return JsonResponse({'success': True, 'message': 'Discord notification sent successfully'})
@@ -1209,6 +1370,13 @@ def trigger_blynk_event(
                 description="Queen bee tooting detected in Hive 1."
             )
 
+        # Publish acoustic features from the shared feature engine
+        if frequency_data and 'PEAK_FREQUENCY' in VIRTUAL_PINS:
+            blynk_connection.send_string_to_blynk(
+                VIRTUAL_PINS['PEAK_FREQUENCY'],
+                f"{frequency_data['peak_frequency']} Hz ({frequency_data.get('activity_level', 'Unknown')})"
+            )
+
     except Exception as blynk_event_error:
         logger.error(f"Error triggering Blynk event notifications: {blynk_event_error}")
 
@@ -1217,8 +1385,10 @@ def trigger_blynk_event(
 def diagnose_audio_devices():
     """
     Enhanced audio device diagnosis with comprehensive error handling and logging
+
+    Devices come from the cached device manager, so repeated calls do not
+    re-enumerate PortAudio.
     """
-    import sounddevice as sd
     import traceback
     import sys
     
@@ -1227,16 +1397,18 @@ def diagnose_audio_devices():
     logger.info("Platform: %s", sys.platform)
     
     try:
-        # Get all devices from sounddevice
+        # Get all devices from the device cache
         try:
-            all_devices = sd.query_devices()
+            all_devices = device_manager.get_devices()
             logger.info(f"Total devices found: {len(all_devices)}")
             
             # Comprehensive device detection
             detected_devices = []
             usb_input_devices = []
+            device_details = {}
             
-            for i, device in enumerate(all_devices):
+            for device in all_devices:
+                i = device['index']
                 try:
                     # Log details for ALL devices, not just input devices
                     device_info = {
@@ -1253,6 +1425,11 @@ def diagnose_audio_devices():
                     # Still track devices with input channels
                     if device.get('max_input_channels', 0) > 0:
                         detected_devices.append(i)
+                        device_details[i] = {
+                            'index': i,
+                            'name': device_info['name'],
+                            'max_input_channels': device_info['input_channels']
+                        }
                         
                         # Prioritize USB devices
                         if ('usb' in device.get('name', '').lower() or 
@@ -1262,27 +1439,15 @@ def diagnose_audio_devices():
                 except Exception as device_error:
                     logger.error(f"Error processing device {i}: {device_error}")
             
-            # Prioritize USB devices if available
+            # Prioritize USB devices if available (one per hive microphone)
             if usb_input_devices:
                 logger.info(f"Prioritizing USB input devices: {usb_input_devices}")
-                return usb_input_devices, [
-                    {
-                        'index': usb_input_devices[0],
-                        'name': sd.query_devices(usb_input_devices[0])['name'],
-                        'max_input_channels': sd.query_devices(usb_input_devices[0])['max_input_channels']
-                    }
-                ]
+                return usb_input_devices, [device_details[i] for i in usb_input_devices]
             
             # Fallback to all detected input devices
             if detected_devices:
-                logger.info(f"Using first available input device: {detected_devices[0]}")
-                return detected_devices, [
-                    {
-                        'index': detected_devices[0],
-                        'name': sd.query_devices(detected_devices[0])['name'],
-                        'max_input_channels': sd.query_devices(detected_devices[0])['max_input_channels']
-                    }
-                ]
+                logger.info(f"Using available input devices: {detected_devices}")
+                return detected_devices, [device_details[i] for i in detected_devices]
             
             # No devices found
             logger.error("No input devices detected")
@@ -1301,6 +1466,383 @@ def diagnose_audio_devices():
         logger.error(traceback.format_exc())
         return [], []
 
+@csrf_exempt
+def record_hives(request):
+    """
+    Record every configured hive microphone in parallel and analyze each
+
+    Hives come from settings.HIVE_AUDIO_INPUTS, or one hive per detected
+    USB input device. Expects an optional JSON body with 'duration'. Each
+    request gets its own session directory; bad captures are reported with
+    their quality but not stored.
+    """
+    try:
+        data = json.loads(request.body) if request.body else {}
+        duration = data.get('duration', 5)
+
+        if not isinstance(duration, (int, float)) or duration <= 0:
+            return JsonResponse({
+                'status': 'error', 
+                'message': 'Invalid recording duration'
+            }, status=400)
+
+        hive_inputs = get_hive_inputs()
+        if not hive_inputs:
+            return JsonResponse({
+                'status': 'error', 
+                'message': 'No hive audio inputs configured or detected'
+            }, status=400)
+
+        # One callback stream per device, all hives recorded at the same time
+        manager = CaptureManager(hive_inputs, buffer_seconds=max(60, int(duration) + 1))
+        recordings = manager.record(duration)
+
+        # A session directory per request, so concurrent or later requests
+        # never overwrite each other's recordings
+        recordings_dir = os.path.join(settings.MEDIA_ROOT, 'recordings')
+        os.makedirs(recordings_dir, exist_ok=True)
+        session_dir = tempfile.mkdtemp(prefix=datetime.now().strftime('hives_%Y%m%d_%H%M%S_'), dir=recordings_dir)
+        os.chmod(session_dir, 0o755)
+
+        hive_results = {}
+        for hive_id, samples in recordings.items():
+            clip = AudioClip(samples, manager.sample_rate, source=hive_id)
+            quality = clip.quality()
+
+            # Bad captures are reported but, as in hourly runs, never archived or analyzed
+            if quality['status'] != 'ok':
+                hive_results[hive_id] = {
+                    'audio_path': None,
+                    'quality': quality,
+                    'frequency_analysis': None,
+                    'anomalies': []
+                }
+                continue
+
+            # Optionally decimate to the bee band before features and storage
+            clip = clip.decimate()
+            audio_path = clip.persist(os.path.join(session_dir, f'{hive_id}_recording'))
+
+            frequency_data = clip.features()
+
+            # Compare each hive with its own baseline
+            anomalies = []
+            try:
+                anomalies = recording_detector.update_shared(hive_id, recording_values(frequency_data))
+            except Exception as e:
+                logger.error(f"Anomaly detection error for {hive_id}: {e}")
+
+            hive_results[hive_id] = {
+                'audio_path': os.path.relpath(audio_path, settings.MEDIA_ROOT),
+                'quality': quality,
+                'frequency_analysis': frequency_data,
+                'anomalies': anomalies
+            }
+
+        return JsonResponse({
+            'status': 'success',
+            'session': os.path.basename(session_dir),
+            'hives': hive_results,
+            'devices': {
+                str(device): {'channels': capture.channels, 'status_errors': capture.status_errors}
+                for device, capture in manager.devices.items()
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Multi-hive recording error: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JsonResponse({
+            'status': 'error', 
+            'message': str(e)
+        }, status=500)
+
+def _ingest_authorized(request):
+    """
+    Check the bearer token of a capture node when INGEST_API_TOKEN is set
+    """
+    token = getattr(settings, 'INGEST_API_TOKEN', '')
+    if not token:
+        return True
+    return request.headers.get('Authorization', '') == f'Bearer {token}'
+
+def _upload_response(metadata, status=200):
+    response = JsonResponse({'status': 'success', 'upload': metadata}, status=status)
+    response['Upload-Offset'] = str(metadata.get('offset', 0))
+    return response
+
+@csrf_exempt
+def create_upload(request):
+    """
+    Start a resumable audio upload from a remote capture node
+
+    Expects a JSON body with 'hive_id', 'format' ('wav', 'flac' or 'pcm'),
+    an optional 'total_size' in bytes and, for raw PCM, 'sample_rate',
+    'channels' and 'dtype'. Audio is then sent to upload/<upload_id>/.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Only POST requests are allowed'}, status=405)
+    if not _ingest_authorized(request):
+        return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=401)
+
+    try:
+        data = json.loads(request.body) if request.body else {}
+        total_size = data.get('total_size')
+        metadata = upload_store.create(
+            hive_id=data.get('hive_id'),
+            upload_format=str(data.get('format', 'wav')).lower(),
+            total_size=int(total_size) if total_size is not None else None,
+            sample_rate=data.get('sample_rate'),
+            channels=int(data.get('channels', 1)),
+            dtype=data.get('dtype', 'int16')
+        )
+        return _upload_response(metadata, status=201)
+
+    except UploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=e.status)
+    except Exception as e:
+        logger.error(f"Upload creation error: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+@csrf_exempt
+def upload_audio(request, upload_id):
+    """
+    Stream audio into a resumable upload
+
+    GET/HEAD returns the upload status and current offset (also in the
+    'Upload-Offset' header). PUT/PATCH appends the request body at the
+    offset given in the 'Upload-Offset' header; the body is streamed to
+    disk and never read into memory as a whole. Send 'Upload-Complete: 1'
+    (or ?complete=1) with the last chunk to queue the file for analysis.
+    DELETE abandons an unfinished upload.
+    """
+    if not _ingest_authorized(request):
+        return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=401)
+
+    try:
+        if request.method in ('GET', 'HEAD'):
+            return _upload_response(upload_store.get(upload_id))
+
+        if request.method == 'DELETE':
+            upload_store.delete(upload_id)
+            return JsonResponse({'status': 'success', 'message': 'Upload deleted'})
+
+        if request.method not in ('PUT', 'PATCH'):
+            return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+        try:
+            offset = int(request.headers.get('Upload-Offset', 0))
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid Upload-Offset header'}, status=400)
+
+        # Read the WSGI input stream directly instead of request.body
+        upload_store.append(upload_id, offset, request)
+
+        complete = (request.headers.get('Upload-Complete', '').lower() in ('1', 'true') or
+                    request.GET.get('complete') in ('1', 'true'))
+        if not complete:
+            return _upload_response(upload_store.get(upload_id))
+
+        metadata, audio_path = upload_store.complete(upload_id)
+        metadata['queue_position'] = ingest_queue.submit(upload_id, audio_path)
+        return _upload_response(metadata, status=202)
+
+    except UploadError as e:
+        logger.warning(f"Upload {upload_id} rejected: {e}")
+        response = JsonResponse({'status': 'error', 'message': str(e)}, status=e.status)
+        try:
+            response['Upload-Offset'] = str(upload_store.get(upload_id)['offset'])
+        except UploadError:
+            pass
+        return response
+    except Exception as e:
+        logger.error(f"Upload error for {upload_id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def spectrogram_image(request, key, image_format):
+    """
+    Serve a registered spectrogram, rendering it on the first request
+
+    Images are content-addressed and never change, so the key is a strong
+    ETag: If-None-Match is answered with 304 without touching the cache,
+    and responses may be cached by browsers and proxies indefinitely.
+    """
+    if not re.fullmatch(r'[0-9a-f]{40}', key) or image_format not in ('png', 'webp'):
+        return JsonResponse({'status': 'error', 'message': 'Unknown spectrogram'}, status=404)
+
+    etag = f'"{key}.{image_format}"'
+    cache_control = 'public, max-age=31536000, immutable'
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match.strip() == '*' or etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(',')):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    try:
+        image_path = spectrogram_cache.render_registered(key, image_format)
+    except KeyError:
+        return JsonResponse({'status': 'error', 'message': 'Unknown or expired spectrogram'}, status=404)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=410)
+    except Exception as e:
+        logger.error(f"Spectrogram render error for {key}: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    response = FileResponse(open(image_path, 'rb'), content_type=f'image/{image_format}')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+def serve_media(request, path):
+    """
+    Stream a recording or image from MEDIA_ROOT with HTTP Range and
+    conditional request support
+    """
+    try:
+        return file_response(request, media_path(path))
+    except FileNotFoundError:
+        return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+
+def media_preview(request, path):
+    """
+    Serve a cached low-bitrate Ogg Opus preview of a recording
+    """
+    try:
+        source = media_path(path)
+        if not is_audio_file(source):
+            raise FileNotFoundError(path)
+        return file_response(request, audio_preview(source), cache_control='public, max-age=3600')
+    except FileNotFoundError:
+        return JsonResponse({'status': 'error', 'message': 'Recording not found'}, status=404)
+    except Exception as e:
+        logger.error(f"Audio preview error for {path}: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def media_thumbnail(request, path):
+    """
+    Serve a cached WebP spectrogram thumbnail of a recording or spectrogram image
+    """
+    try:
+        return file_response(request, thumbnail(media_path(path)), cache_control='public, max-age=3600')
+    except FileNotFoundError:
+        return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+    except Exception as e:
+        logger.error(f"Thumbnail error for {path}: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def recording_sessions(request):
+    """
+    List recent recording sessions with links to each file, its audio
+    preview and its thumbnail; nothing is generated until requested
+
+    Query parameters: limit (default 20)
+    """
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid limit'}, status=400)
+
+    sessions = list_recording_sessions(limit)
+    for session in sessions:
+        for entry in session['files']:
+            entry['url'] = f"{settings.MEDIA_URL}{entry['path']}"
+            entry['thumbnail_url'] = reverse('audio_analyzer:media_thumbnail', args=[entry['path']])
+            if entry['audio']:
+                entry['preview_url'] = reverse('audio_analyzer:media_preview', args=[entry['path']])
+    return JsonResponse({'status': 'success', 'sessions': sessions})
+
+def spectrogram_tiles(request, hive_id):
+    """
+    Describe a hive's spectrogram tile pyramid: level geometry, frequency
+    and dB range, and the tile columns available per level
+    """
+    try:
+        return JsonResponse(dict(tile_metadata(hive_id), status='success'))
+    except (FileNotFoundError, ValueError):
+        return JsonResponse({'status': 'error', 'message': f'No spectrogram tiles for hive {hive_id}'}, status=404)
+
+def spectrogram_tile(request, hive_id, level, x, y):
+    """
+    Serve one 256x256 spectrogram tile as PNG
+
+    Tile x of a level starts at epoch second x * tile_seconds and y = 0 is
+    the highest frequency band. Missing audio is transparent. Finished
+    tiles are cacheable for a day; the tile still being written is
+    revalidated with its ETag.
+    """
+    try:
+        values = read_tile(hive_id, level, x, y)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+    if values is None:
+        return JsonResponse({'status': 'error', 'message': 'No audio recorded for this tile'}, status=404)
+
+    etag = f'"{hashlib.blake2b(values.tobytes(), digest_size=12).hexdigest()}"'
+    finished = (x + 1) * level_info(level)['tile_seconds'] < time.time() - 60
+    cache_control = 'public, max-age=86400' if finished else 'no-cache'
+    if etag in (tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(render_tile(values), content_type='image/png')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+def telemetry_hives(request):
+    """
+    List the hives with recorded telemetry and the stored fields
+    """
+    return JsonResponse({
+        'status': 'success',
+        'hives': list_telemetry_hives(),
+        'fields': get_telemetry_fields()
+    })
+
+def hive_telemetry(request, hive_id):
+    """
+    Range query over the per-second telemetry of one hive
+
+    Query parameters: 'start' and 'end' as epoch seconds (default: the last
+    hour), 'step' in seconds per point (default 1) and 'max_points'
+    (default settings.TELEMETRY_MAX_POINTS), which coarsens the step so
+    long ranges stay cheap to return and plot.
+    """
+    try:
+        now = int(time.time())
+        end = int(request.GET.get('end', now))
+        start = int(request.GET.get('start', end - 3600))
+        step = int(request.GET.get('step', 1))
+        max_points = int(request.GET.get('max_points', getattr(settings, 'TELEMETRY_MAX_POINTS', 2000)))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'start, end, step and max_points must be integers'}, status=400)
+
+    if end < start or step < 1:
+        return JsonResponse({'status': 'error', 'message': 'Invalid time range'}, status=400)
+
+    try:
+        result = query_telemetry(hive_id, start, end, step, max_points)
+    except (FileNotFoundError, ValueError):
+        return JsonResponse({'status': 'error', 'message': f'No telemetry for hive {hive_id}'}, status=404)
+    except Exception as e:
+        logger.error(f"Telemetry query error for {hive_id}: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    result['status'] = 'success'
+    return JsonResponse(result)
+
+def hive_anomalies(request):
+    """
+    Per-hive baselines, active anomalies and recent anomaly events of the
+    telemetry and recording detectors
+    """
+    return JsonResponse({
+        'status': 'success',
+        'telemetry': summarize_anomaly_state('telemetry'),
+        'recordings': summarize_anomaly_state('recordings')
+    })
+
 def record_and_analyze_audio(request):
     """
     Record audio from the first available input device and analyze it.
@@ -1308,8 +1850,8 @@ def record_and_analyze_audio(request):
     Provides comprehensive error handling and device detection.
     """
     try:
-        # Diagnose available audio devices
-        input_devices, device_details = diagnose_audio_devices()
+        # Diagnose available audio devices on the configured capture backend
+        input_devices, device_details = get_capture_backend().diagnose()
         
         # Check if any input devices are available
         if not input_devices:
@@ -1319,7 +1861,7 @@ def record_and_analyze_audio(request):
                 'status': 'error', 
                 'message': error_message,
                 'diagnostic_info': {
-                    'total_devices': len(sd.query_devices()),
+                    'total_devices': len(device_manager.get_devices()),
                     'input_devices': device_details
                 }
             }, status=400)
@@ -1332,28 +1874,29 @@ def record_and_analyze_audio(request):
         duration = request.POST.get('duration', 5)  # Default 5 seconds
         sample_rate = request.POST.get('sample_rate', 44100)  # Default 44.1 kHz
         
-        # Record audio from specified device
-        recording = sd.rec(
-            int(duration * sample_rate), 
-            samplerate=sample_rate, 
-            channels=1, 
-            dtype='float64',
-            device=device_index
-        )
-        sd.wait()
+        # Record audio from specified device on the configured capture backend
+        recording = get_capture_backend().record(duration, sample_rate, channels=1, device=device_index)
         
-        # Save recording
-        audio_filename = f'bee_recording_{""}.wav'
-        audio_path = os.path.join(settings.MEDIA_ROOT, audio_filename)
+        # Skip frequency analysis and Sheets logging for broken captures
+        clip = AudioClip(recording, sample_rate)
+        quality = clip.quality()
+        if quality['status'] != 'ok':
+            return JsonResponse({
+                'status': 'bad_capture',
+                'message': f"Bad capture: {', '.join(quality['reasons'])}",
+                'device': device_index,
+                'quality': quality
+            })
         
-        # Ensure media directory exists
-        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+        # Optionally decimate to the bee band before analysis and storage
+        clip = clip.decimate()
         
-        # Write audio file using scipy
-        wavfile.write(audio_path, sample_rate, (recording * 32767).astype(np.int16))
+        # Save recording in the archive format on the background writer
+        audio_path = clip.persist(os.path.join(settings.MEDIA_ROOT, f'bee_recording_{""}'))
+        audio_filename = os.path.basename(audio_path)
         
-        # Perform frequency analysis
-        frequency_results = analyze_audio_frequency(audio_path, sample_rate)
+        # Perform frequency analysis on the in-memory buffer
+        frequency_results = analyze_audio_frequency(audio_path, clip.sample_rate, clip=clip)
         
         return JsonResponse({
             'status': 'success', 
@@ -1370,44 +1913,23 @@ def record_and_analyze_audio(request):
             'message': str(e)
         }, status=500)
 
-def analyze_audio_frequency(audio_path, sample_rate):
+def analyze_audio_frequency(audio_path, sample_rate, clip=None):
     """
     Perform frequency analysis on the recorded audio
     
     :param audio_path: Path to the audio file
     :param sample_rate: Sampling rate of the audio
+    :param clip: Optional in-memory AudioClip of the same recording
     :return: Dictionary of frequency analysis results
     """
     try:
-        # Load audio file
-        y, sr = librosa.load(audio_path)
-        
-        # Compute spectral features
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-        spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)[0]
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)[0]
-        
-        # Compute dominant frequency
-        fft = np.fft.fft(y)
-        frequencies = np.fft.fftfreq(len(y), 1/sr)
-        
-        # Filter out low-frequency noise (below 20 Hz)
-        MIN_FREQUENCY = 20
-        mask = np.abs(frequencies) >= MIN_FREQUENCY
-        filtered_freqs = frequencies[mask]
-        filtered_fft = np.abs(fft[mask])
-        
-        # Compute frequency range
-        frequency_range = (np.min(frequencies[frequencies > 0]), np.max(frequencies))
-        
-        # Prepare frequency data for Google Sheets
-        frequency_data = {
-            'dominant_frequency': round(np.max(filtered_freqs), 2),
-            'frequency_range': f"{round(frequency_range[0], 2)} - {round(frequency_range[1], 2)}",
-            'spectral_centroid': round(np.mean(spectral_centroid), 2),
-            'spectral_bandwidth': round(np.mean(spectral_bandwidth), 2),
-            'spectral_rolloff': round(np.mean(spectral_rolloff), 2)
-        }
+        if clip is not None:
+            frequency_data = clip.features()
+        else:
+            # Stream the file in fixed-size blocks at its native rate; one STFT
+            # per block feeds every spectral feature
+            frequency_data = compute_file_features(audio_path)
+            frequency_data['activity_level'] = classify_activity(frequency_data)
         
         # Save frequency data to Google Sheets
         save_frequency_to_sheets(frequency_data)
@@ -99,12 +99,123 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Lightweight media previews, generated on first request under MEDIA_ROOT/previews
+MEDIA_PREVIEW_BITRATE = 24000  # Ogg Opus audio previews, bits per second
+MEDIA_THUMBNAIL_SIZE = (320, 128)  # WebP spectrogram thumbnails, maximum (width, height)
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Machine Learning Model Path
 ML_MODEL_PATH = BASE_DIR / 'ml_models' / 'bee_behavior_model.keras'
 
+# Audio Processing
+# Long recordings are memory-mapped and analysed in blocks of this many seconds
+AUDIO_CHUNK_SECONDS = int(os.environ.get('AUDIO_CHUNK_SECONDS', '10'))
+
+# Optional bee-band front end: decimate captures to this rate (e.g. 8000)
+# right after capture; None keeps the capture rate
+BEE_BAND_SAMPLE_RATE = int(os.environ['BEE_BAND_SAMPLE_RATE']) if os.environ.get('BEE_BAND_SAMPLE_RATE') else None
+
+# Anytime analysis: score sliding windows during capture and stop once every
+# predictor in ANYTIME_PREDICTORS agrees for ANYTIME_STABLE_WINDOWS windows
+# at or above ANYTIME_CONFIDENCE_THRESHOLD; the requested duration becomes the maximum
+ANYTIME_ANALYSIS = os.environ.get('ANYTIME_ANALYSIS', 'false').lower() in ('1', 'true')
+ANYTIME_PREDICTORS = ['BNQ', 'QNQ']
+ANYTIME_WINDOW_SECONDS = float(os.environ.get('ANYTIME_WINDOW_SECONDS', '2.0'))
+ANYTIME_HOP_SECONDS = float(os.environ.get('ANYTIME_HOP_SECONDS', '1.0'))
+ANYTIME_CONFIDENCE_THRESHOLD = float(os.environ.get('ANYTIME_CONFIDENCE_THRESHOLD', '0.9'))
+ANYTIME_STABLE_WINDOWS = int(os.environ.get('ANYTIME_STABLE_WINDOWS', '3'))
+
+# Queen piping pre-detector gating the TOOT CNN (see piping_detector.py)
+PIPING_FUNDAMENTALS = list(range(300, 525, 25))  # Hz
+PIPING_HARMONICS = 2
+PIPING_THRESHOLD_DB = float(os.environ.get('PIPING_THRESHOLD_DB', '12'))
+# Peaks with this much energy (dB relative) at f/2, f/3 or just below f are hum, not piping
+PIPING_GUARD_RATIO_DB = float(os.environ.get('PIPING_GUARD_RATIO_DB', '-3'))
+# Run the detector continuously in run_telemetry
+PIPING_MONITOR = os.environ.get('PIPING_MONITOR', 'true').lower() in ('1', 'true')
+
+# Spectrogram images: 'pillow' (numpy colormap lookup, thread-safe, fast) or
+# 'matplotlib' (legacy librosa specshow renderer, requires matplotlib)
+SPECTROGRAM_RENDERER = os.environ.get('SPECTROGRAM_RENDERER', 'pillow')
+
+# Content-addressed spectrogram cache (audio hash + render parameters) with
+# LRU eviction once it exceeds the size budget
+SPECTROGRAM_CACHE_DIR = MEDIA_ROOT / 'spectrogram_cache'
+SPECTROGRAM_CACHE_MAX_BYTES = int(os.environ.get('SPECTROGRAM_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Worker processes for batch spectrogram rendering (render_spectrograms and
+# multi-image requests); 0 renders in the calling process
+SPECTROGRAM_POOL_WORKERS = int(os.environ.get('SPECTROGRAM_POOL_WORKERS', str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+
+# Capture backend: 'sounddevice' (hardware), 'file' (replay AUDIO_REPLAY_FILES)
+# or 'synthetic' (generated bee sound) for headless runs and load tests
+AUDIO_CAPTURE_BACKEND = os.environ.get('AUDIO_CAPTURE_BACKEND', 'sounddevice')
+AUDIO_REPLAY_FILES = [p for p in os.environ.get('AUDIO_REPLAY_FILES', '').split(',') if p]
+AUDIO_REPLAY_SPEED = float(os.environ.get('AUDIO_REPLAY_SPEED', '1.0'))  # 0 = as fast as possible
+AUDIO_REPLAY_LOOP = True
+AUDIO_SYNTHETIC_DEVICES = int(os.environ.get('AUDIO_SYNTHETIC_DEVICES', '1'))
+AUDIO_SYNTHETIC_OPTIONS = {}  # e.g. {'piping_rate': 0.1} for occasional tooting
+
+# Seconds between background audio device re-enumerations (hotplug detection)
+AUDIO_DEVICE_REFRESH_SECONDS = int(os.environ.get('AUDIO_DEVICE_REFRESH_SECONDS', '30'))
+
+# Hive microphones recorded in parallel, one entry per hive. Several hives
+# may share a multi-channel interface by using different channels, e.g.
+# [{'hive_id': 'hive1', 'device': 2, 'channel': 0},
+#  {'hive_id': 'hive2', 'device': 2, 'channel': 1}]
+# When empty, each detected USB input device is treated as one hive.
+HIVE_AUDIO_INPUTS = []
+
+# Continuous telemetry (manage.py run_telemetry): one-byte quantised summaries
+# per hive in fixed-size ring files, every field (RMS, peak frequency and band
+# energies) every second plus minute means for long ranges. The default 30
+# days is about 18 MB per hive
+TELEMETRY_DIR = BASE_DIR / 'telemetry'
+TELEMETRY_RETENTION_SECONDS = int(os.environ.get('TELEMETRY_RETENTION_SECONDS', str(30 * 86400)))
+TELEMETRY_MAX_POINTS = 2000  # Range queries are averaged down to at most this many points
+
+# Spectrogram tile pyramid built by run_telemetry --tiles: level 0 has one
+# column per 0.25 s and 512 rows up to SPECTROGRAM_TILE_MAX_FREQUENCY (about
+# 180 MB per hive per day); each level halves that. Levels below
+# SPECTROGRAM_TILE_FINE_LEVELS are pruned after the retention period
+SPECTROGRAM_TILES = os.environ.get('SPECTROGRAM_TILES', 'false').lower() in ('1', 'true')
+SPECTROGRAM_TILE_DIR = BASE_DIR / 'spectrogram_tiles'
+SPECTROGRAM_TILE_LEVELS = 14
+SPECTROGRAM_TILE_MAX_FREQUENCY = 4000.0
+SPECTROGRAM_TILE_DB_RANGE = (-100.0, -20.0)
+SPECTROGRAM_TILE_FINE_LEVELS = 6
+SPECTROGRAM_TILE_FINE_RETENTION_DAYS = int(os.environ.get('SPECTROGRAM_TILE_FINE_RETENTION_DAYS', '7'))
+
+# Online anomaly detection: per-hive EWMA mean/variance and P-square quantiles
+# of each acoustic feature. A value is flagged when |z| >= ANOMALY_Z_THRESHOLD
+# and it lies outside the ANOMALY_QUANTILES band. Halflife and warmup are in
+# samples: seconds for telemetry, recordings for the analysis pipeline
+ANOMALY_STATE_DIR = BASE_DIR / 'anomaly_state'
+ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD', '4.0'))
+ANOMALY_QUANTILES = (0.01, 0.99)
+ANOMALY_DETECTORS = {
+    'telemetry': {'halflife': 3600, 'warmup': 600},
+    'recordings': {'halflife': 24, 'warmup': 24},
+}
+# Hive whose recording baseline run_hourly_analysis updates
+HOURLY_HIVE_ID = os.environ.get('HOURLY_HIVE_ID', 'default')
+
+# Remote capture node uploads: size limit and optional bearer token
+INGEST_MAX_UPLOAD_BYTES = int(os.environ.get('INGEST_MAX_UPLOAD_BYTES', str(500 * 1024 * 1024)))
+INGEST_API_TOKEN = os.environ.get('INGEST_API_TOKEN', '')
+
+# Recording archive: 'flac' (lossless), 'opus' (lossy) or 'wav' (uncompressed)
+RECORDING_ARCHIVE_FORMAT = os.environ.get('RECORDING_ARCHIVE_FORMAT', 'flac')
+RECORDING_OPUS_BITRATE = int(os.environ.get('RECORDING_OPUS_BITRATE', '32000'))  # bits per second
+
+# Overrides for the pre-inference capture quality gate (see audio_quality.py)
+CAPTURE_QUALITY_THRESHOLDS = {}
+
+# Delete recording sessions older than this many days (0 keeps them forever)
+RECORDING_RETENTION_DAYS = int(os.environ.get('RECORDING_RETENTION_DAYS', '0'))
+
 # Logging Configuration
 LOGGING = {
     'version': 1,
@@ -139,11 +250,27 @@ LOGGING = {
 # Discord Integration
 DISCORD_BOT_TOKEN = os.environ.get('DISCORD_BOT_TOKEN', 'MTMxMzM0ODk1NzkwODM3MzUxNA.GNgp-A.uQrvCg9yMBvq8zG3oHhKEPqhPJvv3J7Ja0OPPs')
 DISCORD_CHANNEL_ID = int(os.environ.get('DISCORD_CHANNEL_ID', '1311152755276124181'))
+DISCORD_QUEUE_SIZE = 1000  # Messages queued on the background notifier before new ones are refused
+# Spectrogram attached to alerts: 'image' streams the full PNG, 'thumbnail'
+# sends a WebP downscaled to DISCORD_THUMBNAIL_SIZE
+DISCORD_ATTACHMENT = os.environ.get('DISCORD_ATTACHMENT', 'image')
+DISCORD_THUMBNAIL_SIZE = (640, 256)
+
+# Google Sheets rows are appended in the background, one batchUpdate per
+# SHEETS_BATCH_SIZE rows or after SHEETS_FLUSH_SECONDS at the latest
+SHEETS_BATCH_SIZE = 50
+SHEETS_FLUSH_SECONDS = 10
+
+# Durable write-behind spool (SQLite WAL) for outbound rows; drained by a
+# background thread and by `manage.py sync_outbound`
+OUTBOUND_SPOOL_PATH = BASE_DIR / 'outbound_spool.sqlite3'
+OUTBOUND_SPOOL_SYNCHRONOUS = 'FULL'  # 'NORMAL' trades the last commits on power loss for fewer fsyncs
 
 # Blynk Virtual Pin Configurations
 BLYNK_VIRTUAL_PINS = {
     'STATUS': 0,
     'BEE_PREDICTION': 6,
     'QUEEN_BEE_PREDICTION': 7,
-    'TOOTING_PREDICTION': 8
+    'TOOTING_PREDICTION': 8,
+    'PEAK_FREQUENCY': 9
 }
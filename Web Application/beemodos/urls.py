@@ -22,9 +22,11 @@ urlpatterns = [
     
     # Test Discord endpoint
     path('audio_analyzer/test-discord/', audio_analyzer_views.test_discord, name='audio_analyzer_test_discord'),
+    
+    # Recordings and spectrograms, streamed with byte-range support
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:path>", audio_analyzer_views.serve_media, name='media'),
 ]
 
-# Serve media and static files during development
+# Serve static files during development
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,6 +1,15 @@
 import os
+import logging
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'beemodos.settings')
 
 application = get_wsgi_application()
+
+# Only server processes load this module (runserver included), never other
+# management commands: re-queue upload analyses a previous server left unfinished
+try:
+    from audio_analyzer.ingest import ingest_queue
+    ingest_queue.recover()
+except Exception as e:
+    logging.getLogger(__name__).error(f"Failed to recover pending upload analyses: {e}")